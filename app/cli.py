@@ -10,14 +10,27 @@ import time
 import logging
 from typing import Optional
 from pathlib import Path
-from app.services.processor import DocumentProcessor
+from app.services.processor import DocumentProcessor, iter_files, load_checkpoint_results, result_path_key
 from app.services.gdrive import GoogleDriveService
-from app.models import DocumentResult
+from app.models import DocumentResult, DocumentResultList
 from datetime import datetime
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# Extensiones que se buscan al procesar una carpeta local
+LOCAL_FOLDER_EXTENSIONS = (
+    '.pdf', '.docx', '.zip', '.rar', '.cbr', '.7z',
+    '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz',
+    '.xml', '.eml',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tiff', '.tif'
+)
+
 # Cargar variables de entorno desde .env
 load_dotenv()
 
@@ -96,20 +109,8 @@ def process_local_folder(
         # Para el manifest, usaremos el directorio padre como 'folder_path'
         display_path = folder_path.parent
     else:
-        # Si es un directorio, buscar recursivamente
-        pdf_files = list(folder_path.rglob("*.pdf"))
-        docx_files = list(folder_path.rglob("*.docx"))
-        zip_files = list(folder_path.rglob("*.zip"))
-        rar_files = list(folder_path.rglob("*.rar")) + list(folder_path.rglob("*.cbr"))
-        sevenz_files = list(folder_path.rglob("*.7z"))
-        tar_files = list(folder_path.rglob("*.tar")) + list(folder_path.rglob("*.tar.gz")) + list(folder_path.rglob("*.tgz")) + list(folder_path.rglob("*.tar.bz2")) + list(folder_path.rglob("*.tbz2")) + list(folder_path.rglob("*.tar.xz"))
-        xml_files = list(folder_path.rglob("*.xml"))
-        eml_files = list(folder_path.rglob("*.eml"))
-        image_files = (list(folder_path.rglob("*.jpg")) + list(folder_path.rglob("*.jpeg")) +
-                       list(folder_path.rglob("*.png")) + list(folder_path.rglob("*.gif")) +
-                       list(folder_path.rglob("*.webp")) + list(folder_path.rglob("*.bmp")) +
-                       list(folder_path.rglob("*.tiff")) + list(folder_path.rglob("*.tif")))
-        all_files = pdf_files + docx_files + zip_files + rar_files + sevenz_files + tar_files + xml_files + eml_files + image_files
+        # Si es un directorio, buscar recursivamente (un solo recorrido para todas las extensiones)
+        all_files = [Path(p) for p in iter_files(str(folder_path)) if p.endswith(LOCAL_FOLDER_EXTENSIONS)]
         print(f"Encontrados {len(all_files)} archivos en la carpeta para procesar...")
         display_path = folder_path
     
@@ -142,39 +143,40 @@ def process_local_folder(
             except ValueError:
                 result.path = file_path.name
                 
-            results.append(result)
             print(f"✓ Completado: {file_path.name}")
         except Exception as e:
             print(f"✗ Error procesando {file_path}: {e}")
-            results.append({
-                "id": file_path.name,
-                "name": file_path.name,
-                "description": f"Error al procesar: {str(e)}",
-                "type": "pdf" if file_path.suffix == ".pdf" else ("zip" if file_path.suffix in [".zip", ".rar", ".cbr", ".7z", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz"] else "unknown"),
-                "path": str(file_path.relative_to(folder_path)),
-                "metadata": {"error": True}
-            })
+            result = DocumentResult(
+                name=file_path.name,
+                title=file_path.name,  # Usar nombre como título en caso de error
+                description=f"Error al procesar: {str(e)}",
+                type="pdf" if file_path.suffix == ".pdf" else ("zip" if file_path.suffix in [".zip", ".rar", ".cbr", ".7z", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz"] else "unknown"),
+                path=str(file_path.relative_to(display_path)),
+                metadata={"error": True}
+            )
+        results.append(result)
     
-    # Ordenar resultados por ruta
-    results.sort(key=lambda x: x.path or "")
+    # Ordenar resultados por ruta y construir el manifest en la misma pasada
+    results.sort(key=result_path_key)
+    manifest_files = []
+    for r in results:
+        children = r.children
+        manifest_files.append({
+            "file_id": r.file_id,
+            "name": r.name,
+            "type": r.type,
+            "path": r.path,
+            "description": r.description,
+            "metadata": r.metadata,
+            "children_count": len(children) if children else 0
+        })
     
     # Crear manifest
     manifest = {
         "folder_path": str(display_path),
         "processed_at": datetime.now().isoformat(),
-        "total_files": len(results),
-        "files": [
-            {
-                "file_id": r.file_id,
-                "name": r.name,
-                "type": r.type,
-                "path": r.path,
-                "description": r.description,
-                "metadata": r.metadata,
-                "children_count": len(r.children) if r.children else 0
-            }
-            for r in results
-        ]
+        "total_files": len(manifest_files),
+        "files": manifest_files
     }
     
     # Guardar resultado (siempre guardar, con o sin --output)
@@ -184,12 +186,18 @@ def process_local_folder(
         # Guardar automáticamente en /data/result_timestamp.json
         output_path = add_timestamp_to_filename("/data/result.json")
 
+    # Serializar una sola vez (con orjson si está disponible) para stdout y fichero
+    if orjson is not None:
+        manifest_json = orjson.dumps(manifest, option=orjson.OPT_INDENT_2).decode('utf-8')
+    else:
+        manifest_json = json.dumps(manifest, indent=2, ensure_ascii=False)
+
     # Imprimir JSON a stdout
     print("\n" + "="*80)
-    print(json.dumps(manifest, indent=2, ensure_ascii=False))
+    print(manifest_json)
     
     with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(manifest, f, indent=2, ensure_ascii=False)
+        f.write(manifest_json)
     print(f"\n✓ Resultados guardados en: {output_path}")
 
     return manifest
@@ -244,25 +252,16 @@ def process_gdrive_file(
         if file_id:
             file_info = gdrive_service.get_file_info(file_id)
             file_name = file_info.get('name', 'unknown_file')
+            mime_type = file_info.get('mimeType', '')
             print(f"Procesando archivo de Google Drive: {file_name} (ID: {file_id})")
         else:
             # Buscar archivo por nombre en la carpeta
             print(f"Buscando archivo '{file_name}' en la carpeta {folder_id}...")
             folder_contents = gdrive_service.list_folder_contents(folder_id)
             
-            found_file = None
-            for item in folder_contents:
-                # Buscar por nombre exacto o con extensión
-                if (item['name'] == file_name or 
-                    item['name'] == f"{file_name}.pdf" or 
-                            item['name'] == f"{file_name}.zip" or
-                            item['name'] == f"{file_name}.rar" or
-                            item['name'] == f"{file_name}.7z" or
-                            item['name'] == f"{file_name}.tar" or
-                            item['name'] == f"{file_name}.tar.gz" or
-                            item['name'] == f"{file_name}.tgz"):
-                    found_file = item
-                    break
+            # Buscar por nombre exacto o con extensión (nombres candidatos calculados una sola vez)
+            candidates = {f"{file_name}{suffix}" for suffix in DocumentProcessor.FOLDER_SEARCH_SUFFIXES}
+            found_file = next((item for item in folder_contents if item['name'] in candidates), None)
             
             if not found_file:
                 print(f"Error: Archivo '{file_name}' no encontrado en la carpeta {folder_id}")
@@ -270,6 +269,7 @@ def process_gdrive_file(
             
             file_id = found_file['id']
             file_name = found_file['name']
+            mime_type = found_file.get('mimeType', '')
             print(f"Archivo encontrado: {file_name} (ID: {file_id})")
         
         print(f"Configuración: {initial_pages} página(s) inicial(es), {final_pages} página(s) final(es), max_tokens={max_tokens}, temp_vllm={temperature_vllm}, temp_llm={temperature_llm}")
@@ -280,6 +280,7 @@ def process_gdrive_file(
             "folder_id": folder_id,
             "file_id": file_id,
             "file_name": file_name,
+            "mime_type": mime_type,
             "language": language,
             "initial_pages": initial_pages,
             "final_pages": final_pages,
@@ -412,56 +413,27 @@ def retry_failed_files(
             "max_inner_files": max_archive_files
         }
         
-        results = []
-        for file_info in files_to_process:
-            try:
-                result = processor.process_file_from_source(
-                    source_config,
-                    file_id=file_info['id'],
-                    file_name=file_info['name']
-                )
-                result.path = file_info['path']
-                
-                # Verificar si la descripción indica error
-                description = result.description or ""
-                if processor._is_error_description(description):
-                    error_msg = f"Error en descripción: {description}"
-                    checkpoint_service.mark_file_failed(
-                        file_info['id'],
-                        file_info['name'],
-                        error_msg
-                    )
-                    result.description = error_msg
-                    result.metadata = result.metadata or {}
-                    result.metadata["error"] = True
-                else:
-                    # Éxito: remover de fallidos y marcar como procesado
-                    checkpoint_service.mark_file_processed(
-                        file_info['id'],
-                        file_info['name'],
-                        result.model_dump()
-                    )
-                    print(f"✓ Reintento exitoso: {file_info['name']}")
-                
-                results.append(result)
-            except Exception as e:
-                error_msg = f"Error al procesar: {str(e)}"
-                logger.error(f"Error procesando {file_info['name']}: {e}")
-                checkpoint_service.mark_file_failed(
-                    file_info['id'],
-                    file_info['name'],
-                    str(e)
-                )
-                error_result = DocumentResult(
-                    name=file_info['name'],
-                    title=file_info['name'],  # Usar nombre como título en caso de error
-                    description=error_msg,
-                    type=file_info.get('mimeType', 'unknown'),
-                    path=file_info.get('path', ''),
-                    file_id=file_info['id'],
-                    metadata={"error": True}
-                )
-                results.append(error_result)
+        # Mismo pipeline que el procesamiento de carpetas: la descarga de los siguientes archivos se
+        # solapa con la inferencia del actual, y cada archivo pasa por la misma lógica de checkpoint
+        from app.services.manifest import ManifestWriter
+        manifest_writer = ManifestWriter(f"retry-{folder_id}")
+        try:
+            processor._process_files_pipeline(
+                files_to_process, source_config, checkpoint_service,
+                max(1, int(os.getenv("MAX_WORKERS", "1"))), manifest_writer
+            )
+        except BaseException:
+            manifest_writer.close()
+            raise
+        results = list(manifest_writer.read_results())
+        manifest_writer.remove()
+        checkpoint_service.flush_journal()
+        # El manifiesto está en orden de finalización: ordenar por ruta, igual que los resultados de carpetas
+        results.sort(key=result_path_key)
+        
+        for result in results:
+            if not (result.metadata or {}).get("error"):
+                print(f"✓ Reintento exitoso: {result.name}")
         
         # Guardar resultado
         if output:
@@ -577,11 +549,11 @@ def add_missing_files(
             missing_results.append(missing_result)
         
         # Añadir archivos faltantes a los resultados existentes
-        existing_results = [DocumentResult(**r) for r in results_data.get("results", [])]
+        existing_results = DocumentResultList.validate_python(results_data.get("results", []))
         all_results = existing_results + missing_results
         
         # Ordenar por path
-        all_results.sort(key=lambda x: x.path or "")
+        all_results.sort(key=result_path_key)
         
         # Crear nuevo results.json
         updated_results = {
@@ -652,17 +624,9 @@ def checkpoint_to_results(
         
         # Obtener resultados procesados
         processed_results = checkpoint_service.get_results()
-        results = []
         
         # Convertir resultados procesados a DocumentResult
-        for prev_result in processed_results:
-            result_data = prev_result.get("result", {})
-            if isinstance(result_data, dict):
-                try:
-                    doc_result = DocumentResult(**result_data)
-                    results.append(doc_result)
-                except Exception as e:
-                    logger.warning(f"Error cargando resultado previo: {e}")
+        results = load_checkpoint_results(processed_results)
         
         # Obtener todos los archivos para buscar paths (si Google Drive está disponible)
         all_files_dict = {}
@@ -798,7 +762,7 @@ def checkpoint_to_results(
                 ))
 
         # Ordenar resultados por path
-        results.sort(key=lambda x: x.path or "")
+        results.sort(key=result_path_key)
 
         # Guardar resultado
         if output:
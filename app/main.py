@@ -33,6 +33,11 @@ app = FastAPI(title="Summarizer Service", version="0.2.0")
 templates = Jinja2Templates(directory="app/templates")
 processor = DocumentProcessor()
 
+@app.on_event("shutdown")
+def shutdown_processor():
+    """Cierra el pool de renderizado del procesador al parar el servicio"""
+    processor.shutdown()
+
 # Ruta base del proyecto
 BASE_DIR = Path(__file__).parent.parent
 
@@ -42,7 +47,7 @@ try:
     if os.getenv("GOOGLE_DRIVE_ENABLED", "true").lower() == "true":
         gdrive_service = GoogleDriveService()
 except Exception as e:
-    print(f"Warning: No se pudo inicializar Google Drive Service: {e}")
+    logger.warning("No se pudo inicializar Google Drive Service: %s", e)
     gdrive_service = None
 
 @app.get("/favicon.ico")
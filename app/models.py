@@ -1,5 +1,5 @@
 from typing import List, Optional, Literal, Union, Dict, Any
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 from datetime import datetime
 
 class SourceConfig(BaseModel):
@@ -52,6 +52,9 @@ class DocumentResult(BaseModel):
     file_id: Optional[str] = None  # ID del archivo en Google Drive (si aplica, para mode = "gdrive")
     children: Optional[List['DocumentResult']] = None
     metadata: Optional[Dict[str, Any]] = None
+
+# Valida una lista completa de resultados en una sola llamada (p.ej. al cargar un checkpoint grande)
+DocumentResultList = TypeAdapter(List[DocumentResult])
  
 class ProcessFolderResponse(BaseModel):
     folder_id: str
@@ -1,19 +1,37 @@
 """
 Servicio de checkpoint para modo desatendido
 Guarda el estado del procesamiento para poder retomar desde donde se quedó
+
+Cada archivo terminado se registra en un diario SQLite en modo WAL (<checkpoint>.journal.sqlite3),
+en transacciones de CHECKPOINT_JOURNAL_BATCH archivos (por defecto, los de un batch). El JSON completo solo se reescribe cada CHECKPOINT_INTERVAL
+segundos o cada CHECKPOINT_FLUSH_EVERY archivos, y al cargar un checkpoint se reaplican las entradas
+del diario que aún no estaban en el JSON.
 """
 import os
 import json
+import sqlite3
 import threading
 import time
-from typing import Dict, List, Set, Optional
+from typing import Dict, List, Set, Optional, Tuple
 from pathlib import Path
 from datetime import datetime
 import logging
 
+try:
+    import orjson  # Serializa el checkpoint completo bastante más rápido que json
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 
+def _dump_checkpoint(data: Dict) -> bytes:
+    """Serializa el checkpoint a bytes UTF-8 de una vez (un solo write en lugar de uno por fragmento)"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS, default=str)
+    return json.dumps(data, indent=2, ensure_ascii=False, default=str).encode('utf-8')
+
+
 class CheckpointService:
     """Servicio para gestionar checkpoints de procesamiento"""
     
@@ -36,9 +54,23 @@ class CheckpointService:
         self.checkpoint_data: Dict = {}
         self.last_save_time = time.time()
         self.checkpoint_interval = int(os.getenv("CHECKPOINT_INTERVAL", "60"))
+        self.flush_every = int(os.getenv("CHECKPOINT_FLUSH_EVERY", "50"))
+        self.fsync_log = os.getenv("CHECKPOINT_FSYNC", "false").lower() == "true"
+        # Archivos por transacción del diario (al caer el proceso se reprocesan como mucho estos)
+        self.journal_batch = max(1, int(os.getenv("CHECKPOINT_JOURNAL_BATCH", os.getenv("BATCH_SIZE", "1"))))
+        
+        # Índices en memoria para no recorrer las listas del JSON en cada archivo
+        self._processed_ids: Set[str] = set()
+        self._failed_ids: Set[str] = set()
+        # Posición de cada file_id en "results", para reemplazar en lugar de duplicar
+        self._result_index: Dict[str, int] = {}
+        # Diario de archivos terminados desde el último guardado completo
+        self._journal: Optional[sqlite3.Connection] = None
+        self._journal_buffer: List[Tuple[str, str]] = []
+        self._unsaved_count = 0
         
         logger.info(f"CheckpointService inicializado. Directorio: {self.checkpoint_dir}")
-        logger.info(f"Intervalo de guardado: {self.checkpoint_interval} segundos")
+        logger.info(f"Intervalo de guardado: {self.checkpoint_interval} segundos o {self.flush_every} archivos")
     
     def start_checkpoint(self, folder_id: str, folder_name: str, total_files: int, config: Dict) -> str:
         """
@@ -112,6 +144,9 @@ class CheckpointService:
                 "config": config,
                 "status": "in_progress"
             }
+            with self.lock:
+                self._close_log()
+                self._rebuild_indexes()
             self._save_checkpoint()
             return self.current_checkpoint
     
@@ -139,25 +174,187 @@ class CheckpointService:
         try:
             with open(self.current_checkpoint, 'r', encoding='utf-8') as f:
                 self.checkpoint_data = json.load(f)
-            logger.info(f"Checkpoint cargado: {len(self.checkpoint_data.get('processed_files', []))} archivos procesados")
         except Exception as e:
             logger.error(f"Error cargando checkpoint: {e}")
             self.checkpoint_data = {}
+        
+        with self.lock:
+            self._close_log()
+            self._rebuild_indexes()
+            replayed = self._replay_log()
+        if replayed:
+            # Consolidar en el JSON lo recuperado del diario
+            logger.info(f"Recuperados {replayed} archivos del diario del checkpoint")
+            self._save_checkpoint()
+        logger.info(f"Checkpoint cargado: {len(self.checkpoint_data.get('processed_files', []))} archivos procesados")
     
     def _save_checkpoint(self):
-        """Guarda el checkpoint al archivo"""
+        """Guarda el checkpoint completo al archivo y vacía el diario"""
         if not self.current_checkpoint:
             return
         
         try:
             with self.lock:
+                self._prune_pending()
                 self.checkpoint_data["last_updated"] = datetime.now().isoformat()
-                with open(self.current_checkpoint, 'w', encoding='utf-8') as f:
-                    json.dump(self.checkpoint_data, f, indent=2, ensure_ascii=False, default=str)
+                # Escribir a un temporal y renombrar: una caída a mitad no deja el JSON corrupto
+                tmp_path = f"{self.current_checkpoint}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(_dump_checkpoint(self.checkpoint_data))
+                    if self.fsync_log:
+                        f.flush()
+                        os.fsync(f.fileno())
+                os.replace(tmp_path, self.current_checkpoint)
+                # El JSON recién renombrado ya incluye todas las entradas del diario, también las que seguían
+                # en _journal_buffer sin escribir: descartarlas no pierde nada
+                self._journal_buffer.clear()
+                if self._journal is not None:
+                    self._journal.execute("DELETE FROM journal")
+                    self._journal.commit()
+                else:
+                    self._remove_journal_files()
+                self._unsaved_count = 0
                 self.last_save_time = time.time()
         except Exception as e:
             logger.error(f"Error guardando checkpoint: {e}")
     
+    def _journal_path(self) -> str:
+        """Ruta del diario del checkpoint actual (no coincide con el patrón checkpoint_*.json)"""
+        return f"{self.current_checkpoint}.journal.sqlite3"
+    
+    def _open_journal(self) -> sqlite3.Connection:
+        """Abre (o crea) el diario SQLite del checkpoint actual (llamar con el lock tomado)"""
+        if self._journal is None:
+            conn = sqlite3.connect(self._journal_path(), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # NORMAL sobrevive a una caída del proceso; FULL también a un corte de luz
+            conn.execute(f"PRAGMA synchronous={'FULL' if self.fsync_log else 'NORMAL'}")
+            conn.execute("CREATE TABLE IF NOT EXISTS journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, event TEXT NOT NULL, entry TEXT NOT NULL)")
+            conn.commit()
+            self._journal = conn
+        return self._journal
+    
+    def _close_log(self):
+        """Escribe lo pendiente y cierra el diario abierto (llamar con el lock tomado)"""
+        if self._journal is not None:
+            self._flush_journal_buffer()
+            self._journal.close()
+            self._journal = None
+    
+    def _remove_journal_files(self):
+        """Borra el diario y los ficheros auxiliares del WAL (llamar con el lock tomado y el diario cerrado)"""
+        journal_path = self._journal_path()
+        for path in (journal_path, f"{journal_path}-wal", f"{journal_path}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def _append_log(self, event: str, entry: Dict):
+        """Registra un archivo terminado en el diario, en una transacción cada journal_batch archivos (llamar con el lock tomado)"""
+        try:
+            self._open_journal()
+        except sqlite3.Error as e:
+            logger.error(f"Error abriendo diario de checkpoint: {e}")
+            return
+        self._journal_buffer.append((event, json.dumps(entry, ensure_ascii=False, default=str)))
+        self._unsaved_count += 1
+        if len(self._journal_buffer) >= self.journal_batch:
+            self._flush_journal_buffer()
+    
+    def _flush_journal_buffer(self):
+        """Escribe en una sola transacción las entradas pendientes del diario (llamar con el lock tomado)"""
+        if not self._journal_buffer:
+            return
+        try:
+            self._journal.executemany("INSERT INTO journal (event, entry) VALUES (?, ?)", self._journal_buffer)
+            self._journal.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error escribiendo diario de checkpoint: {e}")
+        self._journal_buffer.clear()
+    
+    def flush_journal(self):
+        """Escribe en el diario los archivos terminados que aún estaban en memoria (p.ej. al cerrar un batch)"""
+        with self.lock:
+            if self._journal is not None:
+                self._flush_journal_buffer()
+    
+    def _replay_log(self) -> int:
+        """Reaplica las entradas del diario sobre checkpoint_data (llamar con el lock tomado)"""
+        if not os.path.exists(self._journal_path()):
+            return 0
+        
+        try:
+            rows = self._open_journal().execute("SELECT event, entry FROM journal ORDER BY seq").fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Error leyendo diario de checkpoint: {e}")
+            return 0
+        
+        replayed = 0
+        for event, entry in rows:
+            if event == "processed":
+                self._apply_processed(json.loads(entry))
+            elif event == "failed":
+                self._apply_failed(json.loads(entry))
+            else:
+                continue
+            replayed += 1
+        return replayed
+    
+    def _rebuild_indexes(self):
+        """Reconstruye los índices en memoria a partir de checkpoint_data"""
+        self._processed_ids = set(self.checkpoint_data.get("processed_files", []))
+        self._failed_ids = {f.get("file_id") for f in self.checkpoint_data.get("failed_files", [])}
+        self._result_index = {r.get("file_id"): i for i, r in enumerate(self.checkpoint_data.get("results", []))}
+        self._unsaved_count = 0
+    
+    def _prune_pending(self):
+        """Quita de pendientes los archivos ya procesados o fallidos (llamar con el lock tomado)"""
+        pending = self.checkpoint_data.get("pending_files")
+        if pending:
+            self.checkpoint_data["pending_files"] = [
+                f for f in pending if f not in self._processed_ids and f not in self._failed_ids
+            ]
+    
+    def _apply_processed(self, entry: Dict):
+        """Registra en memoria un archivo procesado (llamar con el lock tomado)"""
+        file_id = entry["file_id"]
+        # Agregar a procesados
+        if file_id not in self._processed_ids:
+            self._processed_ids.add(file_id)
+            self.checkpoint_data.setdefault("processed_files", []).append(file_id)
+        
+        # Remover de fallidos si estaba ahí (los pendientes se depuran al guardar)
+        if file_id in self._failed_ids:
+            self._failed_ids.discard(file_id)
+            self.checkpoint_data["failed_files"] = [
+                f for f in self.checkpoint_data.get("failed_files", []) if f.get("file_id") != file_id
+            ]
+        
+        # Agregar resultado, o reemplazar el anterior del mismo archivo: al reaplicar el diario tras una
+        # caída entre el guardado del JSON y el vaciado del diario, la entrada ya puede estar en el JSON
+        results = self.checkpoint_data.setdefault("results", [])
+        index = self._result_index.get(file_id)
+        if index is None:
+            self._result_index[file_id] = len(results)
+            results.append(entry)
+        else:
+            results[index] = entry
+    
+    def _apply_failed(self, entry: Dict):
+        """Registra en memoria un archivo fallido (llamar con el lock tomado)"""
+        file_id = entry["file_id"]
+        # Remover de procesados si estaba ahí
+        if file_id in self._processed_ids:
+            self._processed_ids.discard(file_id)
+            self.checkpoint_data["processed_files"].remove(file_id)
+        
+        # Agregar a fallidos, evitando duplicados
+        failed_files = self.checkpoint_data.setdefault("failed_files", [])
+        if file_id in self._failed_ids:
+            failed_files = [f for f in failed_files if f.get("file_id") != file_id]
+            self.checkpoint_data["failed_files"] = failed_files
+        self._failed_ids.add(file_id)
+        failed_files.append(entry)
+    
     def mark_file_processed(self, file_id: str, file_name: str, result: Dict):
         """
         Marca un archivo como procesado exitosamente
@@ -167,27 +364,15 @@ class CheckpointService:
             file_name: Nombre del archivo
             result: Resultado del procesamiento
         """
+        entry = {
+            "file_id": file_id,
+            "file_name": file_name,
+            "result": result,
+            "processed_at": datetime.now().isoformat()
+        }
         with self.lock:
-            # Agregar a procesados
-            if file_id not in self.checkpoint_data.get("processed_files", []):
-                self.checkpoint_data.setdefault("processed_files", []).append(file_id)
-            
-            # Remover de pendientes
-            if file_id in self.checkpoint_data.get("pending_files", []):
-                self.checkpoint_data["pending_files"].remove(file_id)
-            
-            # Remover de fallidos si estaba ahí
-            failed_files = self.checkpoint_data.get("failed_files", [])
-            failed_files = [f for f in failed_files if f.get("file_id") != file_id]
-            self.checkpoint_data["failed_files"] = failed_files
-            
-            # Agregar resultado
-            self.checkpoint_data.setdefault("results", []).append({
-                "file_id": file_id,
-                "file_name": file_name,
-                "result": result,
-                "processed_at": datetime.now().isoformat()
-            })
+            self._apply_processed(entry)
+            self._append_log("processed", entry)
         
         # Guardar periódicamente
         self._auto_save()
@@ -201,26 +386,15 @@ class CheckpointService:
             file_name: Nombre del archivo
             error: Mensaje de error
         """
+        entry = {
+            "file_id": file_id,
+            "file_name": file_name,
+            "error": error,
+            "failed_at": datetime.now().isoformat()
+        }
         with self.lock:
-            # Remover de procesados si estaba ahí
-            if file_id in self.checkpoint_data.get("processed_files", []):
-                self.checkpoint_data["processed_files"].remove(file_id)
-            
-            # Remover de pendientes
-            if file_id in self.checkpoint_data.get("pending_files", []):
-                self.checkpoint_data["pending_files"].remove(file_id)
-            
-            # Agregar a fallidos
-            failed_files = self.checkpoint_data.get("failed_files", [])
-            # Evitar duplicados
-            failed_files = [f for f in failed_files if f.get("file_id") != file_id]
-            failed_files.append({
-                "file_id": file_id,
-                "file_name": file_name,
-                "error": error,
-                "failed_at": datetime.now().isoformat()
-            })
-            self.checkpoint_data["failed_files"] = failed_files
+            self._apply_failed(entry)
+            self._append_log("failed", entry)
         
         # Guardar periódicamente
         self._auto_save()
@@ -234,27 +408,41 @@ class CheckpointService:
         
         self._auto_save()
     
+    def set_pending_files(self, file_ids: List[str]):
+        """Reemplaza la lista de pendientes y guarda el checkpoint"""
+        with self.lock:
+            self.checkpoint_data["pending_files"] = list(file_ids)
+        
+        self._save_checkpoint()
+    
     def get_processed_files(self) -> Set[str]:
         """Retorna el conjunto de archivos ya procesados"""
-        return set(self.checkpoint_data.get("processed_files", []))
+        with self.lock:
+            return set(self._processed_ids)
     
     def get_pending_files(self) -> List[str]:
         """Retorna la lista de archivos pendientes"""
-        return self.checkpoint_data.get("pending_files", [])
+        with self.lock:
+            self._prune_pending()
+            return list(self.checkpoint_data.get("pending_files", []))
     
     def get_failed_files(self) -> List[Dict]:
-        """Retorna la lista de archivos fallidos"""
-        return self.checkpoint_data.get("failed_files", [])
+        """Retorna la lista de archivos fallidos (copia: los workers siguen modificando la original)"""
+        with self.lock:
+            return list(self.checkpoint_data.get("failed_files", []))
     
     def get_results(self) -> List[Dict]:
-        """Retorna los resultados procesados"""
-        return self.checkpoint_data.get("results", [])
+        """Retorna los resultados procesados (copia: los workers siguen modificando la original)"""
+        with self.lock:
+            return list(self.checkpoint_data.get("results", []))
     
     def get_progress(self) -> Dict:
         """Retorna información del progreso"""
-        processed = len(self.checkpoint_data.get("processed_files", []))
-        failed = len(self.checkpoint_data.get("failed_files", []))
-        total = self.checkpoint_data.get("total_files", 0)
+        with self.lock:
+            processed = len(self._processed_ids)
+            failed = len(self._failed_ids)
+            total = self.checkpoint_data.get("total_files", 0)
+            last_updated = self.checkpoint_data.get("last_updated")
         pending = total - processed - failed
         
         return {
@@ -264,14 +452,20 @@ class CheckpointService:
             "pending": pending,
             "progress_percent": (processed / total * 100) if total > 0 else 0,
             "checkpoint_file": self.current_checkpoint,
-            "last_updated": self.checkpoint_data.get("last_updated")
+            "last_updated": last_updated
         }
     
     def _auto_save(self):
-        """Guarda automáticamente si ha pasado el intervalo"""
-        current_time = time.time()
-        if current_time - self.last_save_time >= self.checkpoint_interval:
-            self._save_checkpoint()
+        """Guarda el JSON completo si ha pasado el intervalo o se acumularon flush_every archivos en el diario"""
+        # Con varios workers, solo el primero que detecta el intervalo vencido guarda
+        with self.lock:
+            current_time = time.time()
+            due_by_count = self.flush_every > 0 and self._unsaved_count >= self.flush_every
+            if not due_by_count and current_time - self.last_save_time < self.checkpoint_interval:
+                return
+            self.last_save_time = current_time
+            self._unsaved_count = 0
+        self._save_checkpoint()
     
     def finalize(self, status: str = "completed"):
         """Finaliza el checkpoint"""
@@ -279,6 +473,9 @@ class CheckpointService:
             self.checkpoint_data["status"] = status
             self.checkpoint_data["completed_at"] = datetime.now().isoformat()
         self._save_checkpoint()
+        with self.lock:
+            self._close_log()
+            self._remove_journal_files()
         logger.info(f"Checkpoint finalizado con estado: {status}")
         logger.info(f"Archivo de checkpoint: {self.current_checkpoint}")
     
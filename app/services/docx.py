@@ -5,18 +5,29 @@ import shutil
 import signal
 import subprocess
 import tempfile
-from typing import List
+from typing import List, Optional
+from PIL import Image
+import logging
 
+logger = logging.getLogger(__name__)
 
 class DOCXProcessor:
-    def convert_to_images(self, docx_path: str, output_folder: str, initial_pages: int = 2, final_pages: int = 2) -> List[str]:
-        """Convierte las primeras N y últimas M páginas del DOCX/DOC/ODT a imágenes
+    def __init__(self, scratch_dir: Optional[str] = None):
+        """
+        Args:
+            scratch_dir: Directorio donde crear los perfiles temporales de LibreOffice.
+                         Si es None, usa el directorio temporal del sistema
+        """
+        self.scratch_dir = scratch_dir
+
+    def convert_to_images(self, docx_path: str, output_folder: str, initial_pages: int = 2, final_pages: int = 2) -> List[Image.Image]:
+        """Convierte las primeras N y últimas M páginas del DOCX/DOC/ODT a imágenes en memoria (PIL)
 
         Primero convierte DOCX/DOC/ODT a PDF usando LibreOffice, luego PDF a imágenes (igual que PDFs)
 
         Args:
             docx_path: Ruta al archivo DOCX, DOC o ODT
-            output_folder: Carpeta donde guardar las imágenes
+            output_folder: Carpeta de trabajo donde LibreOffice genera el PDF intermedio
             initial_pages: Número de páginas iniciales a procesar (default: 2)
             final_pages: Número de páginas finales a procesar (default: 2)
         """
@@ -32,7 +43,7 @@ class DOCXProcessor:
             # Isolated user profile per conversion to prevent lock file conflicts.
             # Without this, a timed-out soffice.bin leaves a lock on the shared
             # profile, causing all subsequent conversions to hang.
-            lo_profile_dir = tempfile.mkdtemp(prefix="lo_profile_")
+            lo_profile_dir = tempfile.mkdtemp(prefix="lo_profile_", dir=self.scratch_dir)
 
             proc = subprocess.Popen(
                 [
@@ -62,12 +73,12 @@ class DOCXProcessor:
                     pass
                 proc.kill()
                 proc.wait()
-                print(f"LibreOffice timed out converting {docx_path}")
+                logger.error("LibreOffice timed out converting %s", docx_path)
                 return []
 
             # Verificar si la conversión fue exitosa
             if proc.returncode != 0:
-                print(f"Error converting document to PDF: {stderr}")
+                logger.error("Error converting document to PDF: %s", stderr)
                 return []
 
             # Verificar que el PDF se haya generado
@@ -79,7 +90,7 @@ class DOCXProcessor:
                     pdf_files.sort(key=lambda x: os.path.getmtime(os.path.join(output_folder, x)), reverse=True)
                     temp_pdf = os.path.join(output_folder, pdf_files[0])
                 else:
-                    print(f"Error: No se pudo convertir documento a PDF: {docx_path}")
+                    logger.error("Error: No se pudo convertir documento a PDF: %s", docx_path)
                     return []
 
             # Obtener número total de páginas del PDF generado
@@ -88,25 +99,16 @@ class DOCXProcessor:
 
             # Procesar páginas iniciales
             if total_pages >= 1 and initial_pages > 0:
-                first_batch = convert_from_path(temp_pdf, first_page=1, last_page=min(initial_pages, total_pages))
-                for i, img in enumerate(first_batch):
-                    path = os.path.join(output_folder, f"page_{i+1}.jpg")
-                    img.save(path, "JPEG")
-                    images.append(path)
+                images.extend(convert_from_path(temp_pdf, first_page=1, last_page=min(initial_pages, total_pages)))
 
             # Procesar páginas finales (si hay suficientes páginas y no se solapan con las iniciales)
             if total_pages > initial_pages and final_pages > 0:
                 last_start = max(initial_pages + 1, total_pages - final_pages + 1)
-                last_batch = convert_from_path(temp_pdf, first_page=last_start, last_page=total_pages)
-                for i, img in enumerate(last_batch):
-                    page_num = last_start + i
-                    path = os.path.join(output_folder, f"page_{page_num}.jpg")
-                    img.save(path, "JPEG")
-                    images.append(path)
+                images.extend(convert_from_path(temp_pdf, first_page=last_start, last_page=total_pages))
 
             return images
         except Exception as e:
-            print(f"Error processing document {docx_path}: {e}")
+            logger.error("Error processing document %s: %s", docx_path, e)
             return []
         finally:
             # Limpiar PDF temporal si existe
@@ -1,10 +1,12 @@
 import os
 import io
+import re
 import pickle
 import time
 import ssl
 import logging
-from typing import List, Dict, Optional
+import threading
+from typing import List, Dict, Optional, Iterable
 from google.oauth2.credentials import Credentials
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
@@ -12,15 +14,31 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 from googleapiclient.errors import HttpError
+import google_auth_httplib2
+import httplib2
 
 # Scopes necesarios para Google Drive
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 
 logger = logging.getLogger(__name__)
 
+# Errores de descarga que pueden resolverse con reintentos (el mensaje se compara en minúsculas, en una pasada)
+_RETRYABLE_ERROR_RE = re.compile(
+    r"ssl|record layer failure|connection|timeout|network|broken pipe"
+    # Límites de cuota de la API con varias descargas concurrentes
+    r"|rate limit|ratelimitexceeded|too many requests|backend error"
+)
+
 class GoogleDriveService:
     def __init__(self):
         self.service = None
+        self.credentials = None
+        # httplib2.Http no es thread-safe: cada hilo de descarga usa su propia conexión autorizada
+        self._thread_local = threading.local()
+        # Límite global de descargas simultáneas (GDRIVE_MAX_CONCURRENT_DOWNLOADS, 0 = sin límite): las descargas
+        # se solapan entre sí, pero sin superar la cuota de la API aunque varios pools descarguen a la vez
+        max_downloads = int(os.getenv("GDRIVE_MAX_CONCURRENT_DOWNLOADS", "0"))
+        self._download_slots = threading.BoundedSemaphore(max_downloads) if max_downloads > 0 else None
         self._init_service()
 
     def _init_service(self):
@@ -82,8 +100,17 @@ class GoogleDriveService:
                 "del tipo 'installed' (Desktop app)."
             )
         
+        self.credentials = creds
         self.service = build('drive', 'v3', credentials=creds)
 
+    def _get_thread_http(self) -> google_auth_httplib2.AuthorizedHttp:
+        """Devuelve un cliente HTTP autorizado propio del hilo actual (reutilizado entre descargas)"""
+        http = getattr(self._thread_local, "http", None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+            self._thread_local.http = http
+        return http
+
     def list_files(self, limit: int = 10) -> List[Dict]:
         """Lista archivos en general (sin filtrar por carpeta padre)"""
         try:
@@ -95,7 +122,7 @@ class GoogleDriveService:
             ).execute()
             return response.get('files', [])
         except Exception as e:
-            print(f"Error listando archivos: {e}")
+            logger.error("Error listando archivos: %s", e)
             return []
 
     def extract_folder_id(self, url: str) -> str:
@@ -123,7 +150,7 @@ class GoogleDriveService:
                     pageToken=page_token,
                     supportsAllDrives=True,
                     includeItemsFromAllDrives=True
-                ).execute()
+                ).execute(http=self._get_thread_http())
                 
                 items = response.get('files', [])
                 results.extend(items)
@@ -132,7 +159,7 @@ class GoogleDriveService:
                 if not page_token:
                     break
             except Exception as e:
-                print(f"Error listando carpeta {folder_id}: {e}")
+                logger.error("Error listando carpeta %s: %s", folder_id, e)
                 break
         
         return results
@@ -161,21 +188,19 @@ class GoogleDriveService:
         
         for attempt in range(max_retries):
             try:
-                return download_func()
+                # El hueco se libera durante la espera entre reintentos para no bloquear otras descargas
+                if self._download_slots is None:
+                    return download_func()
+                with self._download_slots:
+                    return download_func()
             except (ssl.SSLError, IOError, OSError, HttpError) as e:
                 last_exception = e
                 error_msg = str(e).lower()
                 
-                # Errores que pueden resolverse con reintentos
-                retryable_errors = [
-                    'ssl', 'record layer failure', 'connection', 
-                    'timeout', 'network', 'broken pipe', 'connection reset'
-                ]
-                
-                if any(err in error_msg for err in retryable_errors):
+                if _RETRYABLE_ERROR_RE.search(error_msg):
                     if attempt < max_retries - 1:
                         delay = initial_delay * (2 ** attempt)  # Backoff exponencial
-                        logger.warning(f"⚠️  Error SSL/red descargando {file_id} (intento {attempt + 1}/{max_retries}). "
+                        logger.warning(f"⚠️  Error SSL/red/cuota descargando {file_id} (intento {attempt + 1}/{max_retries}). "
                                      f"Reintentando en {delay:.1f}s...")
                         time.sleep(delay)
                         continue
@@ -192,11 +217,15 @@ class GoogleDriveService:
         raise Exception(f"Error descargando archivo {file_id} después de {max_retries} intentos: {last_exception}")
 
     def download_file(self, file_id: str, destination_path: str):
-        """Descarga un archivo de Google Drive a una ruta local con reintentos automáticos"""
+        """Descarga un archivo de Google Drive a una ruta local con reintentos automáticos
+
+        Usa una conexión HTTP por hilo, por lo que puede llamarse desde varios hilos a la vez.
+        """
         max_retries = int(os.getenv("GDRIVE_DOWNLOAD_RETRIES", "3"))
         
         def _do_download():
             request = self.service.files().get_media(fileId=file_id)
+            request.http = self._get_thread_http()
             with open(destination_path, 'wb') as f:
                 downloader = MediaIoBaseDownload(f, request)
                 done = False
@@ -206,33 +235,80 @@ class GoogleDriveService:
         self._download_with_retry(file_id, _do_download, max_retries=max_retries)
 
     def download_file_to_memory(self, file_id: str) -> bytes:
-        """Descarga un archivo de Google Drive a memoria con reintentos automáticos"""
+        """Descarga un archivo de Google Drive a memoria con reintentos automáticos
+
+        Como download_file, usa una conexión HTTP por hilo.
+        """
         max_retries = int(os.getenv("GDRIVE_DOWNLOAD_RETRIES", "3"))
         
         def _do_download():
             request = self.service.files().get_media(fileId=file_id)
+            request.http = self._get_thread_http()
             fh = io.BytesIO()
             downloader = MediaIoBaseDownload(fh, request)
             done = False
             while not done:
                 status, done = downloader.next_chunk()
-            fh.seek(0)
-            return fh.read()
+            return fh.getvalue()
         
         return self._download_with_retry(file_id, _do_download, max_retries=max_retries)
 
-    def get_file_info(self, file_id: str) -> Dict:
-        """Obtiene información de un archivo"""
+    def get_file_info(self, file_id: str, fields: str = 'id, name, mimeType, size') -> Dict:
+        """Obtiene información de un archivo
+        
+        Args:
+            file_id: ID del archivo en Google Drive
+            fields: Campos a solicitar a la API (por defecto id, name, mimeType y size)
+        """
         try:
             file = self.service.files().get(
                 fileId=file_id, 
-                fields='id, name, mimeType, size',
+                fields=fields,
                 supportsAllDrives=True
-            ).execute()
+            ).execute(http=self._get_thread_http())
             return file
         except Exception as e:
             raise Exception(f"Error obteniendo info del archivo {file_id}: {e}")
 
+    def get_files_info(self, file_ids: Iterable[str], fields: str = 'id, name, mimeType, size') -> Dict[str, Dict]:
+        """Obtiene la información de varios archivos con peticiones batch (hasta 100 archivos por petición HTTP)
+        
+        Args:
+            file_ids: IDs de los archivos en Google Drive
+            fields: Campos a solicitar a la API (por defecto id, name, mimeType y size)
+            
+        Returns:
+            Diccionario {file_id: info}. Los archivos que no se pudieron consultar no aparecen
+        """
+        files_info = {}
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                logger.warning("Error obteniendo info del archivo %s: %s", request_id, exception)
+            else:
+                files_info[request_id] = response
+
+        def execute(batch):
+            try:
+                batch.execute()
+            except Exception as e:
+                logger.error("Error en la petición batch de info de archivos: %s", e)
+
+        # Se recorre file_ids una sola vez, sin copiar un trozo de la lista por cada petición batch
+        batch = None
+        for count, file_id in enumerate(file_ids):
+            if count % 100 == 0:
+                if batch is not None:
+                    execute(batch)
+                batch = self.service.new_batch_http_request(callback=callback)
+            batch.add(
+                self.service.files().get(fileId=file_id, fields=fields, supportsAllDrives=True),
+                request_id=file_id
+            )
+        if batch is not None:
+            execute(batch)
+        return files_info
+
     def get_all_files_recursive(self, folder_id: str, file_types: List[str] = None, file_extensions: List[str] = None) -> List[Dict]:
         """Obtiene recursivamente todos los archivos de una carpeta y subcarpetas
 
@@ -274,8 +350,10 @@ class GoogleDriveService:
                 '.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tiff', '.tif'
             ]
 
-        # Normalizar extensiones a minúsculas
-        file_extensions = [ext.lower() for ext in file_extensions]
+        # Normalizar extensiones a minúsculas; conjuntos para que el filtro por archivo sea O(1)
+        # en lugar de recorrer las dos listas (unas 25 entradas cada una) por cada archivo de la carpeta
+        file_extensions = frozenset(ext.lower() for ext in file_extensions)
+        file_types = frozenset(file_types)
 
         folder_id = self.extract_folder_id(folder_id)
         all_files = []
@@ -299,17 +377,17 @@ class GoogleDriveService:
             for item in items:
                 item_path = f"{current_path}/{item['name']}" if current_path else item['name']
 
-                if item['mimeType'] == 'application/vnd.google-apps.folder':
+                mime_type = item['mimeType']
+                if mime_type == 'application/vnd.google-apps.folder':
                     # Es una carpeta, recorrer recursivamente
                     traverse_folder(item['id'], item_path)
                 else:
-                    # Verificar por MIME type O por extensión de archivo
-                    file_ext = get_file_extension(item['name'])
-                    if item['mimeType'] in file_types or file_ext in file_extensions:
+                    # Verificar por MIME type O por extensión de archivo (la extensión solo si hace falta)
+                    if mime_type in file_types or get_file_extension(item['name']) in file_extensions:
                         all_files.append({
                             'id': item['id'],
                             'name': item['name'],
-                            'mimeType': item['mimeType'],
+                            'mimeType': mime_type,
                             'path': item_path,
                             'size': item.get('size', '0')
                         })
@@ -1,14 +1,42 @@
 import os
+import re
+import hashlib
+import threading
 import requests
 import logging
 import json
 import time
-from typing import Optional
+from collections import OrderedDict
+from typing import List, Optional
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+try:
+    import orjson  # Serializa la petición y parsea la respuesta del modelo bastante más rápido que json
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# Patrones de limpieza de respuestas en texto plano, compilados una sola vez
+_ANSWER_TAG_RE = re.compile(r'<answer>\s*(.*?)(?:\s*</answer>|$)', re.DOTALL | re.IGNORECASE)
+_ANSWER_OPEN_RE = re.compile(r'<answer>\s*', re.IGNORECASE)
+_ANSWER_CLOSE_RE = re.compile(r'\s*</answer>', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+_JSON_DESCRIPTION_RES = tuple(re.compile(pattern, re.IGNORECASE | re.DOTALL) for pattern in (
+    r'\{[^}]*"description"\s*:\s*"([^"]+)"[^}]*\}',
+    r'\{[^}]*"descripcion"\s*:\s*"([^"]+)"[^}]*\}',
+    r'"description"\s*:\s*"([^"]+)"',
+    r'"descripcion"\s*:\s*"([^"]+)"',
+))
+_CODE_FENCE_RE = re.compile(r'```[a-z]*\n?')
+_PREFIX_RES = tuple(re.compile(prefix, re.IGNORECASE) for prefix in (
+    r'^description:\s*',
+    r'^descripcion:\s*',
+    r'^resumen:\s*',
+    r'^summary:\s*',
+))
+
 class LLMService:
     def __init__(self, model: str = None):
         self.api_url = os.getenv("MODEL_API_URL", "http://localhost:11434/v1/chat/completions")
@@ -23,20 +51,76 @@ class LLMService:
         else:
             self.model = os.getenv("LLM_MODEL", "Qwen/Qwen3-32B")
 
-        # Configurar retry strategy para manejar rate limiting y errores temporales
-        self.retry_strategy = Retry(
-            total=3,  # 3 intentos
-            backoff_factor=1,  # Esperar 1, 2, 4 segundos entre reintentos
-            status_forcelist=[429, 500, 502, 503, 504],  # Reintentar en estos códigos HTTP
-            allowed_methods=["POST"]
-        )
-        self.adapter = HTTPAdapter(max_retries=self.retry_strategy)
-        self.session = requests.Session()
-        self.session.mount("http://", self.adapter)
-        self.session.mount("https://", self.adapter)
+        self.session = self._shared_session()
+
+        # Caché LRU de respuestas para peticiones deterministas (temperatura <= LLM_CACHE_MAX_TEMPERATURE):
+        # reintentos de carpetas y documentos repetidos no vuelven a llamar al modelo (0 = desactivada)
+        self.cache_size = int(os.getenv("LLM_CACHE_SIZE", "256"))
+        self.cache_max_temperature = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.1"))
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    # Sesión HTTP única por proceso, compartida por todas las instancias (p.ej. varios DocumentProcessor)
+    _session: Optional[requests.Session] = None
+    _session_lock = threading.Lock()
+
+    @classmethod
+    def _shared_session(cls) -> requests.Session:
+        """Sesión con keep-alive y reintentos compartida por todas las instancias del proceso"""
+        with cls._session_lock:
+            if cls._session is None:
+                # Configurar retry strategy para manejar rate limiting y errores temporales
+                retry_strategy = Retry(
+                    total=3,  # 3 intentos
+                    backoff_factor=1,  # Esperar 1, 2, 4 segundos entre reintentos
+                    status_forcelist=[429, 500, 502, 503, 504],  # Reintentar en estos códigos HTTP
+                    allowed_methods=["POST"]
+                )
+                # pool_maxsize: una conexión reutilizable por inferencia concurrente (por defecto requests guarda solo 10)
+                adapter = HTTPAdapter(
+                    max_retries=retry_strategy,
+                    pool_maxsize=int(os.getenv("MAX_CONCURRENT_INFERENCE", "16"))
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                cls._session = session
+            return cls._session
 
-    def analyze_llm(self, prompt: str, max_tokens: Optional[int] = None, schema: dict = None, temperature: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, model: Optional[str] = None, enable_thinking: Optional[bool] = None) -> str:
-        """Servicio específico para procesamiento de solo texto (LLM) en texto plano"""
+    def _cache_key(self, payload: dict) -> Optional[str]:
+        """Clave de caché de una petición, o None si no es cacheable (caché desactivada o muestreo no determinista)"""
+        temperature = payload.get("temperature")
+        if self.cache_size <= 0 or temperature is None or temperature > self.cache_max_temperature:
+            return None
+        return hashlib.blake2b(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8"), digest_size=16).hexdigest()
+
+    def _send_cached_request(self, payload: dict) -> str:
+        """Envía la petición reutilizando la respuesta cacheada si existe; solo se cachean respuestas sin error"""
+        cache_key = self._cache_key(payload)
+        if cache_key is not None:
+            with self._cache_lock:
+                cached = self._cache.get(cache_key)
+                if cached is not None:
+                    self._cache.move_to_end(cache_key)
+                    logger.info("LLM response served from cache")
+                    return cached
+        content = self._send_request(payload, clean="response_format" not in payload)
+        if cache_key is not None and content and not content.startswith("Error"):
+            with self._cache_lock:
+                self._cache[cache_key] = content
+                self._cache.move_to_end(cache_key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return content
+
+    def analyze_llm(self, prompt: str, max_tokens: Optional[int] = None, schema: dict = None, temperature: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, model: Optional[str] = None, enable_thinking: Optional[bool] = None, stop: Optional[List[str]] = None) -> str:
+        """Servicio específico para procesamiento de solo texto (LLM)
+        
+        Sin schema devuelve texto plano ya limpio. Con schema usa Structured Outputs y devuelve el JSON
+        generado por el modelo tal cual (el servidor garantiza la forma, no hace falta limpiarlo).
+        stop corta la generación en cuanto aparece una de las cadenas (p.ej. "</answer>"); solo se envía
+        sin razonamiento, porque el razonamiento podría mencionarlas y cortar la respuesta antes de tiempo.
+        """
         # Usar el modelo proporcionado o el modelo por defecto de la instancia
         model_to_use = model or self.model
         logger.info(f"Preparing LLM request for text-only analysis (Plain Text). Model: {model_to_use}")
@@ -45,10 +129,15 @@ class LLMService:
         if enable_thinking is None:
             enable_thinking = os.getenv("LLM_ENABLE_THINKING", "false").lower() == "true"
         
+        if schema:
+            output_format_rule = "- Always respond with a JSON object that follows the requested schema; its text fields contain plain text only (no markdown, no nested formats)"
+        else:
+            output_format_rule = "- Always respond with plain text only (no JSON, no markdown, no structured formats, no quotes, no brackets)"
+        
         messages = [
             {
                 "role": "system",
-                "content": """You are an expert document analyst specialized in extracting semantic information from documents. Your task is to analyze document content and generate clear, complete, and accurate summaries, descriptions, and titles.
+                "content": f"""You are an expert document analyst specialized in extracting semantic information from documents. Your task is to analyze document content and generate clear, complete, and accurate summaries, descriptions, and titles.
 
 CRITICAL RULES:
 - NEVER include your reasoning, thinking process, chain of thought, or any explanation in your response
@@ -71,7 +160,7 @@ CRITICAL - Output rules:
 - The description must be a direct description of the document content, nothing more
 
 Key principles:
-- Always respond with plain text only (no JSON, no markdown, no structured formats, no quotes, no brackets)
+{output_format_rule}
 - Be precise and factual: include specific entities (names, organizations, dates, amounts) when they appear in the content
 - Focus on semantic understanding: capture the purpose, key concepts, and important details
 - Be complete but comprehensive: provide enough information to clearly identify and understand the document
@@ -89,6 +178,15 @@ Key principles:
             "messages": messages,
             "stream": False
         }
+        if schema:
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "document_analysis",
+                    "strict": True,
+                    "schema": schema
+                }
+            }
         
         # Solo incluir parámetros si se proporcionan explícitamente
         if max_tokens is not None:
@@ -99,6 +197,8 @@ Key principles:
             payload["top_p"] = top_p
         if top_k is not None:
             payload["top_k"] = top_k
+        if stop and enable_thinking is False:
+            payload["stop"] = stop
         
         # Añadir extra_body con chat_template_kwargs si no_think está activado (enable_thinking=False)
         # Si enable_thinking es False, enviar en extra_body para evitar que razone
@@ -111,7 +211,7 @@ Key principles:
             payload["enable_thinking"] = True
             logger.debug("Thinking mode enabled for LLM")
 
-        return self._send_request(payload)
+        return self._send_cached_request(payload)
 
     def _clean_plain_text_response(self, content: str) -> str:
         """
@@ -126,13 +226,9 @@ Key principles:
         if not content:
             return ""
         
-        # Si parece JSON, intentar extraer el texto
-        import re
-        
         # Primero, intentar extraer contenido de etiquetas <answer></answer>
         # Buscar tanto con etiqueta de cierre como sin ella (por si el modelo no la cierra)
-        # Usar .*? para capturar todo hasta </answer> o el final, con DOTALL para incluir saltos de línea
-        answer_match = re.search(r'<answer>\s*(.*?)(?:\s*</answer>|$)', content, re.DOTALL | re.IGNORECASE)
+        answer_match = _ANSWER_TAG_RE.search(content)
         if answer_match:
             extracted = answer_match.group(1).strip()
             logger.info("Extraído texto de etiquetas <answer></answer>")
@@ -140,27 +236,15 @@ Key principles:
             content = extracted
         else:
             # Si no hay etiquetas pero el contenido contiene <answer>, limpiarlo
-            # Buscar <answer> en cualquier posición y eliminarlo junto con espacios/saltos de línea
-            content = re.sub(r'<answer>\s*', '', content, flags=re.IGNORECASE)
-            content = re.sub(r'\s*</answer>', '', content, flags=re.IGNORECASE)
+            content = _ANSWER_OPEN_RE.sub('', content)
+            content = _ANSWER_CLOSE_RE.sub('', content)
         
-        # Limpiar saltos de línea y espacios extra que puedan quedar
-        content = re.sub(r'\n+', ' ', content)  # Reemplazar múltiples saltos de línea con un espacio
-        content = re.sub(r'\r+', ' ', content)  # Reemplazar retornos de carro
-        content = re.sub(r'\t+', ' ', content)  # Reemplazar tabs
-        content = re.sub(r'\s+', ' ', content)  # Reemplazar múltiples espacios con uno solo
-        content = content.strip()
+        # Saltos de línea, retornos de carro, tabs y espacios repetidos -> un solo espacio
+        content = _WHITESPACE_RE.sub(' ', content).strip()
         
         # Buscar patrones JSON comunes
-        json_patterns = [
-            r'\{[^}]*"description"\s*:\s*"([^"]+)"[^}]*\}',
-            r'\{[^}]*"descripcion"\s*:\s*"([^"]+)"[^}]*\}',
-            r'"description"\s*:\s*"([^"]+)"',
-            r'"descripcion"\s*:\s*"([^"]+)"',
-        ]
-        
-        for pattern in json_patterns:
-            match = re.search(pattern, content, re.IGNORECASE | re.DOTALL)
+        for pattern in _JSON_DESCRIPTION_RES:
+            match = pattern.search(content)
             if match:
                 extracted = match.group(1)
                 # Decodificar escapes JSON
@@ -171,9 +255,7 @@ Key principles:
         
         # Si tiene bloques de código markdown, limpiarlos
         if "```" in content:
-            # Remover bloques de código
-            content = re.sub(r'```[a-z]*\n?', '', content)
-            content = re.sub(r'```\n?', '', content)
+            content = _CODE_FENCE_RE.sub('', content)
         
         # Remover comillas al inicio y final si están solas
         content = content.strip()
@@ -190,18 +272,12 @@ Key principles:
         content = content.replace('\\r', ' ')  # Retornos de carro escapados -> espacio
         
         # Remover prefijos comunes
-        prefixes_to_remove = [
-            r'^description:\s*',
-            r'^descripcion:\s*',
-            r'^resumen:\s*',
-            r'^summary:\s*',
-        ]
-        for prefix in prefixes_to_remove:
-            content = re.sub(prefix, '', content, flags=re.IGNORECASE)
+        for prefix in _PREFIX_RES:
+            content = prefix.sub('', content)
         
         return content.strip()
 
-    def _send_request(self, payload: dict) -> str:
+    def _send_request(self, payload: dict, clean: bool = True) -> str:
         try:
             headers = {
                 "Content-Type": "application/json"
@@ -216,20 +292,22 @@ Key principles:
             # Usar session con retry y timeout configurado
             response = self.session.post(
                 self.api_url,
-                json=payload,
+                data=orjson.dumps(payload) if orjson is not None else json.dumps(payload).encode('utf-8'),
                 headers=headers,
                 timeout=(10, 180)  # 10s para conectar, 180s para leer respuesta
             )
             response.raise_for_status()
             
-            resp_json = response.json()
+            resp_json = orjson.loads(response.content) if orjson is not None else response.json()
             content = resp_json["choices"][0]["message"]["content"]
             
             if content is None:
                 logger.warning("LLM returned empty content (None)")
                 return "Error: El modelo no devolvió contenido."
             
-            # Limpiar la respuesta para asegurar texto plano
+            # Limpiar la respuesta para asegurar texto plano (las respuestas estructuradas se devuelven tal cual)
+            if not clean:
+                return content.strip()
             cleaned_content = self._clean_plain_text_response(content.strip())
             return cleaned_content
         except requests.exceptions.HTTPError as e:
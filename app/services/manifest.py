@@ -0,0 +1,69 @@
+"""
+Volcado incremental de resultados a disco (JSONL)
+Permite procesar carpetas grandes sin mantener todos los resultados en memoria durante el procesamiento
+"""
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterator, Optional
+import logging
+
+from app.models import DocumentResult
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestWriter:
+    """Escribe cada DocumentResult como una línea JSON en cuanto se genera"""
+
+    def __init__(self, name: str, manifest_dir: Optional[str] = None):
+        """
+        Inicializa el fichero JSONL de resultados
+
+        Args:
+            name: Identificador del procesamiento (p.ej. folder_id), usado como prefijo del nombre del fichero.
+                  El nombre lleva además un sufijo único, así que dos procesamientos simultáneos de la
+                  misma carpeta no comparten (ni truncan) el mismo fichero
+            manifest_dir: Directorio donde crear el fichero.
+                          Si es None, usa MANIFEST_DIR del .env o el directorio temporal del sistema
+        """
+        manifest_dir = Path(manifest_dir or os.getenv("MANIFEST_DIR", tempfile.gettempdir()))
+        manifest_dir.mkdir(parents=True, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=f"manifest-{name}-", suffix=".jsonl", dir=manifest_dir)
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.count = 0
+        self._file = os.fdopen(fd, 'w', encoding='utf-8')
+        logger.info(f"Volcando resultados incrementalmente en: {self.path}")
+
+    def write(self, result: DocumentResult):
+        """Añade un resultado al fichero (thread-safe)"""
+        line = result.model_dump_json()
+        with self.lock:
+            self._file.write(line)
+            self._file.write('\n')
+            self._file.flush()
+            self.count += 1
+
+    def close(self):
+        """Cierra el fichero (los resultados siguen disponibles con read_results)"""
+        with self.lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def read_results(self) -> Iterator[DocumentResult]:
+        """Lee los resultados escritos, en orden de escritura"""
+        self.close()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield DocumentResult.model_validate_json(line)
+
+    def remove(self):
+        """Elimina el fichero de resultados"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            logger.warning(f"No se pudo eliminar el fichero de resultados {self.path}: {e}")
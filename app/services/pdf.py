@@ -1,65 +1,186 @@
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PyPDF2 import PdfReader
+from PIL import Image
 import os
-from typing import List
+import tempfile
+import threading
+from typing import Callable, List, Optional, Tuple, Union
 import logging
 
+from app.services.vllm import encode_jpeg
+
+try:
+    import fitz  # PyMuPDF: renderiza en proceso, sin lanzar pdftoppm ni parsear todo el documento
+except ImportError:
+    fitz = None
+
+try:
+    import pypdfium2 as pdfium  # Alternativa en proceso a PyMuPDF (licencia Apache/BSD)
+except ImportError:
+    pdfium = None
+
 logger = logging.getLogger(__name__)
 
+
+# PDFium no es thread-safe (ni siquiera con documentos distintos): una sola llamada a la vez por proceso
+_PDFIUM_LOCK = threading.Lock()
+# PyMuPDF tampoco es thread-safe (comparte estado global de MuPDF entre documentos): mismo tratamiento
+_FITZ_LOCK = threading.Lock()
+
+
+class UnreadablePDFError(Exception):
+    """PDF sin páginas o protegido con contraseña: ningún renderizador podrá convertirlo"""
+
+
+def _select_pages(total_pages: int, initial_pages: int, final_pages: int) -> List[int]:
+    """Números de página (1-based) a renderizar: las primeras N y las últimas M, sin solaparse"""
+    page_numbers = list(range(1, min(initial_pages, total_pages) + 1)) if initial_pages > 0 else []
+    if total_pages > initial_pages and final_pages > 0:
+        last_start = max(initial_pages + 1, total_pages - final_pages + 1)
+        page_numbers.extend(range(last_start, total_pages + 1))
+    return page_numbers
+
+
 class PDFProcessor:
-    def convert_to_images(self, pdf_path: str, output_folder: str, initial_pages: int = 2, final_pages: int = 2) -> List[str]:
-        """Convierte las primeras N y últimas M páginas del PDF a imágenes
+    def __init__(self, scratch_dir: Optional[str] = None):
+        """
+        Args:
+            scratch_dir: Directorio donde volcar los PDFs en memoria cuando hay que recurrir a pdf2image.
+                         Si es None, usa el directorio temporal del sistema
+        """
+        self.scratch_dir = scratch_dir
+
+    def _in_process_renderer(self) -> Optional[Callable[..., List[Tuple[int, Image.Image]]]]:
+        """Renderizador en proceso disponible (PyMuPDF y si no pypdfium2), o None si solo queda pdf2image"""
+        if fitz is not None:
+            return self.render_pages_fitz
+        if pdfium is not None:
+            return self.render_pages_pdfium
+        return None
+
+    def can_render_bytes(self, initial_pages: int = 2, final_pages: int = 2) -> bool:
+        """Indica si convert_to_images puede renderizar un PDF en memoria (bytes) sin escribirlo a disco"""
+        return self._in_process_renderer() is not None and initial_pages + final_pages <= int(os.getenv("PDF_FITZ_MAX_PAGES", "8"))
+
+    def render_pages_fitz(self, pdf_source: Union[str, bytes], initial_pages: int = 2, final_pages: int = 2, dpi: int = 200) -> List[Tuple[int, Image.Image]]:
+        """Renderiza solo las páginas necesarias con PyMuPDF
+        
+        Selecciona las mismas páginas que convert_to_images (primeras N y últimas M sin solaparse).
+        Por defecto usa 200 dpi, la misma resolución que pdf2image, para no alterar lo que ve el modelo.
+        pdf_source puede ser una ruta o el contenido del PDF en memoria.
+        
+        Returns:
+            Lista de tuplas (número de página 1-based, imagen PIL)
+        """
+        rendered = []
+        matrix = fitz.Matrix(dpi / 72, dpi / 72)
+        with _FITZ_LOCK:
+            if isinstance(pdf_source, (bytes, bytearray, memoryview)):
+                doc = fitz.open(stream=pdf_source, filetype="pdf")
+            else:
+                doc = fitz.open(pdf_source)
+            with doc:
+                if doc.needs_pass:
+                    raise UnreadablePDFError("PDF protegido con contraseña")
+                total_pages = doc.page_count
+                if total_pages == 0:
+                    raise UnreadablePDFError("PDF sin páginas")
+                for page_num in _select_pages(total_pages, initial_pages, final_pages):
+                    pix = doc[page_num - 1].get_pixmap(matrix=matrix, alpha=False)
+                    rendered.append((page_num, Image.frombytes("RGB", (pix.width, pix.height), pix.samples)))
+        return rendered
+
+    def render_pages_pdfium(self, pdf_source: Union[str, bytes], initial_pages: int = 2, final_pages: int = 2, dpi: int = 200) -> List[Tuple[int, Image.Image]]:
+        """Renderiza solo las páginas necesarias con pypdfium2 (mismas páginas y resolución que render_pages_fitz)
+        
+        Returns:
+            Lista de tuplas (número de página 1-based, imagen PIL)
+        """
+        rendered = []
+        with _PDFIUM_LOCK:
+            try:
+                doc = pdfium.PdfDocument(bytes(pdf_source) if isinstance(pdf_source, (bytearray, memoryview)) else pdf_source)
+            except pdfium.PdfiumError as e:
+                if 'password' in str(e).lower():
+                    raise UnreadablePDFError("PDF protegido con contraseña") from e
+                raise
+            try:
+                total_pages = len(doc)
+                if total_pages == 0:
+                    raise UnreadablePDFError("PDF sin páginas")
+                for page_num in _select_pages(total_pages, initial_pages, final_pages):
+                    page = doc[page_num - 1]
+                    try:
+                        rendered.append((page_num, page.render(scale=dpi / 72).to_pil().convert("RGB")))
+                    finally:
+                        page.close()
+            finally:
+                doc.close()
+        return rendered
+
+    def convert_to_images(self, pdf_path: Union[str, bytes], initial_pages: int = 2, final_pages: int = 2) -> List[Image.Image]:
+        """Convierte las primeras N y últimas M páginas del PDF a imágenes en memoria (PIL)
+        
+        Si PyMuPDF (o pypdfium2) está instalado y se piden pocas páginas (PDF_FITZ_MAX_PAGES), renderiza
+        en proceso; en caso contrario (o si el renderizado en proceso falla) usa pdf2image/Poppler.
         
         Args:
-            pdf_path: Ruta al archivo PDF
-            output_folder: Carpeta donde guardar las imágenes
+            pdf_path: Ruta al archivo PDF, o su contenido en memoria (bytes). Con bytes, solo se
+                      escribe a un archivo temporal si hay que recurrir a pdf2image
             initial_pages: Número de páginas iniciales a procesar (default: 2)
             final_pages: Número de páginas finales a procesar (default: 2)
         """
         images = []
+        in_memory = isinstance(pdf_path, (bytes, bytearray, memoryview))
+        if self.can_render_bytes(initial_pages, final_pages):
+            try:
+                return [img for _, img in self._in_process_renderer()(pdf_path, initial_pages, final_pages)]
+            except UnreadablePDFError as e:
+                # pdf2image tampoco podría: no se intenta de nuevo
+                logger.warning(f"PDF ilegible {'en memoria' if in_memory else os.path.basename(pdf_path)}: {e}")
+                return []
+            except Exception as e:
+                logger.warning(f"El renderizado en proceso falló para {'el PDF en memoria' if in_memory else os.path.basename(pdf_path)}: {e}. Usando pdf2image...")
+                images = []
+        if in_memory:
+            # pdf2image y PyPDF2 trabajan sobre rutas: volcar a un archivo temporal
+            fd, tmp_path = tempfile.mkstemp(suffix=".pdf", dir=self.scratch_dir)
+            try:
+                with os.fdopen(fd, 'wb') as tmp_file:
+                    tmp_file.write(pdf_path)
+                return self.convert_to_images(tmp_path, initial_pages, final_pages)
+            finally:
+                os.remove(tmp_path)
         try:
             # Obtener número total de páginas con strict=False para ser más permisivo
             try:
                 reader = PdfReader(pdf_path, strict=False)
+                if reader.is_encrypted and not reader.decrypt(""):
+                    # Requiere contraseña de usuario: no se puede renderizar, evitar lanzar Poppler para nada
+                    logger.warning(f"PDF protegido con contraseña ignorado: {os.path.basename(pdf_path)}")
+                    return []
                 total_pages = len(reader.pages)
             except Exception as pdf_read_error:
-                # Si PyPDF2 falla, intentar obtener número de páginas desde pdf2image
+                # Si PyPDF2 falla, obtener el número de páginas con pdfinfo (Poppler), sin renderizar ninguna
                 logger.warning(f"PyPDF2 no pudo leer el PDF {os.path.basename(pdf_path)}: {pdf_read_error}. Intentando con pdf2image directamente...")
                 try:
-                    # Intentar convertir la primera página para obtener el total
-                    test_images = convert_from_path(pdf_path, first_page=1, last_page=1)
-                    if test_images:
-                        # Si funciona, intentar obtener el número total de páginas
-                        # pdf2image puede manejar algunos PDFs que PyPDF2 no puede
-                        # Intentar convertir todas las páginas para contar
-                        all_images = convert_from_path(pdf_path)
-                        total_pages = len(all_images)
-                        # Limpiar las imágenes de prueba
-                        for img in all_images:
-                            img.close()
-                    else:
-                        raise Exception("No se pudieron extraer imágenes del PDF")
+                    total_pages = int(pdfinfo_from_path(pdf_path).get("Pages", 0))
                 except Exception as fallback_error:
                     logger.error(f"Error al obtener número de páginas del PDF {os.path.basename(pdf_path)}: {fallback_error}")
                     raise pdf_read_error  # Re-lanzar el error original
             
+            if total_pages == 0:
+                logger.warning(f"PDF sin páginas: {os.path.basename(pdf_path)}")
+                return []
+            
             # Procesar páginas iniciales
             if total_pages >= 1 and initial_pages > 0:
-                first_batch = convert_from_path(pdf_path, first_page=1, last_page=min(initial_pages, total_pages))
-                for i, img in enumerate(first_batch):
-                    path = os.path.join(output_folder, f"page_{i+1}.jpg")
-                    img.save(path, "JPEG")
-                    images.append(path)
+                images.extend(convert_from_path(pdf_path, first_page=1, last_page=min(initial_pages, total_pages)))
             
             # Procesar páginas finales (si hay suficientes páginas y no se solapan con las iniciales)
             if total_pages > initial_pages and final_pages > 0:
                 last_start = max(initial_pages + 1, total_pages - final_pages + 1)
-                last_batch = convert_from_path(pdf_path, first_page=last_start, last_page=total_pages)
-                for i, img in enumerate(last_batch):
-                    page_num = last_start + i
-                    path = os.path.join(output_folder, f"page_{page_num}.jpg")
-                    img.save(path, "JPEG")
-                    images.append(path)
+                images.extend(convert_from_path(pdf_path, first_page=last_start, last_page=total_pages))
             
             return images
         except Exception as e:
@@ -71,4 +192,13 @@ class PDFProcessor:
                 logger.warning(f"PDF con estructura problemática detectado: {os.path.basename(pdf_path)}: {e}")
             else:
                 logger.error(f"Error processing PDF {os.path.basename(pdf_path)}: {e}")
-            return []
\ No newline at end of file
+            return []
+
+
+def render_pdf_pages_jpeg(pdf_path: Union[str, bytes], initial_pages: int = 2, final_pages: int = 2, max_dim: int = 0, quality: int = 80, scratch_dir: Optional[str] = None) -> List[bytes]:
+    """Renderiza las páginas de un PDF y las devuelve ya codificadas en JPEG (ver encode_jpeg)
+
+    Pensada para el ProcessPoolExecutor: devolver JPEG comprimidos en lugar de imágenes PIL evita
+    serializar entre procesos bitmaps de varios MB por página, y la codificación sale del proceso principal.
+    """
+    return [encode_jpeg(image, max_dim, quality) for image in PDFProcessor(scratch_dir).convert_to_images(pdf_path, initial_pages, final_pages)]
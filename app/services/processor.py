@@ -4,30 +4,189 @@ import zipfile
 import tarfile
 import shutil
 import time
-from typing import List, Dict, Any, Optional, Tuple
+import re
+import hashlib
+import atexit
+import itertools
+from collections import OrderedDict, deque
+from typing import List, Dict, Any, Optional, Tuple, Union, Iterator
 from pathlib import Path
-from app.services.pdf import PDFProcessor
+from types import MappingProxyType
+from app.services.pdf import PDFProcessor, render_pdf_pages_jpeg
 from app.services.docx import DOCXProcessor
 from app.services.vllm import VLLMService
 from app.services.llm import LLMService
 from app.services.gdrive import GoogleDriveService
 from app.services.checkpoint import CheckpointService
-from app.services.xml_eml import XMLEMLProcessor
-from app.models import DocumentResult, ProcessFolderResponse
+from app.services.manifest import ManifestWriter
+from app.services.result_cache import ResultCache
+from app.services.xml_eml import XMLEMLProcessor, extract_xml_text, extract_eml_text
+from app.models import DocumentResult, DocumentResultList, ProcessFolderResponse
 from datetime import datetime
 import json
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from pydantic import ValidationError
 
 
 import logging
 
+try:
+    import orjson  # Parser JSON nativo, bastante más rápido que json para las respuestas del modelo
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+
+def _json_loads(text: str) -> Any:
+    """json.loads con orjson si está disponible (orjson.JSONDecodeError hereda de json.JSONDecodeError)"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def load_checkpoint_results(entries: List[Dict[str, Any]]) -> List[DocumentResult]:
+    """
+    Convierte los resultados guardados en un checkpoint ({"result": {...}, ...}) en DocumentResult.
+
+    Valida toda la lista de una vez con DocumentResultList; solo si algún resultado no es válido se
+    recurre a validarlos uno a uno, descartando (con un aviso) los que fallen.
+    """
+    raw_results = [entry.get("result") for entry in entries if isinstance(entry.get("result"), dict)]
+    try:
+        return DocumentResultList.validate_python(raw_results)
+    except ValidationError:
+        pass
+    results = []
+    for result_data in raw_results:
+        try:
+            results.append(DocumentResult.model_validate(result_data))
+        except ValidationError as e:
+            logger.warning(f"Error cargando resultado previo: {e}")
+    return results
+
+
+def result_path_key(result: DocumentResult) -> str:
+    """
+    Clave de ordenación de los resultados por ruta (los que no tienen ruta van primero).
+
+    list.sort evalúa la clave una sola vez por elemento y compara los str en C, así que no hace falta
+    decorar la lista a mano con tuplas (ruta, índice, resultado): es más lento y el orden ya es estable.
+    """
+    return result.path or ""
+
+
+def iter_files(root: str, skip_dirs: Tuple[str, ...] = ()) -> Iterator[str]:
+    """
+    Recorre root recursivamente con os.scandir y devuelve las rutas de los archivos.
+
+    os.scandir obtiene el tipo de cada entrada al listar el directorio, sin un stat() adicional por
+    archivo como os.walk/Path.rglob. No sigue enlaces simbólicos a directorios.
+
+    Args:
+        root: Directorio raíz
+        skip_dirs: Nombres de directorios que no se recorren (p.ej. '__MACOSX')
+    """
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in skip_dirs:
+                        stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path
+
+
+# Schema unificado para Structured Outputs (PDF, DOCX e imágenes). No depende del idioma ni de la
+# configuración, así que se construye una sola vez; no debe modificarse en tiempo de ejecución.
+DOCUMENT_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {
+            "type": "string",
+            "description": "A representative title (maximum 15-20 words) that semantically describes the document content. The title should be self-contained and summarize the essence and meaning of the document."
+        },
+        "description": {
+            "type": "string",
+            "description": "A complete plain text description of the document."
+        }
+    },
+    "required": ["title", "description"],
+    "additionalProperties": False
+}
+
+# Patrones de _extract_description, compilados una sola vez
+_CODEBLOCK_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)```")
+_DESC_KEY_RE = re.compile(r'"descrip(?:tion|cion)"\s*:\s*"([^"]*)"', re.IGNORECASE)
+# raw_decode parsea un objeto JSON que empieza en una posición y devuelve dónde termina (ignora el texto posterior)
+_JSON_DECODER = json.JSONDecoder()
+# Indicadores de que una descripción es un mensaje de error (una sola pasada, sin copiar el texto en minúsculas).
+# Las alternativas que empiezan por "error" comparten prefijo: así el motor lo compara una vez por posición
+# en lugar de probar cinco ramas que fallan en el mismo carácter
+_ERROR_DESCRIPTION_RE = re.compile(
+    r"error(?::| al procesar| procesando| descargando| generando)|no devolvió contenido|failed",
+    re.IGNORECASE
+)
+
+# Títulos generados que en realidad son un mensaje de error (se sustituyen por el nombre del archivo)
+_ERROR_TITLE_RE = re.compile(r"error|no devolvió contenido", re.IGNORECASE)
+# Intervalo con el que las etapas del pipeline de carpetas comprueban la señal de parada mientras esperan en una cola
+_PIPELINE_POLL_SECONDS = 0.5
+# Los prompts de título piden la respuesta dentro de <answer></answer>: la generación termina al cerrar la etiqueta
+_TITLE_STOP = ["</answer>"]
+# Codificaciones de los nombres de los ZIP a intentar en orden de preferencia:
+# 1. UTF-8: estándar moderno
+# 2. CP1252: Windows-1252, común en ZIPs creados en Windows con caracteres españoles/europeos
+# 3. CP437: DOS, común en ZIPs antiguos
+_ZIP_ENCODINGS = (
+    ('utf-8', 'UTF-8'),
+    ('cp1252', 'CP1252 (Windows)'),
+    ('cp437', 'CP437 (DOS)'),
+)
+
+# _clean_description: escapes (\n, \t, \r -> espacio; \", \', \\ -> nada) en una pasada y después
+# borrado de comillas y backslashes restantes con str.translate (equivale a la antigua cadena de replace)
+_ESCAPE_RE = re.compile(r'(\\[ntr])|\\["\'\\]')
+_QUOTES_TABLE = str.maketrans('', '', '"\'\\')
+
+# Nombre completo de cada idioma para la instrucción "Responde en ..." de los prompts (por defecto, español)
+_LANGUAGE_NAMES = MappingProxyType({
+    "es": "español",
+    "en": "inglés",
+    "fr": "francés",
+    "de": "alemán",
+    "it": "italiano",
+    "pt": "portugués"
+})
+
+# Instrucción fija para normalización de términos comerciales (común a los prompts de descripción)
+_NORMALIZE_TERMS_INSTRUCTION = """
+NORMALIZACIÓN DE TÉRMINOS COMERCIALES:
+Cuando el documento sea una simple lista de precios de materiales, productos o una actuación/servicio concreto (sin un alcance de proyecto mayor), utiliza el término "presupuesto" para describirlo, independientemente de cómo se titule el documento original.
+
+Ejemplos que DEBEN normalizarse a "presupuesto":
+- "Factura proforma" con lista de materiales y precios
+- "Cotización de materiales"
+- "Oferta de precios" para productos o servicios puntuales
+- Documentos que solo listan artículos/servicios con sus precios
+
+Ejemplos que NO deben normalizarse (mantener su denominación original):
+- "Propuesta económica" o "Propuesta técnico-económica" para proyectos
+- "Oferta" con alcance de proyecto, fases, entregables
+- Documentos que describen la realización de un proyecto completo"""
+
+# Claves (en minúsculas) en las que _extract_description busca la descripción, por orden de preferencia
+_DESCRIPTION_KEYS = ("description", "descripcion", "macro-description", "macro-descripcion", "summary", "resumen")
+
+
 class DocumentProcessor:
     def __init__(self):
-        self.pdf_processor = PDFProcessor()
-        self.docx_processor = DOCXProcessor()
         self.xml_eml_processor = XMLEMLProcessor()
         
         # Initialize VLLM service for PDF and DOCX processing (multimodal with images)
@@ -46,43 +205,246 @@ class DocumentProcessor:
             self.llm_service = LLMService(model=llm_model)
             logger.info(f"Initialized LLM service with model: {llm_model}")
         
-        # Lock para serializar descargas de Google Drive (evitar rate limiting y colisiones)
-        self.gdrive_download_lock = threading.Lock()
 
         # Semáforo global para limitar inferencias concurrentes (evitar saturar el modelo)
         max_concurrent_inference = int(os.getenv("MAX_CONCURRENT_INFERENCE", "16"))
         self.inference_semaphore = threading.Semaphore(max_concurrent_inference)
+        self._max_concurrent_inference = max_concurrent_inference
         logger.info(f"Initialized inference semaphore with max {max_concurrent_inference} concurrent requests")
+
+        # Pool de procesos para renderizar PDFs, creado una vez y reutilizado en todas las llamadas
+        # (0 = renderizar en el hilo que procesa el documento)
+        render_workers = int(os.getenv("PDF_RENDER_WORKERS", "0"))
+        self._render_workers = max(0, render_workers)
+        self._render_pool = None
+        # Sin pool de procesos, hilos que pre-renderizan los PDFs internos de un comprimido mientras
+        # los workers esperan la inferencia (0 = cada worker renderiza su PDF justo antes de inferir)
+        self._render_prefetch = max(0, int(os.getenv("PDF_RENDER_PREFETCH", "0")))
+        if render_workers > 0:
+            self._render_pool = ProcessPoolExecutor(max_workers=render_workers, mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"Initialized PDF render pool with {render_workers} processes")
+        
+        # Caché LRU de resultados de PDFs por hash de contenido: los duplicados (plantillas, copias en
+        # varias subcarpetas) no repiten renderizado ni inferencia (0 = desactivada)
+        self._pdf_cache_size = int(os.getenv("PDF_CACHE_SIZE", "256"))
+        self._pdf_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._pdf_cache_lock = threading.Lock()
+        # Segundo nivel persistente en SQLite (PDF_CACHE_DIR): los resultados sobreviven entre ejecuciones,
+        # así que al reprocesar una carpeta los PDFs ya vistos no se renderizan ni se envían al modelo
+        pdf_cache_dir = os.getenv("PDF_CACHE_DIR", "").strip()
+        self._pdf_store: Optional[ResultCache] = None
+        if pdf_cache_dir:
+            ttl_days = float(os.getenv("PDF_CACHE_TTL_DAYS", "30"))
+            self._pdf_store = ResultCache(os.path.join(pdf_cache_dir, "pdf_results.sqlite3"), ttl_seconds=ttl_days * 86400)
+        self._pdf_inflight: Dict[tuple, threading.Event] = {}
+        
+        # Configuración leída en cada documento o comprimido: se resuelve una sola vez
+        # Por defecto (0) todos los documentos de un comprimido van en vuelo a la vez hasta MAX_CONCURRENT_INFERENCE,
+        # para que vLLM los agrupe en batch (continuous batching) en lugar de atenderlos de 4 en 4
+        self._archive_workers = int(os.getenv("ARCHIVE_WORKERS", "0"))
+        self._archive_max_files = int(os.getenv("ARCHIVE_MAX_FILES", "0"))
+        self._extract_workers = max(1, int(os.getenv("ARCHIVE_EXTRACT_WORKERS", "4")))
+        self._content_limit = int(os.getenv("XML_EML_CONTENT_LIMIT", "5000"))
+        # XML y EML con Structured Outputs: título y descripción en una sola llamada al LLM (en lugar de dos)
+        self._text_structured = os.getenv("XML_EML_STRUCTURED", "false").lower() == "true"
+        self._macro_max_chars = int(os.getenv("MACRO_SUMMARY_MAX_CHARS", "32000"))
+        self._macro_chunk_size = int(os.getenv("MACRO_SUMMARY_CHUNK_SIZE", "20"))
+        self._macro_structured = os.getenv("MACRO_SUMMARY_STRUCTURED", "false").lower() == "true"
+        self._folder_cache_ttl = float(os.getenv("GDRIVE_FOLDER_CACHE_TTL", "60"))
+        self._adaptive_workers_beta = float(os.getenv("ADAPTIVE_WORKERS_BETA", "0"))
+        
+        # Prompts de PDF/DOCX ya construidos, por idioma (ver _get_vllm_prompt_and_schema)
+        self._vllm_prompts: Dict[str, str] = {}
+        # Partes de los prompts que solo dependen del .env: límite de palabras y lista de nombres
+        # a normalizar (separados por comas), ya con el formato "Nombre 1", "Nombre 2"
+        self._description_word_limit = int(os.getenv("DESCRIPTION_WORD_LIMIT", "250"))
+        self._normalize_names = ", ".join(
+            f'"{name.strip()}"' for name in os.getenv("NORMALIZE_NAMES", "").split(",") if name.strip()
+        )
+        
+        # Directorio de trabajo del procesador: cada llamada usa un subdirectorio propio y su borrado
+        # (p.ej. el árbol extraído de un comprimido) se hace en segundo plano, fuera del camino crítico.
+        # SCRATCH_DIR permite situarlo en un tmpfs (p.ej. /dev/shm): las imágenes de las páginas y los
+        # archivos extraídos se escriben una vez, se leen una vez y se borran, así que no necesitan disco
+        scratch_dir = os.getenv("SCRATCH_DIR", "").strip() or None
+        if scratch_dir and not os.access(scratch_dir, os.W_OK):
+            logger.warning(f"SCRATCH_DIR={scratch_dir} no existe o no es escribible; se usa el directorio temporal del sistema")
+            scratch_dir = None
+        self._scratch_root = tempfile.mkdtemp(prefix="docproc-", dir=scratch_dir)
+        self._cleanup_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scratch-cleanup")
+        atexit.register(shutil.rmtree, self._scratch_root, True)
+        # Los archivos temporales de los renderizadores (PDF volcado para pdf2image, perfil de LibreOffice)
+        # también van al directorio de trabajo, no al directorio temporal del sistema
+        self.pdf_processor = PDFProcessor(self._scratch_root)
+        self.docx_processor = DOCXProcessor(self._scratch_root)
+        
+        # Listados de carpetas de Google Drive indexados por nombre: {folder_id: (instante, {nombre: item})}
+        self._folder_cache: Dict[str, Tuple[float, Dict[str, Dict]]] = {}
+        self._folder_cache_lock = threading.Lock()
+        self._folder_list_locks: Dict[str, threading.Lock] = {}
         
         logger.info(f"Initialized VLLM service with model: {vllm_model}")
         
         self.gdrive_service = GoogleDriveService() if os.getenv("GOOGLE_DRIVE_ENABLED", "true").lower() == "true" else None
         
+    def shutdown(self):
+        """Libera los recursos compartidos del procesador (pool de renderizado de PDFs y directorio de trabajo)"""
+        if self._render_pool is not None:
+            self._render_pool.shutdown(wait=False, cancel_futures=True)
+            self._render_pool = None
+        self._cleanup_pool.shutdown(wait=True)
+        shutil.rmtree(self._scratch_root, ignore_errors=True)
+        if self._pdf_store is not None:
+            self._pdf_store.close()
+
+    def _new_temp_dir(self) -> str:
+        """Crea un subdirectorio de trabajo nuevo dentro del directorio del procesador
+
+        mkdtemp crea el directorio de forma atómica: no depende de un contador compartido entre hilos.
+        """
+        return tempfile.mkdtemp(prefix="job-", dir=self._scratch_root)
+
+    def _discard_temp_dir(self, path: str) -> None:
+        """Borra un subdirectorio de trabajo en segundo plano (en el hilo actual si el procesador ya se cerró)"""
+        try:
+            self._cleanup_pool.submit(shutil.rmtree, path, True)
+        except RuntimeError:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _get_archive_workers(self) -> int:
+        """Hilos para procesar archivos dentro de un comprimido (ARCHIVE_WORKERS)
+        
+        ARCHIVE_WORKERS=0 lanza a la vez tantas peticiones como permite MAX_CONCURRENT_INFERENCE,
+        para que el servidor vLLM agrupe en batch todos los documentos internos del comprimido.
+        """
+        return self._archive_workers if self._archive_workers > 0 else self._max_concurrent_inference
+
+    def _render_pdf(self, pdf_path: Union[str, bytes], initial_pages: int, final_pages: int) -> List[Any]:
+        """Renderiza las páginas del PDF (ruta o bytes) en el pool de procesos si está configurado, o en el hilo actual
+
+        El pool devuelve las páginas ya codificadas en JPEG (bytes), listas para analyze_vllm.
+        """
+        if self._render_pool is not None:
+            try:
+                return self._render_pool.submit(render_pdf_pages_jpeg, pdf_path, initial_pages, final_pages,
+                                                self.vllm_service.image_max_dim, self.vllm_service.image_quality,
+                                                self._scratch_root).result()
+            except BrokenProcessPool as e:
+                logger.warning(f"Pool de renderizado no disponible ({e}). Renderizando en el hilo actual...")
+        return self.pdf_processor.convert_to_images(pdf_path, initial_pages, final_pages)
+
+    def _extract_text(self, pool_func, local_func, path: str, data: Optional[bytes] = None) -> str:
+        """Extrae el texto de un XML/EML (de path, o de data si viene en memoria) en el pool de procesos si está configurado, o en el hilo actual
+
+        El recorrido del árbol XML y la decodificación de los emails son Python puro: en el pool no
+        compiten por el GIL con los hilos que esperan la inferencia.
+        """
+        if self._render_pool is not None:
+            try:
+                return self._render_pool.submit(pool_func, path, data).result()
+            except BrokenProcessPool as e:
+                logger.warning(f"Pool de procesos no disponible ({e}). Extrayendo en el hilo actual...")
+        return local_func(path, data)
+
+    def _pdf_cache_get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        """Devuelve una copia del resultado cacheado para key (memoria y después PDF_CACHE_DIR), o None"""
+        with self._pdf_cache_lock:
+            cached = self._pdf_cache.get(key)
+            if cached is not None:
+                self._pdf_cache.move_to_end(key)
+        if cached is None:
+            if self._pdf_store is None:
+                return None
+            cached = self._pdf_store.get(ResultCache.make_key(key))
+            if cached is None:
+                return None
+            self._pdf_cache_put(key, cached, persist=False)
+        return {**cached, "metadata": dict(cached["metadata"])}
+
+    def _pdf_cache_put(self, key: tuple, result: Dict[str, Any], persist: bool = True) -> None:
+        """Guarda un resultado en la caché de PDFs, descartando el menos usado si se supera PDF_CACHE_SIZE"""
+        with self._pdf_cache_lock:
+            self._pdf_cache[key] = {**result, "metadata": dict(result["metadata"])}
+            self._pdf_cache.move_to_end(key)
+            while len(self._pdf_cache) > self._pdf_cache_size:
+                self._pdf_cache.popitem(last=False)
+        if persist and self._pdf_store is not None:
+            self._pdf_store.put(ResultCache.make_key(key), result)
+
+    def _pdf_inflight_claim(self, key: tuple) -> Optional[threading.Event]:
+        """Marca key como en proceso por este hilo (devuelve None) o devuelve el evento del hilo que ya lo procesa"""
+        with self._pdf_cache_lock:
+            pending = self._pdf_inflight.get(key)
+            if pending is None:
+                self._pdf_inflight[key] = threading.Event()
+            return pending
+
+    def _pdf_inflight_release(self, key: tuple) -> None:
+        """Libera key y despierta a los hilos que esperaban su resultado"""
+        with self._pdf_cache_lock:
+            pending = self._pdf_inflight.pop(key, None)
+        if pending is not None:
+            pending.set()
+
+    def _pdf_cache_key(self, pdf_source: Union[str, bytes], language: str, initial_pages: int, final_pages: int,
+                       max_tokens: Optional[int], temperature_vllm: Optional[float], top_p: Optional[float],
+                       top_k: Optional[int], vllm_model: Optional[str]) -> Optional[tuple]:
+        """Clave de la caché de PDFs: hash del contenido más todo lo que influye en la respuesta del modelo.
+        Devuelve None si la caché está desactivada o no se pudo leer el archivo"""
+        if self._pdf_cache_size <= 0 and self._pdf_store is None:
+            return None
+        try:
+            if isinstance(pdf_source, str):
+                with open(pdf_source, 'rb') as f:
+                    content_hash = hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+            else:
+                content_hash = hashlib.blake2b(pdf_source, digest_size=16).hexdigest()
+        except OSError as e:
+            logger.warning(f"No se pudo calcular el hash de {os.path.basename(pdf_source)}: {e}")
+            return None
+        # El prompt (DESCRIPTION_WORD_LIMIT, NORMALIZE_NAMES) y el tamaño/calidad de las imágenes enviadas
+        # también cambian la respuesta: sin ellos, PDF_CACHE_DIR devolvería resultados de otra configuración
+        prompt_hash = hashlib.blake2b(self._get_vllm_prompt_and_schema(language)[0].encode("utf-8"), digest_size=16).hexdigest()
+        return (content_hash, language, initial_pages, final_pages, max_tokens,
+                temperature_vllm, top_p, top_k, vllm_model or self.vllm_service.model,
+                prompt_hash, self.vllm_service.image_max_dim, self.vllm_service.image_quality)
+
+    def _pdf_result_known(self, key: Optional[tuple]) -> bool:
+        """Indica si el resultado para key ya está en la caché (memoria o PDF_CACHE_DIR) o lo está calculando otro hilo"""
+        if key is None:
+            return False
+        with self._pdf_cache_lock:
+            if key in self._pdf_inflight:
+                return True
+        return self._pdf_cache_get(key) is not None
+
+    def _can_stream_pdf(self, file_name: str, initial_pages: int, final_pages: int) -> bool:
+        """Indica si un archivo de Google Drive es un PDF que se puede descargar y renderizar en memoria"""
+        return file_name.lower().endswith('.pdf') and self.pdf_processor.can_render_bytes(initial_pages, final_pages)
+
     def _get_vllm_prompt_and_schema(self, language: str = "es") -> Tuple[str, dict]:
-        """Genera el prompt y schema unificados para PDF y DOCX (VLLM multimodal)"""
+        """Genera el prompt y schema unificados para PDF y DOCX (VLLM multimodal)
+
+        El prompt solo depende del idioma y de la configuración del .env, así que se construye una vez
+        por idioma y se reutiliza en el resto de documentos.
+        """
+        prompt = self._vllm_prompts.get(language)
+        if prompt is None:
+            prompt = self._build_vllm_prompt(language)
+            self._vllm_prompts[language] = prompt
+        return prompt, DOCUMENT_ANALYSIS_SCHEMA
+
+    def _build_vllm_prompt(self, language: str) -> str:
+        """Construye el prompt unificado para PDF y DOCX en el idioma indicado"""
         # Convertir código de idioma a nombre completo
-        language_names = {
-            "es": "español",
-            "en": "inglés",
-            "fr": "francés",
-            "de": "alemán",
-            "it": "italiano",
-            "pt": "portugués"
-        }
-        language_name = language_names.get(language.lower(), "español")
+        language_name = _LANGUAGE_NAMES.get(language.lower(), "español")
         
-        # Obtener límite de palabras para descripciones desde variable de entorno
-        description_word_limit = int(os.getenv("DESCRIPTION_WORD_LIMIT", "250"))
-        
-        # Obtener lista de nombres para normalizar (opcional)
-        normalize_names_str = os.getenv("NORMALIZE_NAMES", "").strip()
+        # Límite de palabras (DESCRIPTION_WORD_LIMIT) y nombres a normalizar (NORMALIZE_NAMES), resueltos en __init__
+        description_word_limit = self._description_word_limit
         normalize_names_instruction = ""
-        if normalize_names_str:
-            # Parsear la lista de nombres (separados por comas)
-            names_list = [name.strip() for name in normalize_names_str.split(",") if name.strip()]
-            if names_list:
-                names_text = ", ".join([f'"{name}"' for name in names_list])
-                normalize_names_instruction = f"""
+        if self._normalize_names:
+            names_text = self._normalize_names
+            normalize_names_instruction = f"""
 NORMALIZACIÓN DE NOMBRES IMPORTANTES:
 Si detectas en el documento nombres de personas que puedan corresponder a alguno de estos nombres normalizados, DEBES usar la versión normalizada exacta:
 {names_text}
@@ -97,20 +459,7 @@ REGLAS CRÍTICAS para normalización:
 """
 
         # Instrucción fija para normalización de términos comerciales
-        normalize_terms_instruction = """
-NORMALIZACIÓN DE TÉRMINOS COMERCIALES:
-Cuando el documento sea una simple lista de precios de materiales, productos o una actuación/servicio concreto (sin un alcance de proyecto mayor), utiliza el término "presupuesto" para describirlo, independientemente de cómo se titule el documento original.
-
-Ejemplos que DEBEN normalizarse a "presupuesto":
-- "Factura proforma" con lista de materiales y precios
-- "Cotización de materiales"
-- "Oferta de precios" para productos o servicios puntuales
-- Documentos que solo listan artículos/servicios con sus precios
-
-Ejemplos que NO deben normalizarse (mantener su denominación original):
-- "Propuesta económica" o "Propuesta técnico-económica" para proyectos
-- "Oferta" con alcance de proyecto, fases, entregables
-- Documentos que describen la realización de un proyecto completo"""
+        normalize_terms_instruction = _NORMALIZE_TERMS_INSTRUCTION
 
         # Prompt unificado para PDF y DOCX
         prompt = f"""Analiza este documento y genera un título y una descripción en texto plano.
@@ -137,26 +486,9 @@ Tu respuesta DEBE ser un objeto JSON con las claves "title" y "description".
 
 Responde en {language_name}."""
         
-        # Schema unificado para Structured Outputs
-        schema = {
-            "type": "object",
-            "properties": {
-                "title": {
-                    "type": "string",
-                    "description": "A representative title (maximum 15-20 words) that semantically describes the document content. The title should be self-contained and summarize the essence and meaning of the document."
-                },
-                "description": {
-                    "type": "string",
-                    "description": "A complete plain text description of the document."
-                }
-            },
-            "required": ["title", "description"],
-            "additionalProperties": False
-        }
-        
-        return prompt, schema
+        return prompt
 
-    def _get_description_prompt(self, content: str, content_type: str, language: str = "es") -> str:
+    def _get_description_prompt(self, content: str, content_type: str, language: str = "es", structured: bool = False) -> str:
         """
         Genera un prompt unificado para obtener descripciones de documentos (ZIP, XML, EML)
         
@@ -164,33 +496,21 @@ Responde en {language_name}."""
             content: Contenido a analizar (descripciones de ZIP, contenido XML, o contenido EML)
             content_type: Tipo de contenido ("zip", "xml", o "eml")
             language: Idioma para la respuesta (código: "es", "en", etc.)
+            structured: Pide un objeto JSON (Structured Outputs) en lugar de texto plano: {"description": ...}
+                        para "zip" y {"title": ..., "description": ...} para "xml" y "eml"
             
         Returns:
             Prompt formateado para el LLM
         """
         # Convertir código de idioma a nombre completo
-        language_names = {
-            "es": "español",
-            "en": "inglés",
-            "fr": "francés",
-            "de": "alemán",
-            "it": "italiano",
-            "pt": "portugués"
-        }
-        language_name = language_names.get(language.lower(), "español")
-        
-        # Obtener límite de palabras para descripciones desde variable de entorno
-        description_word_limit = int(os.getenv("DESCRIPTION_WORD_LIMIT", "250"))
+        language_name = _LANGUAGE_NAMES.get(language.lower(), "español")
         
-        # Obtener lista de nombres para normalizar (opcional)
-        normalize_names_str = os.getenv("NORMALIZE_NAMES", "").strip()
+        # Límite de palabras (DESCRIPTION_WORD_LIMIT) y nombres a normalizar (NORMALIZE_NAMES), resueltos en __init__
+        description_word_limit = self._description_word_limit
         normalize_names_instruction = ""
-        if normalize_names_str:
-            # Parsear la lista de nombres (separados por comas)
-            names_list = [name.strip() for name in normalize_names_str.split(",") if name.strip()]
-            if names_list:
-                names_text = ", ".join([f'"{name}"' for name in names_list])
-                normalize_names_instruction = f"""
+        if self._normalize_names:
+            names_text = self._normalize_names
+            normalize_names_instruction = f"""
 NORMALIZACIÓN DE NOMBRES IMPORTANTES:
 Si detectas nombres de personas que puedan corresponder a alguno de estos nombres normalizados, DEBES usar la versión normalizada exacta:
 {names_text}
@@ -205,32 +525,39 @@ REGLAS CRÍTICAS para normalización:
 """
 
         # Instrucción fija para normalización de términos comerciales
-        normalize_terms_instruction = """
-NORMALIZACIÓN DE TÉRMINOS COMERCIALES:
-Cuando el documento sea una simple lista de precios de materiales, productos o una actuación/servicio concreto (sin un alcance de proyecto mayor), utiliza el término "presupuesto" para describirlo, independientemente de cómo se titule el documento original.
-
-Ejemplos que DEBEN normalizarse a "presupuesto":
-- "Factura proforma" con lista de materiales y precios
-- "Cotización de materiales"
-- "Oferta de precios" para productos o servicios puntuales
-- Documentos que solo listan artículos/servicios con sus precios
-
-Ejemplos que NO deben normalizarse (mantener su denominación original):
-- "Propuesta económica" o "Propuesta técnico-económica" para proyectos
-- "Oferta" con alcance de proyecto, fases, entregables
-- Documentos que describen la realización de un proyecto completo"""
+        normalize_terms_instruction = _NORMALIZE_TERMS_INSTRUCTION
+
+        # En los prompts de XML y EML (uno por documento) el contenido va al final: todas las instrucciones
+        # forman un prefijo idéntico entre peticiones que el servidor puede reutilizar (--enable-prefix-caching)
+        if content_type in ("xml", "eml"):
+            if structured:
+                output_rules = """- Responde ÚNICAMENTE con un objeto JSON con los campos "title" y "description"
+- "title" es un título representativo (máximo 15-20 palabras) que identifique el documento
+- "description" es texto plano: sin saltos de línea, sin markdown y sin etiquetas como "resumen:" o similares"""
+                task = "genera un título y una descripción en texto plano"
+            else:
+                output_rules = """- Responde ÚNICAMENTE con texto plano, sin formato JSON ni otro formato que no sea texto plano
+- NO uses comillas, llaves, corchetes, saltos de línea, ni ningún formato estructurado
+- NO incluyas etiquetas como "description:", "resumen:" o similares
+- Responde directamente con el texto de la descripción"""
+                task = "genera una descripción en texto plano"
 
         if content_type == "zip":
+            if structured:
+                output_rules = """- Responde ÚNICAMENTE con un objeto JSON con un solo campo "description"
+- El valor de "description" es texto plano: sin saltos de línea, sin markdown y sin etiquetas como "resumen:" o similares"""
+            else:
+                output_rules = """- Responde ÚNICAMENTE con texto plano, sin formato JSON ni otro formato que no sea texto plano
+- NO uses comillas, llaves, corchetes, saltos de línea, ni ningún formato estructurado
+- NO incluyas etiquetas como "description:", "resumen:" o similares
+- Responde directamente con el texto de la descripción"""
             prompt = f"""Analiza las siguientes descripciones de documentos contenidos en un archivo ZIP y genera una breve descripción en TEXTO PLANO que resuma semánticamente el contenido de la colección completa.
 
 Descripciones:
 {content}
 
 IMPORTANTE:
-- Responde ÚNICAMENTE con texto plano, sin formato JSON ni otro formato que no sea texto plano
-- NO uses comillas, llaves, corchetes, saltos de línea, ni ningún formato estructurado
-- NO incluyas etiquetas como "description:", "resumen:" o similares
-- Responde directamente con el texto de la descripción
+{output_rules}
 - El resumen debe ser completo, directo y capturar el propósito y los detalles clave del conjunto (entidades, fechas, montos)
 - La descripción debe capturar en no más de {description_word_limit} palabras los conceptos más importantes para luego poder ser utilizada en un sistema de búsqueda semántica
 
@@ -249,18 +576,12 @@ CRÍTICO - REGLAS DE SALIDA:
 
 Responde en {language_name}."""
         elif content_type == "xml":
-            prompt = f"""Analiza el siguiente contenido XML y genera una descripción en texto plano.
-
-Contenido XML:
-{content}
+            prompt = f"""Analiza el contenido XML incluido al final y {task}.
 
 El resumen debe ser completo, directo y capturar el propósito y los detalles clave del documento (entidades, fechas, montos, estructura).
 
 IMPORTANTE:
-- Responde ÚNICAMENTE con texto plano, sin formato JSON ni otro formato que no sea texto plano
-- NO uses comillas, llaves, corchetes, saltos de línea, ni ningún formato estructurado
-- NO incluyas etiquetas como "description:", "resumen:" o similares
-- Responde directamente con el texto de la descripción
+{output_rules}
 - La descripción debe capturar en no más de {description_word_limit} palabras los conceptos más importantes para luego poder ser utilizada en un sistema de búsqueda semántica
 
 {normalize_names_instruction}
@@ -276,20 +597,17 @@ CRÍTICO - REGLAS DE SALIDA:
 - Aplica cualquier transformación silenciosamente sin explicar ni justificar
 - La descripción debe ser una descripción directa del contenido del documento, nada más
 
-Responde en {language_name}."""
-        elif content_type == "eml":
-            prompt = f"""Analiza el siguiente email y genera una descripción en texto plano.
+Responde en {language_name}.
 
-Email:
-{content}
+Contenido XML:
+{content}"""
+        elif content_type == "eml":
+            prompt = f"""Analiza el email incluido al final y {task}.
 
 El resumen debe ser completo, directo y capturar el propósito del email, asunto, remitente, destinatario y contenido principal.
 
 IMPORTANTE:
-- Responde ÚNICAMENTE con texto plano, sin formato JSON ni otro formato que no sea texto plano
-- NO uses comillas, llaves, corchetes, saltos de línea, ni ningún formato estructurado
-- NO incluyas etiquetas como "description:", "resumen:" o similares
-- Responde directamente con el texto de la descripción
+{output_rules}
 - La descripción debe capturar en no más de {description_word_limit} palabras los conceptos más importantes para luego poder ser utilizada en un sistema de búsqueda semántica
 
 {normalize_names_instruction}
@@ -305,7 +623,10 @@ CRÍTICO - REGLAS DE SALIDA:
 - Aplica cualquier transformación silenciosamente sin explicar ni justificar
 - La descripción debe ser una descripción directa del contenido del documento, nada más
 
-Responde en {language_name}."""
+Responde en {language_name}.
+
+Email:
+{content}"""
         else:
             raise ValueError(f"Tipo de contenido no soportado: {content_type}")
         
@@ -324,15 +645,7 @@ Responde en {language_name}."""
             Prompt formateado para el LLM
         """
         # Convertir código de idioma a nombre completo
-        language_names = {
-            "es": "español",
-            "en": "inglés",
-            "fr": "francés",
-            "de": "alemán",
-            "it": "italiano",
-            "pt": "portugués"
-        }
-        language_name = language_names.get(language.lower(), "español")
+        language_name = _LANGUAGE_NAMES.get(language.lower(), "español")
         # Partes comunes a todos los tipos
         common_rules = """REGLAS ESTRICTAS:
 - El título DEBE ser representativo del contenido, autocontenido y descriptivo del significado y propósito. Máximo 15-20 palabras
@@ -365,13 +678,7 @@ Ejemplos de títulos MALOS (específicos de un solo documento, no de la colecci
 - "Factura Proforma A1263-25" (solo describe un documento)
 - "Correo Electrónico" (solo describe un documento)
 
-INSTRUCCIONES CRÍTICAS:
-- NO escribas tu razonamiento, NO expliques cómo llegaste al título
-- NO uses frases como "Voy a analizar..." o "Necesito pensar..." o "Déjame pensar..."
-- NO muestres tu proceso de pensamiento o chain of thought
-- Responde DIRECTAMENTE con el título, sin explicaciones ni razonamiento
-- Escribe ÚNICAMENTE el título dentro de las etiquetas <answer></answer>
-- NO escribas nada fuera de las etiquetas <answer></answer>
+Escribe ÚNICAMENTE el título dentro de las etiquetas <answer></answer>.
 
 Responde en {language_name}.
 
@@ -391,13 +698,7 @@ Descripción:
 Ejemplo de buen título: "Asesoramiento Transformación Digital"
 Ejemplo de título MALO (demasiado largo o específico): "Transacción entre entidades en Gijón, Asturias: Asesoramiento 360 en Transformación digital, 7260 EUR..."
 
-INSTRUCCIONES CRÍTICAS:
-- NO escribas tu razonamiento, NO expliques cómo llegaste al título
-- NO uses frases como "Voy a analizar..." o "Necesito pensar..." o "Déjame pensar..."
-- NO muestres tu proceso de pensamiento o chain of thought
-- Responde DIRECTAMENTE con el título, sin explicaciones ni razonamiento
-- Escribe ÚNICAMENTE el título dentro de las etiquetas <answer></answer>
-- NO escribas nada fuera de las etiquetas <answer></answer>
+Escribe ÚNICAMENTE el título dentro de las etiquetas <answer></answer>.
 
 Responde en {language_name}.
 
@@ -412,22 +713,7 @@ Responde en {language_name}.
         if not description:
             return True
         
-        error_indicators = [
-            "Error:",
-            "error:",
-            "Error al procesar",
-            "Error procesando",
-            "Error descargando",
-            "Error generando",
-            "El modelo no devolvió contenido",
-            "no devolvió contenido",
-            "failed",
-            "Failed",
-            "FAILED"
-        ]
-        
-        description_lower = description.lower()
-        return any(indicator.lower() in description_lower for indicator in error_indicators)
+        return _ERROR_DESCRIPTION_RE.search(description) is not None
     
     def _clean_description(self, text: str) -> str:
         """
@@ -442,23 +728,38 @@ Responde en {language_name}.
         if not text:
             return ""
         
-        # Primero limpiar escapes
-        text = text.replace('\\"', '"')  # Escapes de comillas dobles
-        text = text.replace("\\'", "'")  # Escapes de comillas simples
-        text = text.replace('\\\\', '')   # Backslashes dobles
-        text = text.replace('\\n', ' ')   # Saltos de línea escapados -> espacio
-        text = text.replace('\\t', ' ')   # Tabs escapados -> espacio
-        text = text.replace('\\r', ' ')   # Retornos de carro escapados -> espacio
-        
-        # Eliminar TODAS las comillas (simples y dobles)
-        text = text.replace('"', '')
-        text = text.replace("'", '')
-        
-        # Eliminar cualquier backslash restante
-        text = text.replace('\\', '')
-        
-        return text.strip()
+        # Primero limpiar escapes (saltos de línea, tabs y retornos escapados -> espacio)
+        text = _ESCAPE_RE.sub(lambda m: ' ' if m.group(1) else '', text)
+        
+        # Eliminar TODAS las comillas (simples y dobles) y cualquier backslash restante
+        return text.translate(_QUOTES_TABLE).strip()
+        
+    def _pick_description(self, data: Any) -> Optional[str]:
+        """Elige la descripción de un JSON ya parseado (claves conocidas o, si no, el valor más largo)"""
+        if not isinstance(data, dict):
+            return None
+        # Normalizar claves del diccionario para búsqueda insensible
+        data_lower = {k.lower(): v for k, v in data.items()}
+        
+        for key in _DESCRIPTION_KEYS:
+            if key in data_lower:
+                result = str(data_lower[key]).strip()
+                # Limpiar escapes de comillas y backslashes
+                result = result.replace('\\"', '"').replace("\\'", "'")
+                result = result.replace('\\\\', '')
+                return result
         
+        # Si no encontramos las claves, coger el valor string más largo del objeto
+        # (solo strings: serializar objetos o listas anidados con str() no da una descripción útil)
+        str_values = [v for v in data.values() if isinstance(v, str)]
+        if str_values:
+            result = max(str_values, key=len).strip()
+            # Limpiar escapes
+            result = result.replace('\\"', '"').replace("\\'", "'")
+            result = result.replace('\\\\', '')
+            return result
+        return None
+
     def _extract_description(self, response_content: str, fallback_msg: str = "Resumen no disponible") -> str:
         """Extrae la descripción de un JSON de forma robusta, manejando markdown y texto extra"""
         if not response_content:
@@ -466,51 +767,41 @@ Responde en {language_name}.
 
         clean_content = response_content.strip()
         
+        # 0. Camino rápido: con Structured Outputs la respuesta suele ser ya un JSON limpio
+        if clean_content.startswith('{') and clean_content.endswith('}'):
+            try:
+                result = self._pick_description(_json_loads(clean_content))
+                if result is not None:
+                    return result
+            except json.JSONDecodeError:
+                pass
+        
         # 1. Intentar limpiar bloques de código Markdown (```json ... ```)
-        import re
         if "```" in clean_content:
-            match = re.search(r"```(?:json)?\s*([\s\S]*?)```", clean_content)
+            match = _CODEBLOCK_RE.search(clean_content)
             if match:
                 clean_content = match.group(1).strip()
         
-        # 2. Intentar buscar el primer '{' y el último '}' por si hay texto alrededor
+        # 2. Buscar el primer objeto JSON válido aunque haya texto alrededor (incluso con llaves sueltas
+        # antes o después): se prueba a decodificar desde cada '{' hasta que uno funcione
         start_idx = clean_content.find('{')
-        end_idx = clean_content.rfind('}')
-        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-            json_str = clean_content[start_idx:end_idx+1]
+        while start_idx != -1:
             try:
-                data = json.loads(json_str)
-                # Lista de claves posibles (insensible a mayúsculas/minúsculas)
-                keys_to_try = ["description", "descripcion", "macro-description", "macro-descripcion", "summary", "resumen"]
-                
-                # Normalizar claves del diccionario para búsqueda insensible
-                data_lower = {k.lower(): v for k, v in data.items()}
-                
-                for key in keys_to_try:
-                    if key in data_lower:
-                        result = str(data_lower[key]).strip()
-                        # Limpiar escapes de comillas y backslashes
-                        result = result.replace('\\"', '"').replace("\\'", "'")
-                        result = result.replace('\\\\', '')
-                        return result
-                
-                # Si no encontramos las claves, coger el valor string más largo del objeto
-                str_values = [str(v) for v in data.values() if isinstance(v, (str, dict, list))]
-                if str_values:
-                    result = max(str_values, key=len).strip()
-                    # Limpiar escapes
-                    result = result.replace('\\"', '"').replace("\\'", "'")
-                    result = result.replace('\\\\', '')
-                    return result
+                data, end_idx = _JSON_DECODER.raw_decode(clean_content, start_idx)
             except json.JSONDecodeError:
-                # Si no es JSON válido tras el recorte, seguimos al paso 3
-                pass
+                start_idx = clean_content.find('{', start_idx + 1)
+                continue
+            result = self._pick_description(data)
+            if result is not None:
+                return result
+            start_idx = clean_content.find('{', end_idx)
+        # Si ningún candidato es JSON válido, seguimos al paso 3
 
         # 3. Si no se pudo parsear como JSON, devolver el contenido limpio
         # Pero si parece JSON serializado (contiene {"description":), intentamos limpiar solo eso
         if '"description":' in clean_content or '"descripcion":' in clean_content:
             # Fallback simple: extraer solo lo que esté entre las segundas comillas tras la clave
-            simple_match = re.search(r'"descrip(?:tion|cion)"\s*:\s*"([^"]*)"', clean_content, re.IGNORECASE)
+            simple_match = _DESC_KEY_RE.search(clean_content)
             if simple_match:
                 extracted = simple_match.group(1).strip()
                 # Limpiar escapes
@@ -524,209 +815,326 @@ Responde en {language_name}.
 
         return clean_content.strip()
 
-    def process_pdf(self, pdf_path: str, language: str = "es", initial_pages: int = 2, final_pages: int = 2, max_tokens: Optional[int] = None, temperature_vllm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, vllm_model: Optional[str] = None) -> Dict[str, Any]:
-        """Procesa un PDF y genera su resumen"""
-        logger.info(f"Starting PDF processing: {os.path.basename(pdf_path)} (Language: {language})")
+    def process_pdf(self, pdf_path: str, language: str = "es", initial_pages: int = 2, final_pages: int = 2, max_tokens: Optional[int] = None, temperature_vllm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, vllm_model: Optional[str] = None, pdf_data: Optional[bytes] = None, images: Optional[List[Any]] = None) -> Dict[str, Any]:
+        """Procesa un PDF y genera su resumen
+
+        Si se pasa pdf_data (contenido del PDF en memoria), pdf_path solo se usa como nombre del archivo.
+        Si se pasan images (páginas ya renderizadas por la etapa de renderizado del pipeline), no se vuelve a renderizar.
+        """
+        file_name = os.path.basename(pdf_path)
+        logger.info(f"Starting PDF processing: {file_name} (Language: {language})")
         
         # Verificar si el archivo está vacío
         try:
-            if os.path.getsize(pdf_path) == 0:
-                logger.warning(f"Archivo PDF vacío ignorado: {os.path.basename(pdf_path)}")
+            if (len(pdf_data) if pdf_data is not None else os.path.getsize(pdf_path)) == 0:
+                logger.warning(f"Archivo PDF vacío ignorado: {file_name}")
                 return None  # Retornar None para indicar que debe ser ignorado
         except OSError as e:
             logger.warning(f"No se pudo verificar tamaño del archivo {pdf_path}: {e}")
         
-        temp_dir = tempfile.mkdtemp()
-        try:
-            # Convertir PDF a imágenes
+        # Caché por contenido: la clave incluye todo lo que influye en la respuesta del modelo
+        cache_key = self._pdf_cache_key(pdf_data if pdf_data is not None else pdf_path, language, initial_pages, final_pages,
+                                        max_tokens, temperature_vllm, top_p, top_k, vllm_model)
+        if cache_key is not None:
+            cached = self._pdf_cache_get(cache_key)
+            if cached is not None:
+                logger.info("PDF con contenido ya procesado, reutilizando resultado: %s", file_name)
+                return cached
+            # Duplicados procesados a la vez (p.ej. copias dentro de un mismo ZIP): solo el primero
+            # llama al modelo, el resto espera su resultado en la caché
+            pending = self._pdf_inflight_claim(cache_key)
+            if pending is not None:
+                logger.info("PDF con el mismo contenido en proceso, esperando su resultado: %s", file_name)
+                pending.wait()
+                cached = self._pdf_cache_get(cache_key)
+                if cached is not None:
+                    return cached
+            else:
+                try:
+                    return self._analyze_pdf(pdf_path, language, initial_pages, final_pages, max_tokens, temperature_vllm, top_p, top_k, vllm_model, pdf_data, images, cache_key)
+                finally:
+                    self._pdf_inflight_release(cache_key)
+        
+        return self._analyze_pdf(pdf_path, language, initial_pages, final_pages, max_tokens, temperature_vllm, top_p, top_k, vllm_model, pdf_data, images, cache_key)
+
+    def _analyze_pdf(self, pdf_path: str, language: str, initial_pages: int, final_pages: int, max_tokens: Optional[int], temperature_vllm: Optional[float], top_p: Optional[float], top_k: Optional[int], vllm_model: Optional[str], pdf_data: Optional[bytes], images: Optional[List[Any]], cache_key: Optional[tuple]) -> Dict[str, Any]:
+        """Renderiza el PDF (si no se pasan images), llama al modelo y guarda el resultado en la caché si cache_key no es None"""
+        file_name = os.path.basename(pdf_path)
+        # Convertir PDF a imágenes en memoria (sin directorio temporal)
+        if images is None:
             logger.info("Converting PDF to images...")
             try:
-                images = self.pdf_processor.convert_to_images(pdf_path, temp_dir, initial_pages, final_pages)
+                images = self._render_pdf(pdf_data if pdf_data is not None else pdf_path, initial_pages, final_pages)
             except Exception as e:
                 error_msg = str(e).lower()
                 # Detectar PDFs corruptos o truncados
                 if 'truncated' in error_msg or 'corrupt' in error_msg or 'image file is truncated' in error_msg:
-                    logger.warning(f"PDF corrupto/truncado detectado: {os.path.basename(pdf_path)}")
+                    logger.warning(f"PDF corrupto/truncado detectado: {file_name}")
                     return None  # Retornar None para indicar que debe ser ignorado
                 else:
                     logger.error(f"Error al convertir PDF a imágenes: {e}")
                     return {
-                        "title": os.path.basename(pdf_path),
+                        "title": file_name,
                         "description": f"Error: No se pudieron extraer imágenes del PDF: {str(e)}",
                         "metadata": {"error": True}
                     }
-            
-            if not images:
-                logger.error("Failed to extract images from PDF")
-                return {
-                    "title": os.path.basename(pdf_path),
-                    "description": "Error: No se pudieron extraer imágenes del PDF",
-                    "metadata": {"error": True}
-                }
-            
-            logger.info(f"Extracted {len(images)} images. Preparing model prompt.")
-            
-            # Obtener prompt y schema unificados
-            prompt, schema = self._get_vllm_prompt_and_schema(language)
-            
-            # Analizar con LLM multimodal usando Structured Outputs
-            logger.info("Calling Multimodal Service...")
-            with self.inference_semaphore:
-                response_content = self.vllm_service.analyze_vllm(images, prompt, max_tokens, schema, temperature_vllm, top_p, top_k, model=vllm_model)
+        
+        if not images:
+            logger.error("Failed to extract images from PDF")
+            return {
+                "title": file_name,
+                "description": "Error: No se pudieron extraer imágenes del PDF",
+                "metadata": {"error": True}
+            }
+        
+        logger.info(f"Extracted {len(images)} images. Preparing model prompt.")
+        
+        # Obtener prompt y schema unificados
+        prompt, schema = self._get_vllm_prompt_and_schema(language)
+        
+        # Analizar con LLM multimodal usando Structured Outputs
+        logger.info("Calling Multimodal Service...")
+        with self.inference_semaphore:
+            response_content = self.vllm_service.analyze_vllm(images, prompt, max_tokens, schema, temperature_vllm, top_p, top_k, model=vllm_model)
 
-            # Extraer title y description del JSON
-            try:
-                import json
-                response_json = json.loads(response_content)
-                title = response_json.get("title", "").strip()
-                description = response_json.get("description", "").strip()
+        # Extraer title y description del JSON
+        try:
+            response_json = _json_loads(response_content)
+            title = response_json.get("title", "").strip()
+            description = response_json.get("description", "").strip()
 
-                # Fallback si no se obtienen correctamente
-                if not title:
-                    title = os.path.basename(pdf_path)
-                if not description:
-                    description = self._extract_description(response_content) or "Sin descripción disponible"
-            except Exception as e:
-                logger.warning(f"Error parsing structured output: {e}. Falling back to description extraction.")
-                description = self._extract_description(response_content) or "Sin descripción disponible"
-                title = os.path.basename(pdf_path)
-            
-            # Asegurar que siempre haya título y descripción
+            # Fallback si no se obtienen correctamente
             if not title:
-                title = os.path.basename(pdf_path)
+                title = file_name
             if not description:
-                description = "Sin descripción disponible"
-            
-            # Limpiar descripción: eliminar comillas y backslashes (SIEMPRE, sin importar de dónde venga)
-            description = self._clean_description(description)
-            
-            logger.info("Response parsed successfully")
+                description = self._extract_description(response_content) or "Sin descripción disponible"
+        except Exception as e:
+            logger.warning(f"Error parsing structured output: {e}. Falling back to description extraction.")
+            description = self._extract_description(response_content) or "Sin descripción disponible"
+            title = file_name
+        
+        # Solo se cachean respuestas completas del modelo (un título de fallback es el nombre de este archivo)
+        cacheable = cache_key is not None and bool(title) and title != file_name
+        
+        # Asegurar que siempre haya título y descripción
+        if not title:
+            title = file_name
+        if not description:
+            description = "Sin descripción disponible"
+        
+        # Limpiar descripción: eliminar comillas y backslashes (SIEMPRE, sin importar de dónde venga)
+        description = self._clean_description(description)
+        
+        logger.info("Response parsed successfully")
 
-            return {
-                "title": title,
-                "description": description,
-                "metadata": {
-                    "pages_processed": len(images),
-                    "language": language
-                }
+        result = {
+            "title": title,
+            "description": description,
+            "metadata": {
+                "pages_processed": len(images),
+                "language": language
             }
-        finally:
-            # Limpiar archivos temporales
-            shutil.rmtree(temp_dir, ignore_errors=True)
+        }
+        if cacheable and not self._is_error_description(description):
+            self._pdf_cache_put(cache_key, result)
+        return result
 
-    def process_docx(self, docx_path: str, language: str = "es", initial_pages: int = 2, final_pages: int = 2, max_tokens: Optional[int] = None, temperature_vllm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, vllm_model: Optional[str] = None) -> Dict[str, Any]:
-        """Procesa un DOCX/DOC/ODT y genera su resumen (igual que PDFs)"""
-        file_ext = os.path.splitext(docx_path)[1].lower()
+    def process_docx(self, docx_path: str, language: str = "es", initial_pages: int = 2, final_pages: int = 2, max_tokens: Optional[int] = None, temperature_vllm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, vllm_model: Optional[str] = None, images: Optional[List[Any]] = None) -> Dict[str, Any]:
+        """Procesa un DOCX/DOC/ODT y genera su resumen (igual que PDFs)
+
+        Si se pasan images (páginas ya convertidas por la etapa de renderizado del pipeline), no se vuelve a convertir;
+        una lista vacía indica que esa conversión falló y devuelve directamente el resultado de error.
+        """
+        file_name = os.path.basename(docx_path)
+        file_ext = os.path.splitext(file_name)[1].lower()
         file_type_name = {"docx": "DOCX", "doc": "DOC", "odt": "ODT"}.get(file_ext[1:], "DOCUMENTO")
-        logger.info(f"Starting {file_type_name} processing: {os.path.basename(docx_path)} (Language: {language})")
+        logger.info(f"Starting {file_type_name} processing: {file_name} (Language: {language})")
         
         # Verificar si el archivo está vacío
         try:
             if os.path.getsize(docx_path) == 0:
-                logger.warning(f"Archivo {file_type_name} vacío ignorado: {os.path.basename(docx_path)}")
+                logger.warning(f"Archivo {file_type_name} vacío ignorado: {file_name}")
                 return None  # Retornar None para indicar que debe ser ignorado
         except OSError as e:
             logger.warning(f"No se pudo verificar tamaño del archivo {docx_path}: {e}")
         
-        temp_dir = tempfile.mkdtemp()
-        try:
-            # Convertir DOCX/DOC/ODT a imágenes (primero convierte a PDF, luego a imágenes)
-            logger.info(f"Converting {file_type_name} to images...")
-            images = self.docx_processor.convert_to_images(docx_path, temp_dir, initial_pages, final_pages)
-            
-            if not images:
-                logger.error(f"Failed to extract images from {file_type_name}")
-                return {
-                    "title": os.path.basename(docx_path),
-                    "description": f"Error: No se pudieron extraer imágenes del {file_type_name}",
-                    "metadata": {}
-                }
-            
-            logger.info(f"Extracted {len(images)} images. Preparing model prompt.")
-            
-            # Obtener prompt y schema unificados
-            prompt, schema = self._get_vllm_prompt_and_schema(language)
-            
-            # Analizar con LLM multimodal usando Structured Outputs
-            logger.info("Calling Multimodal Service...")
-            with self.inference_semaphore:
-                response_content = self.vllm_service.analyze_vllm(images, prompt, max_tokens, schema, temperature_vllm, top_p, top_k, model=vllm_model)
-
-            # Extraer title y description del JSON
+        # Convertir DOCX/DOC/ODT a imágenes (primero convierte a PDF, luego a imágenes). Una lista vacía de la
+        # etapa de renderizado significa que la conversión ya falló: no se repite (cada intento puede agotar
+        # el timeout de LibreOffice)
+        if images is None:
+            temp_dir = self._new_temp_dir()
             try:
-                import json
-                response_json = json.loads(response_content)
-                title = response_json.get("title", "").strip()
-                description = response_json.get("description", "").strip()
+                logger.info(f"Converting {file_type_name} to images...")
+                images = self.docx_processor.convert_to_images(docx_path, temp_dir, initial_pages, final_pages)
+            finally:
+                # Limpiar archivos temporales
+                self._discard_temp_dir(temp_dir)
+        
+        if not images:
+            logger.error(f"Failed to extract images from {file_type_name}")
+            return {
+                "title": file_name,
+                "description": f"Error: No se pudieron extraer imágenes del {file_type_name}",
+                "metadata": {}
+            }
+        
+        logger.info(f"Extracted {len(images)} images. Preparing model prompt.")
+        
+        # Obtener prompt y schema unificados
+        prompt, schema = self._get_vllm_prompt_and_schema(language)
+        
+        # Analizar con LLM multimodal usando Structured Outputs
+        logger.info("Calling Multimodal Service...")
+        with self.inference_semaphore:
+            response_content = self.vllm_service.analyze_vllm(images, prompt, max_tokens, schema, temperature_vllm, top_p, top_k, model=vllm_model)
 
-                # Fallback si no se obtienen correctamente
-                if not title:
-                    title = os.path.basename(docx_path)
-                if not description:
-                    description = self._extract_description(response_content) or "Sin descripción disponible"
-            except Exception as e:
-                logger.warning(f"Error parsing structured output: {e}. Falling back to description extraction.")
-                description = self._extract_description(response_content) or "Sin descripción disponible"
-                title = os.path.basename(docx_path)
-            
-            # Asegurar que siempre haya título y descripción
+        # Extraer title y description del JSON
+        try:
+            response_json = _json_loads(response_content)
+            title = response_json.get("title", "").strip()
+            description = response_json.get("description", "").strip()
+
+            # Fallback si no se obtienen correctamente
             if not title:
-                title = os.path.basename(docx_path)
+                title = file_name
             if not description:
-                description = "Sin descripción disponible"
-            
-            # Limpiar descripción: eliminar comillas y backslashes (SIEMPRE, sin importar de dónde venga)
-            description = self._clean_description(description)
-            
-            logger.info("Response parsed successfully")
+                description = self._extract_description(response_content) or "Sin descripción disponible"
+        except Exception as e:
+            logger.warning(f"Error parsing structured output: {e}. Falling back to description extraction.")
+            description = self._extract_description(response_content) or "Sin descripción disponible"
+            title = file_name
+        
+        # Asegurar que siempre haya título y descripción
+        if not title:
+            title = file_name
+        if not description:
+            description = "Sin descripción disponible"
+        
+        # Limpiar descripción: eliminar comillas y backslashes (SIEMPRE, sin importar de dónde venga)
+        description = self._clean_description(description)
+        
+        logger.info("Response parsed successfully")
 
-            return {
-                "title": title,
-                "description": description,
-                "metadata": {
-                    "pages_processed": len(images),
-                    "language": language
-                }
+        return {
+            "title": title,
+            "description": description,
+            "metadata": {
+                "pages_processed": len(images),
+                "language": language
             }
-        finally:
-            # Limpiar archivos temporales
-            shutil.rmtree(temp_dir, ignore_errors=True)
+        }
+
+    def _is_supported_archive_member(self, member_name: str) -> bool:
+        """Indica si un miembro de un archivo comprimido se procesará (mismos criterios que el recorrido de process_archive)"""
+        if member_name.endswith('/') or '__MACOSX/' in member_name:
+            return False
+        base_name = member_name.rsplit('/', 1)[-1]
+        if base_name.startswith('._'):
+            return False
+        name_lower = base_name.lower()
+        if name_lower.endswith('.xsig'):
+            return False
+        return name_lower.endswith(self.ARCHIVE_MEMBER_EXTENSIONS)
+
+    def _zip_member_path(self, member: zipfile.ZipInfo, extracted_dir: str) -> str:
+        """Ruta de destino de un miembro de un ZIP, saneada igual que ZipFile.extract (sin unidad, sin componentes '..' ni absolutos)"""
+        arcname = member.filename.replace('/', os.path.sep)
+        arcname = os.path.splitdrive(arcname)[1]
+        parts = [p for p in arcname.split(os.path.sep) if p not in ('', os.path.curdir, os.path.pardir)]
+        return os.path.join(extracted_dir, *parts)
+
+    def _extract_zip_member(self, zip_ref: zipfile.ZipFile, member: zipfile.ZipInfo, extracted_dir: str) -> str:
+        """
+        Extrae un miembro de un ZIP copiándolo en streaming con un buffer de ZIP_COPY_BUFSIZE.
+
+        Returns:
+            Ruta del archivo extraído
+        """
+        target_path = self._zip_member_path(member, extracted_dir)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        with zip_ref.open(member) as src, open(target_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, self.ZIP_COPY_BUFSIZE)
+        return target_path
 
-    def _extract_archive(self, archive_path: str, extracted_dir: str) -> None:
+    def _extract_zip_members(self, zip_ref: zipfile.ZipFile, members: List[zipfile.ZipInfo], extracted_dir: str) -> None:
+        """
+        Extrae varios miembros de un ZIP, en paralelo con ARCHIVE_EXTRACT_WORKERS hilos.
+
+        ZipFile admite lecturas concurrentes (el acceso al fichero se serializa internamente) y zlib
+        libera el GIL al descomprimir, así que los miembros se descomprimen en varios núcleos a la vez.
+        """
+        workers = min(self._extract_workers, len(members))
+        if workers <= 1:
+            for member in members:
+                self._extract_zip_member(zip_ref, member, extracted_dir)
+            return
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zip-extract") as executor:
+            # list() propaga la primera excepción, como la extracción secuencial
+            list(executor.map(lambda member: self._extract_zip_member(zip_ref, member, extracted_dir), members))
+
+    def _extract_archive(self, archive_path: str, extracted_dir: str, streamed_pdfs: Optional[Dict[str, Tuple[Optional[str], zipfile.ZipInfo]]] = None,
+                         streamed_texts: Optional[Dict[str, Tuple[Optional[str], zipfile.ZipInfo]]] = None) -> Optional[List[str]]:
         """
         Extrae un archivo comprimido (ZIP, RAR, 7Z, TAR) al directorio especificado.
         
         Args:
             archive_path: Ruta al archivo comprimido
             extracted_dir: Directorio donde extraer los archivos
+            streamed_pdfs: Solo ZIP. Si se pasa un dict, los PDFs no se escriben a disco: se registran como
+                           {ruta de destino: (codificación de nombres, ZipInfo)} para leerlos del ZIP en memoria
+            streamed_texts: Solo ZIP. Igual que streamed_pdfs para los XML y EML (van al LLM de texto y no
+                            necesitan un fichero en disco)
+            
+        Returns:
+            Para ZIP, las rutas de los archivos extraídos (obtenidas del directorio central, sin
+            recorrer el disco). Para el resto de formatos None: hay que recorrer extracted_dir.
             
         Raises:
             ValueError: Si el formato del archivo no es soportado
             Exception: Si hay un error al extraer el archivo
         """
         archive_name = os.path.basename(archive_path).lower()
+        archive_extension = self._archive_extension(archive_name)
+        archive_type = self.ARCHIVE_TYPE_BY_EXTENSION.get(archive_extension)
         
-        if archive_name.endswith('.zip'):
+        if archive_type == "ZIP":
             logger.info("Extracting ZIP file...")
             zip_basename = os.path.basename(archive_path)
             extraction_successful = False
 
-            # Lista de codificaciones a intentar en orden de preferencia:
-            # 1. UTF-8: estándar moderno
-            # 2. CP1252: Windows-1252, común en ZIPs creados en Windows con caracteres españoles/europeos
-            # 3. CP437: DOS, común en ZIPs antiguos
-            encodings_to_try = [
-                ('utf-8', 'UTF-8'),
-                ('cp1252', 'CP1252 (Windows)'),
-                ('cp437', 'CP437 (DOS)'),
-            ]
-
             last_error = None
             failed_encodings = []
-            for encoding, encoding_name in encodings_to_try:
+            extracted_files = []
+
+            def add_member(zip_ref: zipfile.ZipFile, member: zipfile.ZipInfo, encoding: Optional[str],
+                           deferred: Optional[Dict[str, zipfile.ZipInfo]] = None):
+                name_lower = member.filename.lower()
+                streamed = streamed_pdfs if name_lower.endswith('.pdf') else streamed_texts if name_lower.endswith(('.xml', '.eml')) else None
+                if streamed is not None:
+                    target_path = self._zip_member_path(member, extracted_dir)
+                    streamed[target_path] = (encoding, member)
+                    extracted_files.append(target_path)
+                elif deferred is not None:
+                    # Se extrae después junto con el resto (en paralelo, ver _extract_zip_members)
+                    target_path = self._zip_member_path(member, extracted_dir)
+                    deferred[target_path] = member
+                    extracted_files.append(target_path)
+                else:
+                    extracted_files.append(self._extract_zip_member(zip_ref, member, extracted_dir))
+
+            for encoding, encoding_name in _ZIP_ENCODINGS:
+                extracted_files = []
+                for streamed in (streamed_pdfs, streamed_texts):
+                    if streamed is not None:
+                        streamed.clear()
                 try:
                     with zipfile.ZipFile(archive_path, 'r', metadata_encoding=encoding) as zip_ref:
-                        zip_ref.extractall(extracted_dir)
+                        # Extraer solo los miembros que se van a procesar
+                        deferred = {}
+                        for member in zip_ref.infolist():
+                            if self._is_supported_archive_member(member.filename):
+                                add_member(zip_ref, member, encoding, deferred)
+                        self._extract_zip_members(zip_ref, list(deferred.values()), extracted_dir)
                     if encoding != 'utf-8':
                         logger.info(f"ZIP {zip_basename}: extracción exitosa usando codificación {encoding_name}")
                     extraction_successful = True
@@ -758,8 +1166,10 @@ Responde en {language_name}.
                 with zipfile.ZipFile(archive_path, 'r') as zip_ref:
                     extracted_count = 0
                     for member in zip_ref.infolist():
+                        if not self._is_supported_archive_member(member.filename):
+                            continue
                         try:
-                            zip_ref.extract(member, extracted_dir)
+                            add_member(zip_ref, member, None)
                             extracted_count += 1
                         except Exception as member_error:
                             logger.warning(f"Error extrayendo {member.filename}: {member_error}. Continuando...")
@@ -767,20 +1177,16 @@ Responde en {language_name}.
                     if extracted_count == 0:
                         raise Exception("No se pudo extraer ningún archivo del ZIP")
                     logger.info(f"Extraídos {extracted_count} archivo(s) del ZIP con extracción manual")
-        elif archive_name.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz')):
+            return extracted_files
+        elif archive_type == "TAR":
             logger.info("Extracting TAR file...")
-            # Determinar el modo de apertura según la extensión
-            if archive_name.endswith('.tar.gz') or archive_name.endswith('.tgz'):
-                mode = 'r:gz'
-            elif archive_name.endswith('.tar.bz2') or archive_name.endswith('.tbz2'):
-                mode = 'r:bz2'
-            elif archive_name.endswith('.tar.xz'):
-                mode = 'r:xz'
-            else:
-                mode = 'r'
-            with tarfile.open(archive_path, mode) as tar_ref:
-                tar_ref.extractall(extracted_dir)
-        elif archive_name.endswith(('.rar', '.cbr')):
+            # Modo de apertura según la extensión
+            with tarfile.open(archive_path, self.TAR_MODE_BY_EXTENSION[archive_extension]) as tar_ref:
+                # Extraer solo los miembros que se van a procesar (el TAR se lee en streaming, una sola pasada)
+                tar_ref.extractall(extracted_dir, members=(
+                    m for m in tar_ref if m.isfile() and self._is_supported_archive_member(m.name)
+                ))
+        elif archive_type == "RAR":
             logger.info("Extracting RAR file...")
             try:
                 import rarfile
@@ -788,20 +1194,24 @@ Responde en {language_name}.
                 raise ImportError("rarfile no está instalado. Instálalo con: pip install rarfile")
             try:
                 with rarfile.RarFile(archive_path, 'r') as rar_ref:
-                    rar_ref.extractall(extracted_dir)
+                    members = [m for m in rar_ref.infolist() if not m.is_dir() and self._is_supported_archive_member(m.filename)]
+                    if members:
+                        rar_ref.extractall(extracted_dir, members=members)
             except rarfile.RarCannotExec as e:
                 raise ImportError(
                     "No se encontró el binario 'unrar' necesario para extraer archivos RAR. "
                     "En sistemas Debian/Ubuntu, instálalo con: apt-get install unrar"
                 ) from e
-        elif archive_name.endswith('.7z'):
+        elif archive_type == "7Z":
             logger.info("Extracting 7Z file...")
             try:
                 import py7zr
             except ImportError:
                 raise ImportError("py7zr no está instalado. Instálalo con: pip install py7zr")
             with py7zr.SevenZipFile(archive_path, mode='r') as zip7_ref:
-                zip7_ref.extractall(extracted_dir)
+                targets = [name for name in zip7_ref.getnames() if self._is_supported_archive_member(name)]
+                if targets:
+                    zip7_ref.extract(extracted_dir, targets=targets)
         else:
             raise ValueError(f"Formato de archivo no soportado: {archive_name}")
 
@@ -814,21 +1224,94 @@ Responde en {language_name}.
         extrae el RAR, lo comprime como ZIP y procesa el ZIP.
         """
         archive_name = os.path.basename(archive_path)
-        archive_type = "ZIP" if archive_path.lower().endswith('.zip') else "RAR" if archive_path.lower().endswith(('.rar', '.cbr')) else "7Z" if archive_path.lower().endswith('.7z') else "TAR"
-        is_rar = archive_path.lower().endswith(('.rar', '.cbr'))
+        archive_type = self._archive_type(archive_name) or "TAR"
+        is_rar = archive_type == "RAR"
         
         logger.info(f"Starting {archive_type} processing: {archive_name}")
-        temp_dir = tempfile.mkdtemp()
+        
+        # ZIP: consultar el directorio central antes de crear directorios temporales y extraer.
+        # Si no contiene ningún archivo soportado, se devuelve directamente el resultado vacío.
+        if archive_type == "ZIP":
+            try:
+                with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+                    has_supported_members = any(self._is_supported_archive_member(n) for n in zip_ref.namelist())
+            except (zipfile.BadZipFile, UnicodeDecodeError, ValueError):
+                has_supported_members = True  # Dejar que la extracción normal gestione el error
+            if not has_supported_members:
+                logger.info(f"{archive_type} {archive_name} sin archivos soportados: se omite la extracción")
+                return {
+                    "title": archive_name,
+                    "description": f"{archive_type} procesado pero no se encontraron documentos soportados (PDF, XML, EML) dentro.",
+                    "children": [],
+                    "metadata": {
+                        "total_documents": 0,
+                        "total_pdfs": 0,
+                        "total_docx": 0,
+                        "total_xmls": 0,
+                        "total_emls": 0,
+                        "total_images": 0,
+                        "language": language
+                    }
+                }
+        
+        temp_dir = self._new_temp_dir()
         extracted_dir = os.path.join(temp_dir, "extracted")
         os.makedirs(extracted_dir, exist_ok=True)
         
         children_results = []
         
+        # ZIP sin pool de renderizado: los PDFs internos no se escriben a disco, se leen del ZIP y se
+        # renderizan en memoria cuando se procesan (mismo criterio que las descargas de Google Drive)
+        streamed_pdfs = {} if archive_type == "ZIP" and self._render_pool is None and self.pdf_processor.can_render_bytes(initial_pages, final_pages) else None
+        # Los XML y EML internos de un ZIP tampoco se escriben a disco: su texto se extrae de los bytes
+        streamed_texts = {} if archive_type == "ZIP" else None
+        # Cada hilo abre su propio ZipFile (uno por codificación): leer de un ZipFile compartido obligaría
+        # a serializar todas las lecturas. Se guardan todos en streamed_zip para cerrarlos al terminar
+        streamed_zip: List[zipfile.ZipFile] = []
+        streamed_zip_lock = threading.Lock()
+        streamed_zip_local = threading.local()
+        # Hilos de pre-renderizado de PDFs internos (PDF_RENDER_PREFETCH, sin pool de procesos)
+        prefetch_executor: Optional[ThreadPoolExecutor] = None
+        
+        def read_streamed(path: str) -> Optional[bytes]:
+            """Contenido de un PDF, XML o EML interno no extraído a disco, o None si está en extracted_dir"""
+            entry = (streamed_pdfs.get(path) if streamed_pdfs else None) or (streamed_texts.get(path) if streamed_texts else None)
+            if entry is None:
+                return None
+            encoding, member = entry
+            zip_refs = getattr(streamed_zip_local, "zip_refs", None)
+            if zip_refs is None:
+                zip_refs = streamed_zip_local.zip_refs = {}
+            # Misma estrategia que la extracción: si el nombre de la cabecera local no cuadra con la
+            # codificación del índice, se reintenta con las demás (el miembro se localiza por su offset)
+            candidates = [encoding] + [e for e, _ in _ZIP_ENCODINGS if e != encoding]
+            last_error = None
+            for candidate in candidates:
+                try:
+                    zip_ref = zip_refs.get(candidate)
+                    if zip_ref is None:
+                        zip_ref = zip_refs[candidate] = zipfile.ZipFile(archive_path, 'r', metadata_encoding=candidate)
+                        with streamed_zip_lock:
+                            streamed_zip.append(zip_ref)
+                    if candidate == encoding:
+                        info = member
+                    else:
+                        info = next((i for i in zip_ref.infolist() if i.header_offset == member.header_offset), None)
+                        if info is None:
+                            continue
+                    return zip_ref.read(info)
+                except (UnicodeDecodeError, zipfile.BadZipFile) as e:
+                    if not isinstance(e, UnicodeDecodeError) and 'differ' not in str(e).lower():
+                        raise  # Error no relacionado con codificación (p.ej. CRC)
+                    last_error = e
+                    logger.debug(f"{member.filename}: lectura con codificación {candidate} falló: {e}")
+            raise last_error or zipfile.BadZipFile(f"No se pudo leer {member.filename} del ZIP")
+        
         try:
             # Extraer archivo comprimido
             # Si es RAR y falla la extracción, intentar fallback inmediatamente
             try:
-                self._extract_archive(archive_path, extracted_dir)
+                extracted_files = self._extract_archive(archive_path, extracted_dir, streamed_pdfs, streamed_texts)
             except Exception as extract_error:
                 if is_rar:
                     logger.warning(f"Error extrayendo RAR {archive_name}: {extract_error}. Intentando fallback: extraer, comprimir como ZIP y procesar...")
@@ -851,14 +1334,15 @@ Responde en {language_name}.
                             
                             try:
                                 # Intentar extraer con diferentes métodos si falla
+                                supported_members = [m for m in rar_ref.infolist() if not m.is_dir() and self._is_supported_archive_member(m.filename)]
                                 try:
-                                    rar_ref.extractall(extracted_dir)
+                                    rar_ref.extractall(extracted_dir, members=supported_members)
                                     logger.info("RAR extraído exitosamente con extractall")
                                 except Exception as extract_error2:
                                     logger.warning(f"Extractall falló ({extract_error2}), intentando extraer archivo por archivo...")
                                     # Intentar extraer archivo por archivo
                                     extracted_count = 0
-                                    for member in rar_ref.infolist():
+                                    for member in supported_members:
                                         try:
                                             # Crear directorios necesarios
                                             member_path = os.path.join(extracted_dir, member.filename)
@@ -926,35 +1410,32 @@ Responde en {language_name}.
             image_files = []
             nested_archives = []  # Archivos comprimidos anidados
 
-            for root, dirs, files in os.walk(extracted_dir):
+            if extracted_files is None:
+                # Formatos sin listado propio (TAR, RAR, 7Z): recorrer el directorio extraído
+                extracted_files = []
                 # Excluir directorios de metadatos de macOS (__MACOSX)
-                dirs[:] = [d for d in dirs if d != '__MACOSX']
-
-                for file in files:
+                for file_path in iter_files(extracted_dir, skip_dirs=('__MACOSX',)):
                     # Excluir archivos de metadatos de macOS (resource forks con prefijo ._)
-                    if file.startswith('._'):
-                        logger.debug(f"Archivo de metadatos macOS ignorado: {file}")
+                    if os.path.basename(file_path).startswith('._'):
+                        logger.debug("Archivo de metadatos macOS ignorado: %s", file_path)
                         continue
+                    extracted_files.append(file_path)
 
-                    file_path = os.path.join(root, file)
-                    # Excluir explícitamente archivos .xsig
-                    if file.lower().endswith('.xsig'):
-                        logger.info(f"Archivo .xsig ignorado dentro de {archive_type} (no soportado): {file}")
-                        continue  # Saltar archivos .xsig
-                    elif file.lower().endswith('.pdf'):
-                        pdf_files.append(file_path)
-                    elif file.lower().endswith(('.docx', '.doc', '.odt')):
-                        docx_files.append(file_path)
-                    elif file.lower().endswith('.xml'):
-                        xml_files.append(file_path)
-                    elif file.lower().endswith('.eml'):
-                        eml_files.append(file_path)
-                    elif file.lower().endswith(self.IMAGE_EXTENSIONS):
-                        image_files.append(file_path)
-                    # Detectar archivos comprimidos anidados (ZIP, RAR, 7Z, TAR dentro del archivo comprimido principal)
-                    elif file.lower().endswith(('.zip', '.rar', '.cbr', '.7z', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz')):
-                        nested_archives.append(file_path)
-                        logger.info(f"Archivo comprimido anidado detectado: {file_path}")
+            files_by_type = {"pdf": pdf_files, "docx": docx_files, "xml": xml_files, "eml": eml_files,
+                             "image": image_files, "zip": nested_archives}
+            for file_path in extracted_files:
+                file = os.path.basename(file_path)
+                # Excluir explícitamente archivos .xsig
+                if file.lower().endswith('.xsig'):
+                    logger.info(f"Archivo .xsig ignorado dentro de {archive_type} (no soportado): {file}")
+                    continue  # Saltar archivos .xsig
+                file_type = self._detect_type(file)
+                if file_type is None:
+                    continue
+                files_by_type[file_type].append(file_path)
+                # Archivos comprimidos anidados (ZIP, RAR, 7Z, TAR dentro del archivo comprimido principal)
+                if file_type == "zip":
+                    logger.info(f"Archivo comprimido anidado detectado: {file_path}")
 
             total_files = len(pdf_files) + len(docx_files) + len(xml_files) + len(eml_files) + len(image_files)
             logger.info(f"Found {len(pdf_files)} PDF, {len(docx_files)} DOCX/DOC/ODT, {len(xml_files)} XML, {len(eml_files)} EML, and {len(image_files)} image files in {archive_type} (total: {total_files})")
@@ -974,7 +1455,7 @@ Responde en {language_name}.
 
             # Apply ARCHIVE_MAX_FILES limit: read from env if not explicitly provided
             if max_inner_files <= 0:
-                max_inner_files = int(os.getenv("ARCHIVE_MAX_FILES", "0"))
+                max_inner_files = self._archive_max_files
 
             total_found = len(all_inner_files) + len(nested_archives)
             skipped_files = 0
@@ -988,8 +1469,70 @@ Responde en {language_name}.
                 logger.info(f"ARCHIVE_MAX_FILES={max_inner_files}: processing {len(all_inner_files)} files, skipping {skipped_files}")
 
             # Configuración de workers para procesamiento paralelo dentro de archivos
-            archive_workers = int(os.getenv("ARCHIVE_WORKERS", "4"))
-            content_limit = int(os.getenv("XML_EML_CONTENT_LIMIT", "5000"))
+            archive_workers = self._get_archive_workers()
+            content_limit = self._content_limit
+
+            # Con pool de renderizado, los PDFs se renderizan por adelantado en todos los procesos del pool
+            # mientras los workers esperan la inferencia. La ventana de prefetch acota las imágenes en memoria.
+            # Sin pool, PDF_RENDER_PREFETCH hilos hacen lo mismo (productor) para los workers (consumidores)
+            pdf_render_order = [path for kind, path in all_inner_files if kind == 'pdf']
+            if self._render_pool is not None:
+                render_executor = self._render_pool
+                render_window = self._render_workers * 2
+            elif self._render_prefetch > 0 and len(pdf_render_order) > 1 and archive_workers > 1:
+                prefetch_executor = ThreadPoolExecutor(max_workers=self._render_prefetch, thread_name_prefix="pdf-prefetch")
+                render_executor = prefetch_executor
+                render_window = self._render_prefetch * 2
+            else:
+                render_executor = None
+                render_window = 0
+                pdf_render_order = []
+            pdf_render_index = {path: index for index, path in enumerate(pdf_render_order)}
+            render_futures: Dict[str, Any] = {}
+            render_lock = threading.Lock()
+            next_render = 0
+
+            def render_in_thread(path: str) -> List[Any]:
+                """Renderiza un PDF interno en un hilo de pre-renderizado (desde memoria si no se extrajo)"""
+                pdf_data = read_streamed(path)
+                return self.pdf_processor.convert_to_images(pdf_data if pdf_data is not None else path, initial_pages, final_pages)
+
+            def prefetch_renders(upto: int):
+                """Encola en el pool de renderizado los PDFs hasta la posición upto (exclusive)"""
+                nonlocal next_render
+                with render_lock:
+                    while next_render < min(upto, len(pdf_render_order)):
+                        path = pdf_render_order[next_render]
+                        try:
+                            if prefetch_executor is not None:
+                                render_futures[path] = prefetch_executor.submit(render_in_thread, path)
+                            else:
+                                render_futures[path] = render_executor.submit(render_pdf_pages_jpeg, path, initial_pages, final_pages,
+                                                                              self.vllm_service.image_max_dim, self.vllm_service.image_quality,
+                                                                              self._scratch_root)
+                        except (BrokenProcessPool, RuntimeError) as e:
+                            logger.warning(f"Pool de renderizado no disponible ({e}). Se renderizará en los workers")
+                            next_render = len(pdf_render_order)
+                            return
+                        next_render += 1
+
+            def take_prerendered(path: str) -> Optional[List[Any]]:
+                """Devuelve las páginas ya renderizadas de un PDF interno, o None si hay que renderizarlo"""
+                index = pdf_render_index.get(path)
+                if index is None:
+                    return None
+                prefetch_renders(index + 1 + render_window)
+                with render_lock:
+                    future = render_futures.pop(path, None)
+                if future is None:
+                    return None
+                try:
+                    return future.result()
+                except Exception as e:
+                    logger.warning("Error renderizando %s en el pool: %s", path, e)
+                    return None
+
+            prefetch_renders(render_window)
 
             def process_inner_file(file_info: tuple) -> Optional[DocumentResult]:
                 """Procesa un archivo individual dentro del archivo comprimido"""
@@ -1001,25 +1544,25 @@ Responde en {language_name}.
                     result = None
 
                     if file_type == 'pdf':
-                        logger.info(f"Processing inner PDF: {relative_path}")
-                        result = self.process_pdf(file_path, language, initial_pages, final_pages, max_tokens, temperature_vllm, top_p, top_k, vllm_model=vllm_model)
+                        logger.info("Processing inner PDF: %s", relative_path)
+                        result = self.process_pdf(file_path, language, initial_pages, final_pages, max_tokens, temperature_vllm, top_p, top_k, vllm_model=vllm_model, pdf_data=read_streamed(file_path), images=take_prerendered(file_path))
                         doc_type = "pdf"
                     elif file_type == 'docx':
                         file_ext = os.path.splitext(file_path)[1].lower()
                         file_type_name = {".docx": "DOCX", ".doc": "DOC", ".odt": "ODT"}.get(file_ext, "DOCUMENTO")
-                        logger.info(f"Processing inner {file_type_name}: {relative_path}")
+                        logger.info("Processing inner %s: %s", file_type_name, relative_path)
                         result = self.process_docx(file_path, language, initial_pages, final_pages, max_tokens, temperature_vllm, top_p, top_k, vllm_model=vllm_model)
                         doc_type = "docx"  # Usar "docx" como tipo genérico para Word/ODT
                     elif file_type == 'xml':
-                        logger.info(f"Processing inner XML: {relative_path}")
-                        result = self.process_xml(file_path, language, max_tokens, temperature_llm, top_p, top_k, content_limit, llm_model=llm_model, no_think=no_think)
+                        logger.info("Processing inner XML: %s", relative_path)
+                        result = self.process_xml(file_path, language, max_tokens, temperature_llm, top_p, top_k, content_limit, llm_model=llm_model, no_think=no_think, xml_data=read_streamed(file_path))
                         doc_type = "xml"
                     elif file_type == 'eml':
-                        logger.info(f"Processing inner EML: {relative_path}")
-                        result = self.process_eml(file_path, language, max_tokens, temperature_llm, top_p, top_k, content_limit, llm_model=llm_model, no_think=no_think)
+                        logger.info("Processing inner EML: %s", relative_path)
+                        result = self.process_eml(file_path, language, max_tokens, temperature_llm, top_p, top_k, content_limit, llm_model=llm_model, no_think=no_think, eml_data=read_streamed(file_path))
                         doc_type = "eml"
                     elif file_type == 'image':
-                        logger.info(f"Processing inner image: {relative_path}")
+                        logger.info("Processing inner image: %s", relative_path)
                         result = self.process_image(file_path, language, max_tokens, temperature_vllm, top_p, top_k, vllm_model=vllm_model)
                         doc_type = "image"
                     else:
@@ -1028,7 +1571,7 @@ Responde en {language_name}.
 
                     # Si el archivo está vacío, result será None y lo ignoramos
                     if result is None:
-                        logger.info(f"Archivo {file_type} vacío ignorado: {relative_path}")
+                        logger.info("Archivo %s vacío ignorado: %s", file_type, relative_path)
                         return None
 
                     # Asegurar que title y description siempre estén presentes
@@ -1036,7 +1579,7 @@ Responde en {language_name}.
                     description = result.get("description") or "Sin descripción disponible"
 
                     # Para EML: si el título contiene un error, usar el nombre del archivo
-                    if file_type == 'eml' and title and ("Error" in title or "error" in title.lower() or "no devolvió contenido" in title.lower()):
+                    if file_type == 'eml' and title and _ERROR_TITLE_RE.search(title):
                         title = file_name
 
                     description = self._clean_description(description)
@@ -1061,133 +1604,134 @@ Responde en {language_name}.
                         metadata={"error": True}
                     )
 
-            # Procesar archivos en paralelo si hay más de uno
-            if len(all_inner_files) > 1 and archive_workers > 1:
-                logger.info(f"Processing {len(all_inner_files)} inner files in parallel with {archive_workers} workers")
-                with ThreadPoolExecutor(max_workers=archive_workers) as executor:
-                    futures = {executor.submit(process_inner_file, f): f for f in all_inner_files}
+            def process_nested_archive(nested_archive_path: str, budget: int) -> List[DocumentResult]:
+                """Procesa recursivamente un archivo comprimido anidado y devuelve sus children con el path reescrito"""
+                relative_path = os.path.relpath(nested_archive_path, extracted_dir)
+                logger.info("Processing nested archive: %s", relative_path)
+                try:
+                    # Procesar el archivo comprimido anidado recursivamente
+                    nested_result = self.process_archive(
+                        nested_archive_path, 
+                        language, 
+                        initial_pages, 
+                        final_pages, 
+                        max_tokens, 
+                        temperature_vllm, 
+                        temperature_llm, 
+                        top_p,
+                        top_k,
+                        vllm_model=vllm_model,
+                        llm_model=llm_model,
+                        no_think=no_think,
+                        max_inner_files=budget
+                    )
+                    
+                    if nested_result and nested_result.get("children"):
+                        # Añadir los children del archivo comprimido anidado como children del archivo principal
+                        nested_archive_name = os.path.basename(nested_archive_path)
+                        nested_children = []
+                        for child in nested_result["children"]:
+                            # Construir path que refleje la estructura anidada: nested_archive/child_path
+                            if child.path:
+                                nested_child_path = f"{relative_path}/{child.path}"
+                            else:
+                                nested_child_path = f"{relative_path}/{child.name}"
+                            
+                            nested_children.append(DocumentResult(
+                                name=child.name,
+                                title=child.title,
+                                description=child.description,
+                                type=child.type,
+                                path=nested_child_path,
+                                metadata=child.metadata
+                            ))
+                        logger.info(f"Added {len(nested_children)} documents from nested archive {nested_archive_name}")
+                        return nested_children
+
+                    # Si el archivo comprimido anidado no tiene children, añadir un resultado indicando que está vacío
+                    logger.warning(f"Nested archive {relative_path} produced no documents")
+                    return [DocumentResult(
+                        name=os.path.basename(nested_archive_path),
+                        title=os.path.basename(nested_archive_path),
+                        description=f"Archivo comprimido anidado procesado pero no se encontraron documentos soportados dentro.",
+                        type="zip",  # Tipo genérico para archivos comprimidos
+                        path=relative_path,
+                        metadata={"nested_archive": True, "empty": True}
+                    )]
+                except Exception as e:
+                    logger.error(f"Error processing nested archive {nested_archive_path}: {e}")
+                    # Añadir un resultado de error para el archivo comprimido anidado
+                    return [DocumentResult(
+                        name=os.path.basename(nested_archive_path),
+                        title=os.path.basename(nested_archive_path),
+                        description=f"Error procesando archivo comprimido anidado: {str(e)}",
+                        type="zip",  # Tipo genérico para archivos comprimidos
+                        path=relative_path,
+                        metadata={"error": True, "nested_archive": True}
+                    )]
+
+            # Sin ARCHIVE_MAX_FILES los anidados no comparten presupuesto: se lanzan en el mismo pool que
+            # los archivos internos para que todas las peticiones estén en vuelo a la vez (vLLM las agrupa
+            # en batch); la concurrencia real de inferencia la sigue limitando inference_semaphore
+            concurrent_nested = nested_archives if max_inner_files <= 0 else []
+            total_tasks = len(all_inner_files) + len(concurrent_nested)
+
+            if total_tasks > 1 and archive_workers > 1:
+                pool_size = min(archive_workers, total_tasks)
+                logger.info(f"Processing {len(all_inner_files)} inner files and {len(concurrent_nested)} nested archive(s) in parallel with {pool_size} workers")
+                with ThreadPoolExecutor(max_workers=pool_size) as executor:
+                    futures = [executor.submit(process_inner_file, f) for f in all_inner_files]
+                    nested_futures = [executor.submit(process_nested_archive, p, 0) for p in concurrent_nested]
                     for future in as_completed(futures):
                         result = future.result()
                         if result:
                             children_results.append(result)
+                    for future in nested_futures:
+                        children_results.extend(future.result())
             else:
                 # Procesamiento secuencial para un solo archivo o si ARCHIVE_WORKERS=1
                 for file_info in all_inner_files:
                     result = process_inner_file(file_info)
                     if result:
                         children_results.append(result)
+                for nested_archive_path in concurrent_nested:
+                    children_results.extend(process_nested_archive(nested_archive_path, 0))
 
-            # Procesar archivos comprimidos anidados recursivamente
-            if nested_archives:
+            # Con ARCHIVE_MAX_FILES los anidados se procesan en orden, descontando del presupuesto restante
+            if nested_archives and max_inner_files > 0:
                 # Compute remaining budget for nested archives
-                remaining_budget = max_inner_files - len(all_inner_files) if max_inner_files > 0 else 0
+                remaining_budget = max_inner_files - len(all_inner_files)
 
                 logger.info(f"Found {len(nested_archives)} nested archive(s). Processing recursively...")
                 for nested_archive_path in nested_archives:
                     # Skip nested archives if budget exhausted
-                    if max_inner_files > 0 and remaining_budget <= 0:
+                    if remaining_budget <= 0:
                         skipped_files += 1
                         logger.info(f"ARCHIVE_MAX_FILES budget exhausted, skipping nested archive: {os.path.basename(nested_archive_path)}")
                         continue
 
-                    relative_path = os.path.relpath(nested_archive_path, extracted_dir)
-                    logger.info(f"Processing nested archive: {relative_path}")
-                    try:
-                        # Procesar el archivo comprimido anidado recursivamente
-                        nested_result = self.process_archive(
-                            nested_archive_path, 
-                            language, 
-                            initial_pages, 
-                            final_pages, 
-                            max_tokens, 
-                            temperature_vllm, 
-                            temperature_llm, 
-                            top_p,
-                            top_k,
-                            vllm_model=vllm_model,
-                            llm_model=llm_model,
-                            no_think=no_think,
-                            max_inner_files=remaining_budget
-                        )
-                        
-                        if nested_result and nested_result.get("children"):
-                            # Añadir los children del archivo comprimido anidado como children del archivo principal
-                            nested_archive_name = os.path.basename(nested_archive_path)
-                            for child in nested_result["children"]:
-                                # Construir path que refleje la estructura anidada: nested_archive/child_path
-                                if child.path:
-                                    nested_child_path = f"{relative_path}/{child.path}"
-                                else:
-                                    nested_child_path = f"{relative_path}/{child.name}"
-                                
-                                children_results.append(DocumentResult(
-                                    name=child.name,
-                                    title=child.title,
-                                    description=child.description,
-                                    type=child.type,
-                                    path=nested_child_path,
-                                    metadata=child.metadata
-                                ))
-                            logger.info(f"Added {len(nested_result['children'])} documents from nested archive {nested_archive_name}")
-                            # Decrement remaining budget
-                            if max_inner_files > 0:
-                                remaining_budget -= len(nested_result["children"])
-                        else:
-                            # Si el archivo comprimido anidado no tiene children, añadir un resultado indicando que está vacío
-                            logger.warning(f"Nested archive {relative_path} produced no documents")
-                            children_results.append(DocumentResult(
-                                name=os.path.basename(nested_archive_path),
-                                title=os.path.basename(nested_archive_path),
-                                description=f"Archivo comprimido anidado procesado pero no se encontraron documentos soportados dentro.",
-                                type="zip",  # Tipo genérico para archivos comprimidos
-                                path=relative_path,
-                                metadata={"nested_archive": True, "empty": True}
-                            ))
-                    except Exception as e:
-                        logger.error(f"Error processing nested archive {nested_archive_path}: {e}")
-                        # Añadir un resultado de error para el archivo comprimido anidado
-                        children_results.append(DocumentResult(
-                            name=os.path.basename(nested_archive_path),
-                            title=os.path.basename(nested_archive_path),
-                            description=f"Error procesando archivo comprimido anidado: {str(e)}",
-                            type="zip",  # Tipo genérico para archivos comprimidos
-                            path=relative_path,
-                            metadata={"error": True, "nested_archive": True}
-                        ))
+                    nested_children = process_nested_archive(nested_archive_path, remaining_budget)
+                    children_results.extend(nested_children)
+                    # Decrement remaining budget (el placeholder de vacío/error conserva el path del propio archivo anidado)
+                    nested_relative_path = os.path.relpath(nested_archive_path, extracted_dir)
+                    if nested_children and nested_children[0].path != nested_relative_path:
+                        remaining_budget -= len(nested_children)
 
             # Generar resumen agregado inteligente
             total_docs = len(children_results)
             logger.info(f"{archive_type} processing complete. {total_docs} documents processed ({len(pdf_files)} PDFs, {len(docx_files)} DOCX/DOC/ODT, {len(xml_files)} XMLs, {len(eml_files)} EMLs, {len(image_files)} images, {len(nested_archives)} nested archives). Generating macro-summary.")
             
             if total_docs > 0:
-                # Construir contexto para macro-resumen
-                descriptions_text = "\n".join([f"- {r.name}: {r.description}" for r in children_results])
-                
-                # Primera llamada: obtener descripción usando prompt unificado
-                macro_prompt = self._get_description_prompt(descriptions_text, "zip", language)
-
                 try:
+                    # Primera llamada (o árbol de llamadas si hay muchos documentos): obtener descripción
                     logger.info(f"Calling LLM Service for {archive_type} macro-summary (description)...")
-                    with self.inference_semaphore:
-                        macro_description_raw = self.llm_service.analyze_llm(
-                            prompt=macro_prompt,
-                            max_tokens=max_tokens,
-                            temperature=temperature_llm,
-                            top_p=top_p,
-                            top_k=top_k,
-                            model=llm_model,
-                            enable_thinking=False if no_think else None
-                        )
-
-                    # Asegurar que es texto plano (ya viene limpio de analyze_llm, pero por si acaso)
-                    macro_description = self.llm_service._clean_plain_text_response(macro_description_raw)
-                    macro_description = self._clean_description(macro_description)  # Limpiar comillas y backslashes
+                    macro_description = self._generate_macro_description(
+                        children_results, language, max_tokens, temperature_llm, top_p, top_k,
+                        llm_model=llm_model, no_think=no_think
+                    )
 
                     logger.info(f"Macro-description generado: {len(macro_description)} caracteres")
 
-                    # Pequeño delay para evitar rate limiting entre llamadas secuenciales
-                    time.sleep(0.5)
-
                     # Segunda llamada: obtener título basado en la descripción usando prompt unificado
                     title_prompt = self._get_title_prompt(macro_description, "zip", language)
 
@@ -1200,13 +1744,14 @@ Responde en {language_name}.
                             top_p=top_p,
                             top_k=top_k,
                             model=llm_model,
-                            enable_thinking=False if no_think else None
+                            enable_thinking=False if no_think else None,
+                            stop=_TITLE_STOP
                         )
 
                     macro_title = self.llm_service._clean_plain_text_response(macro_title_raw).strip()
                     
                     # Si el título está vacío o contiene un mensaje de error, usar el nombre del archivo
-                    if not macro_title or "Error" in macro_title or "error" in macro_title.lower() or "no devolvió contenido" in macro_title.lower():
+                    if not macro_title or _ERROR_TITLE_RE.search(macro_title):
                         macro_title = archive_name
                         logger.warning(f"LLM returned empty or error content for {archive_type} title. Using filename: {macro_title}")
                     else:
@@ -1276,7 +1821,137 @@ Responde en {language_name}.
                 # Si no es RAR, lanzar el error normalmente
                 raise
         finally:
-            shutil.rmtree(temp_dir, ignore_errors=True)
+            if prefetch_executor is not None:
+                prefetch_executor.shutdown(wait=True, cancel_futures=True)
+            for zip_ref in streamed_zip:
+                zip_ref.close()
+            self._discard_temp_dir(temp_dir)
+
+    # Schema del macro-resumen con MACRO_SUMMARY_STRUCTURED=true (Structured Outputs)
+    MACRO_SUMMARY_SCHEMA = {
+        "type": "object",
+        "properties": {"description": {"type": "string"}},
+        "required": ["description"],
+        "additionalProperties": False
+    }
+
+    def _summarize_descriptions(self, descriptions_text: str, language: str = "es", max_tokens: Optional[int] = None, temperature_llm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, llm_model: Optional[str] = None, no_think: bool = False) -> str:
+        """Genera un macro-resumen en texto plano a partir de una lista de descripciones ("- nombre: descripción")
+        
+        Con MACRO_SUMMARY_STRUCTURED=true se pide la respuesta con Structured Outputs (un JSON con el campo
+        "description"): basta con leer el campo, sin la limpieza heurística de texto plano.
+        """
+        structured = self._macro_structured
+        macro_prompt = self._get_description_prompt(descriptions_text, "zip", language, structured=structured)
+        with self.inference_semaphore:
+            macro_description_raw = self.llm_service.analyze_llm(
+                prompt=macro_prompt,
+                max_tokens=max_tokens,
+                schema=self.MACRO_SUMMARY_SCHEMA if structured else None,
+                temperature=temperature_llm,
+                top_p=top_p,
+                top_k=top_k,
+                model=llm_model,
+                enable_thinking=False if no_think else None
+            )
+
+        if structured:
+            try:
+                description = _json_loads(macro_description_raw).get("description")
+                if isinstance(description, str):
+                    return self._clean_description(description)
+            except (ValueError, AttributeError):
+                pass
+            # El servidor no respetó el schema (p.ej. no soporta response_format): tratar como texto plano
+            logger.warning("Macro-resumen estructurado no válido, usando limpieza de texto plano")
+
+        # Asegurar que es texto plano (ya viene limpio de analyze_llm, pero por si acaso)
+        macro_description = self.llm_service._clean_plain_text_response(macro_description_raw)
+        return self._clean_description(macro_description)  # Limpiar comillas y backslashes
+
+    def _format_descriptions(self, results: List[DocumentResult]) -> str:
+        """
+        Construye la lista "- nombre: descripción" que se envía al LLM para el macro-resumen.
+
+        Se corta al alcanzar MACRO_SUMMARY_MAX_CHARS caracteres (0 = sin límite) para no exceder el
+        contexto del modelo; los documentos restantes se omiten indicando cuántos son.
+        """
+        max_chars = self._macro_max_chars
+        lines = (f"- {r.name}: {r.description}" for r in results)
+        if max_chars <= 0:
+            return "\n".join(lines)
+
+        kept = []
+        total_chars = 0
+        for line in lines:
+            total_chars += len(line) + 1
+            if kept and total_chars > max_chars:
+                break
+            kept.append(line)
+        omitted = len(results) - len(kept)
+        if omitted:
+            logger.info("Macro-resumen: %d documento(s) omitidos por MACRO_SUMMARY_MAX_CHARS=%d", omitted, max_chars)
+            kept.append(f"- (y {omitted} documento(s) más)")
+        return "\n".join(kept)
+
+    def _generate_macro_description(self, children_results: List[DocumentResult], language: str = "es", max_tokens: Optional[int] = None, temperature_llm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, llm_model: Optional[str] = None, no_think: bool = False) -> str:
+        """
+        Genera la macro-descripción de una colección de documentos.
+
+        Si la colección supera MACRO_SUMMARY_CHUNK_SIZE documentos, se aplica un map-reduce:
+        se resume cada grupo de documentos en paralelo y después se resumen los resúmenes parciales.
+        Así el prompt de cada llamada queda acotado aunque el archivo contenga cientos de documentos.
+        """
+        chunk_size = self._macro_chunk_size
+        llm_kwargs = dict(max_tokens=max_tokens, temperature_llm=temperature_llm, top_p=top_p, top_k=top_k, llm_model=llm_model, no_think=no_think)
+
+        if chunk_size <= 0 or len(children_results) <= chunk_size:
+            return self._summarize_descriptions(self._format_descriptions(children_results), language, **llm_kwargs)
+
+        chunks = [children_results[i:i + chunk_size] for i in range(0, len(children_results), chunk_size)]
+        logger.info(f"Macro-resumen jerárquico: {len(children_results)} documentos en {len(chunks)} grupos de hasta {chunk_size}")
+
+        def summarize_chunk(chunk: List[DocumentResult]) -> str:
+            """Resume un grupo de documentos (fase map)"""
+            return self._summarize_descriptions(self._format_descriptions(chunk), language, **llm_kwargs)
+
+        # Fase map: resumir los grupos en paralelo (el semáforo global sigue limitando las inferencias)
+        macro_workers = max(1, min(len(chunks), self._get_archive_workers()))
+        with ThreadPoolExecutor(max_workers=macro_workers) as executor:
+            partial_summaries = list(executor.map(summarize_chunk, chunks))
+
+        # Fase reduce: resumir los resúmenes parciales válidos
+        partial_lines = []
+        for index, (chunk, summary) in enumerate(zip(chunks, partial_summaries), start=1):
+            if self._is_error_description(summary):
+                logger.warning(f"Resumen parcial del grupo {index} inválido, se omite: {summary[:200]}")
+                continue
+            partial_lines.append(f"- Grupo {index} ({len(chunk)} documentos): {summary}")
+
+        if not partial_lines:
+            raise Exception("No se pudo generar ningún resumen parcial de la colección")
+
+        # Si los resúmenes parciales juntos aún superan MACRO_SUMMARY_MAX_CHARS (colecciones muy grandes),
+        # se vuelven a resumir por grupos hasta que quepan en una sola llamada
+        # (grupos de al menos 2: con MACRO_SUMMARY_CHUNK_SIZE=1 cada ronda no reduciría el número de líneas)
+        max_chars = self._macro_max_chars
+        reduce_size = max(2, chunk_size)
+        while max_chars > 0 and len(partial_lines) > reduce_size and sum(len(line) + 1 for line in partial_lines) > max_chars:
+            line_groups = [partial_lines[i:i + reduce_size] for i in range(0, len(partial_lines), reduce_size)]
+            logger.info(f"Macro-resumen jerárquico: reduciendo {len(partial_lines)} resúmenes parciales en {len(line_groups)} grupos")
+            with ThreadPoolExecutor(max_workers=max(1, min(len(line_groups), self._get_archive_workers()))) as executor:
+                group_summaries = list(executor.map(
+                    lambda group: self._summarize_descriptions("\n".join(group), language, **llm_kwargs), line_groups
+                ))
+            partial_lines = [
+                f"- Grupo {index} ({len(group)} resúmenes parciales): {summary}"
+                for index, (group, summary) in enumerate(zip(line_groups, group_summaries), start=1)
+                if not self._is_error_description(summary)
+            ]
+            if not partial_lines:
+                raise Exception("No se pudo generar ningún resumen parcial de la colección")
+
+        return self._summarize_descriptions("\n".join(partial_lines), language, **llm_kwargs)
 
     def process_zip(self, zip_path: str, language: str = "es", initial_pages: int = 2, final_pages: int = 2, max_tokens: Optional[int] = None, temperature_vllm: Optional[float] = None, temperature_llm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, vllm_model: Optional[str] = None, llm_model: Optional[str] = None, no_think: bool = False, max_inner_files: int = 0) -> Dict[str, Any]:
         """
@@ -1284,81 +1959,111 @@ Responde en {language_name}.
         """
         return self.process_archive(zip_path, language, initial_pages, final_pages, max_tokens, temperature_vllm, temperature_llm, top_p, top_k, vllm_model=vllm_model, llm_model=llm_model, no_think=no_think, max_inner_files=max_inner_files)
     
-    def process_xml(self, xml_path: str, language: str = "es", max_tokens: Optional[int] = None, temperature_llm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, content_limit: int = None, llm_model: Optional[str] = None, no_think: bool = False) -> Dict[str, Any]:
-        """Procesa un archivo XML y genera su resumen"""
-        logger.info(f"Starting XML processing: {os.path.basename(xml_path)} (Language: {language})")
+    def _describe_text_document(self, content: str, content_type: str, file_name: str, language: str, max_tokens: Optional[int], temperature_llm: Optional[float], top_p: Optional[float], top_k: Optional[int], llm_model: Optional[str], no_think: bool) -> Tuple[str, str]:
+        """Genera (título, descripción) de un XML o EML con el LLM de texto
+
+        Con XML_EML_STRUCTURED=true se piden ambos en una sola llamada con Structured Outputs (el mismo schema
+        que PDF/DOCX). Si no, o si el servidor no respeta el schema, se hacen dos llamadas: la descripción y
+        después un título a partir de ella. Si no se obtiene un título válido se usa file_name.
+        """
+        label = content_type.upper()
+        enable_thinking = False if no_think else None
+
+        if self._text_structured:
+            prompt = self._get_description_prompt(content, content_type, language, structured=True)
+            logger.info(f"Calling LLM Service for {label} title and description...")
+            with self.inference_semaphore:
+                response_content = self.llm_service.analyze_llm(prompt, max_tokens, schema=DOCUMENT_ANALYSIS_SCHEMA, temperature=temperature_llm, top_p=top_p, top_k=top_k, model=llm_model, enable_thinking=enable_thinking)
+            try:
+                response_json = _json_loads(response_content)
+                title = str(response_json.get("title") or "").strip()
+                description = str(response_json.get("description") or "").strip()
+            except (ValueError, AttributeError):
+                title = description = ""
+            if description:
+                logger.info("Response parsed successfully")
+                return (title if title and not _ERROR_TITLE_RE.search(title) else file_name), self._clean_description(description)
+            # El servidor no respetó el schema (p.ej. no soporta response_format): pedir descripción y título por separado
+            logger.warning(f"Respuesta estructurada de {label} no válida, usando descripción y título por separado")
+
+        # Primera llamada: obtener descripción usando prompt unificado
+        prompt = self._get_description_prompt(content, content_type, language)
+        logger.info(f"Calling LLM Service for {label} description...")
+        with self.inference_semaphore:
+            description = self.llm_service.analyze_llm(prompt, max_tokens, temperature=temperature_llm, top_p=top_p, top_k=top_k, model=llm_model, enable_thinking=enable_thinking)
+
+        # Limpiar la respuesta
+        description = self.llm_service._clean_plain_text_response(description)
+        description = self._clean_description(description)  # Limpiar comillas y backslashes
+
+        logger.info("Response parsed successfully")
+
+        # Segunda llamada: obtener título basado en la descripción usando prompt unificado
+        title_prompt = self._get_title_prompt(description, content_type, language)
+
+        try:
+            logger.info(f"Calling LLM Service for {label} title...")
+            with self.inference_semaphore:
+                title_raw = self.llm_service.analyze_llm(
+                    prompt=title_prompt,
+                    max_tokens=512,  # Títulos cortos, no necesitamos muchos tokens, pero si pedimos muy pocos, a veces falla el modelo
+                    temperature=temperature_llm,
+                    top_p=top_p,
+                    top_k=top_k,
+                    model=llm_model,
+                    enable_thinking=enable_thinking,
+                    stop=_TITLE_STOP
+                )
+
+            title = self.llm_service._clean_plain_text_response(title_raw).strip()
+            
+            # Fallback si el título está vacío o contiene error
+            if not title or _ERROR_TITLE_RE.search(title):
+                title = file_name
+                logger.warning(f"LLM returned empty or error content for {label} title. Using filename: {title}")
+            else:
+                logger.info(f"{label} title generated: {title}")
+        except Exception as e:
+            logger.warning(f"Error generating {label} title: {e}. Using fallback.")
+            title = file_name
+        return title, description
+
+    def process_xml(self, xml_path: str, language: str = "es", max_tokens: Optional[int] = None, temperature_llm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, content_limit: int = None, llm_model: Optional[str] = None, no_think: bool = False, xml_data: Optional[bytes] = None) -> Dict[str, Any]:
+        """Procesa un archivo XML y genera su resumen
+
+        Si se pasa xml_data (contenido en memoria, p.ej. leído de un ZIP), xml_path solo se usa como nombre del archivo.
+        """
+        file_name = os.path.basename(xml_path)
+        logger.info(f"Starting XML processing: {file_name} (Language: {language})")
         
         # Verificar si el archivo está vacío
         try:
-            if os.path.getsize(xml_path) == 0:
-                logger.warning(f"Archivo XML vacío ignorado: {os.path.basename(xml_path)}")
+            if (len(xml_data) if xml_data is not None else os.path.getsize(xml_path)) == 0:
+                logger.warning(f"Archivo XML vacío ignorado: {file_name}")
                 return None  # Retornar None para indicar que debe ser ignorado
         except OSError as e:
             logger.warning(f"No se pudo verificar tamaño del archivo {xml_path}: {e}")
         
-        # Obtener límite de contenido desde variable de entorno o parámetro
+        # Obtener límite de contenido del parámetro o, si no se indica, de XML_EML_CONTENT_LIMIT
         if content_limit is None:
-            content_limit = int(os.getenv("XML_EML_CONTENT_LIMIT", "5000"))
+            content_limit = self._content_limit
         
         try:
             # Extraer contenido del XML
-            xml_content = self.xml_eml_processor.process_xml(xml_path)
+            xml_content = self._extract_text(extract_xml_text, self.xml_eml_processor.process_xml, xml_path, xml_data)
             
             if not xml_content:
                 logger.error("Failed to extract content from XML")
                 return {
-                    "title": os.path.basename(xml_path),
+                    "title": file_name,
                     "description": "Error: No se pudo extraer contenido del XML",
                     "metadata": {}
                 }
             
             logger.info(f"Extracted XML content ({len(xml_content)} characters). Preparing model prompt.")
             
-            # Primera llamada: obtener descripción usando prompt unificado
             xml_preview = xml_content[:content_limit]  # Limitar tamaño del prompt según configuración
-            prompt = self._get_description_prompt(xml_preview, "xml", language)
-            
-            # Analizar con LLM (text-only)
-            logger.info("Calling LLM Service for XML description...")
-            with self.inference_semaphore:
-                description = self.llm_service.analyze_llm(prompt, max_tokens, temperature=temperature_llm, top_p=top_p, top_k=top_k, model=llm_model, enable_thinking=False if no_think else None)
-
-            # Limpiar la respuesta
-            description = self.llm_service._clean_plain_text_response(description)
-            description = self._clean_description(description)  # Limpiar comillas y backslashes
-
-            logger.info("Response parsed successfully")
-
-            # Pequeño delay para evitar rate limiting entre llamadas secuenciales
-            time.sleep(0.5)
-
-            # Segunda llamada: obtener título basado en la descripción usando prompt unificado
-            title_prompt = self._get_title_prompt(description, "xml", language)
-
-            try:
-                logger.info("Calling LLM Service for XML title...")
-                with self.inference_semaphore:
-                    title_raw = self.llm_service.analyze_llm(
-                        prompt=title_prompt,
-                        max_tokens=512,  # Títulos cortos, no necesitamos muchos tokens, pero si pedimos muy pocos, a veces falla el modelo
-                        temperature=temperature_llm,
-                        top_p=top_p,
-                        top_k=top_k,
-                        model=llm_model,
-                        enable_thinking=False if no_think else None
-                    )
-
-                title = self.llm_service._clean_plain_text_response(title_raw).strip()
-                
-                # Fallback si el título está vacío o contiene error
-                if not title or "Error" in title or "error" in title.lower() or "no devolvió contenido" in title.lower():
-                    title = os.path.basename(xml_path)
-                    logger.warning(f"LLM returned empty or error content for XML title. Using filename: {title}")
-                else:
-                    logger.info(f"XML title generated: {title}")
-            except Exception as e:
-                logger.warning(f"Error generating XML title: {e}. Using fallback.")
-                title = os.path.basename(xml_path)
+            title, description = self._describe_text_document(xml_preview, "xml", file_name, language, max_tokens, temperature_llm, top_p, top_k, llm_model, no_think)
             
             return {
                 "title": title,
@@ -1371,86 +2076,47 @@ Responde en {language_name}.
         except Exception as e:
             logger.error(f"Error processing XML: {e}")
             return {
-                "title": os.path.basename(xml_path),
+                "title": file_name,
                 "description": f"Error procesando XML: {str(e)}",
                 "metadata": {"error": True}
             }
     
-    def process_eml(self, eml_path: str, language: str = "es", max_tokens: Optional[int] = None, temperature_llm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, content_limit: int = None, llm_model: Optional[str] = None, no_think: bool = False) -> Dict[str, Any]:
-        """Procesa un archivo EML (email) y genera su resumen"""
-        logger.info(f"Starting EML processing: {os.path.basename(eml_path)} (Language: {language})")
+    def process_eml(self, eml_path: str, language: str = "es", max_tokens: Optional[int] = None, temperature_llm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, content_limit: int = None, llm_model: Optional[str] = None, no_think: bool = False, eml_data: Optional[bytes] = None) -> Dict[str, Any]:
+        """Procesa un archivo EML (email) y genera su resumen
+
+        Si se pasa eml_data (contenido en memoria, p.ej. leído de un ZIP), eml_path solo se usa como nombre del archivo.
+        """
+        file_name = os.path.basename(eml_path)
+        logger.info(f"Starting EML processing: {file_name} (Language: {language})")
         
         # Verificar si el archivo está vacío
         try:
-            if os.path.getsize(eml_path) == 0:
-                logger.warning(f"Archivo EML vacío ignorado: {os.path.basename(eml_path)}")
+            if (len(eml_data) if eml_data is not None else os.path.getsize(eml_path)) == 0:
+                logger.warning(f"Archivo EML vacío ignorado: {file_name}")
                 return None  # Retornar None para indicar que debe ser ignorado
         except OSError as e:
             logger.warning(f"No se pudo verificar tamaño del archivo {eml_path}: {e}")
         
-        # Obtener límite de contenido desde variable de entorno o parámetro
+        # Obtener límite de contenido del parámetro o, si no se indica, de XML_EML_CONTENT_LIMIT
         if content_limit is None:
-            content_limit = int(os.getenv("XML_EML_CONTENT_LIMIT", "5000"))
+            content_limit = self._content_limit
         
         try:
             # Extraer contenido del EML
-            eml_content = self.xml_eml_processor.process_eml(eml_path)
+            eml_content = self._extract_text(extract_eml_text, self.xml_eml_processor.process_eml, eml_path, eml_data)
             
             if not eml_content:
                 logger.error("Failed to extract content from EML")
                 return {
-                    "title": os.path.basename(eml_path),
+                    "title": file_name,
                     "description": "Error: No se pudo extraer contenido del email",
                     "metadata": {}
                 }
             
             logger.info(f"Extracted EML content ({len(eml_content)} characters). Preparing model prompt.")
             
-            # Primera llamada: obtener descripción usando prompt unificado
             eml_preview = eml_content[:content_limit]  # Limitar tamaño del prompt según configuración
-            prompt = self._get_description_prompt(eml_preview, "eml", language)
-            
-            # Primera llamada: obtener descripción
-            logger.info("Calling LLM Service for EML description...")
-            with self.inference_semaphore:
-                description = self.llm_service.analyze_llm(prompt, max_tokens, temperature=temperature_llm, top_p=top_p, top_k=top_k, model=llm_model, enable_thinking=False if no_think else None)
-
-            # Limpiar la respuesta
-            description = self.llm_service._clean_plain_text_response(description)
-            description = self._clean_description(description)  # Limpiar comillas y backslashes
-
-            logger.info("Response parsed successfully")
-
-            # Pequeño delay para evitar rate limiting entre llamadas secuenciales
-            time.sleep(0.5)
-
-            # Segunda llamada: obtener título basado en la descripción usando prompt unificado
-            title_prompt = self._get_title_prompt(description, "eml", language)
-
-            try:
-                logger.info("Calling LLM Service for EML title...")
-                with self.inference_semaphore:
-                    title_raw = self.llm_service.analyze_llm(
-                        prompt=title_prompt,
-                        max_tokens=512,  # Títulos cortos, no necesitamos muchos tokens, pero si pedimos muy pocos, a veces falla el modelo
-                        temperature=temperature_llm,
-                        top_p=top_p,
-                        top_k=top_k,
-                        model=llm_model,
-                        enable_thinking=False if no_think else None
-                    )
-
-                title = self.llm_service._clean_plain_text_response(title_raw).strip()
-                
-                # Fallback si el título está vacío o contiene error
-                if not title or "Error" in title or "error" in title.lower() or "no devolvió contenido" in title.lower():
-                    title = os.path.basename(eml_path)
-                    logger.warning(f"LLM returned empty or error content for EML title. Using filename: {title}")
-                else:
-                    logger.info(f"EML title generated: {title}")
-            except Exception as e:
-                logger.warning(f"Error generating EML title: {e}. Using fallback.")
-                title = os.path.basename(eml_path)
+            title, description = self._describe_text_document(eml_preview, "eml", file_name, language, max_tokens, temperature_llm, top_p, top_k, llm_model, no_think)
             
             return {
                 "title": title,
@@ -1463,7 +2129,7 @@ Responde en {language_name}.
         except Exception as e:
             logger.error(f"Error processing EML: {e}")
             return {
-                "title": os.path.basename(eml_path),
+                "title": file_name,
                 "description": f"Error procesando email: {str(e)}",
                 "metadata": {"error": True}
             }
@@ -1471,14 +2137,44 @@ Responde en {language_name}.
     # Supported image extensions for direct image processing
     IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tiff', '.tif')
 
+    # Extensiones de archivos comprimidos soportados (ZIP, RAR/CBR, 7Z, TAR y variantes comprimidas)
+    ARCHIVE_EXTENSIONS = ('.zip', '.rar', '.cbr', '.7z', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz')
+
+    # Formato de comprimido por extensión (ver _archive_extension) y modo de tarfile.open de cada variante TAR
+    ARCHIVE_TYPE_BY_EXTENSION = {
+        '.zip': "ZIP",
+        '.rar': "RAR",
+        '.cbr': "RAR",
+        '.7z': "7Z",
+        **dict.fromkeys(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz'), "TAR"),
+    }
+    TAR_MODE_BY_EXTENSION = {'.tar': 'r', '.tar.gz': 'r:gz', '.tgz': 'r:gz', '.tar.bz2': 'r:bz2', '.tbz2': 'r:bz2', '.tar.xz': 'r:xz'}
+
+    # Extensiones que process_archive procesa dentro de un archivo comprimido (documentos, imágenes y comprimidos anidados)
+    ARCHIVE_MEMBER_EXTENSIONS = ('.pdf', '.docx', '.doc', '.odt', '.xml', '.eml') + IMAGE_EXTENSIONS + ARCHIVE_EXTENSIONS
+
+    # Tipo de documento por extensión (en minúsculas), usado por _detect_type
+    TYPE_BY_EXTENSION = {
+        '.pdf': "pdf",
+        **dict.fromkeys(('.docx', '.doc', '.odt'), "docx"),
+        **dict.fromkeys(ARCHIVE_EXTENSIONS, "zip"),
+        '.xml': "xml",
+        '.eml': "eml",
+        **dict.fromkeys(IMAGE_EXTENSIONS, "image"),
+    }
+
+    # Tamaño del buffer al copiar miembros de un ZIP a disco (el de shutil por defecto es de 64 KiB)
+    ZIP_COPY_BUFSIZE = 1024 * 1024
+
     def process_image(self, image_path: str, language: str = "es", max_tokens: Optional[int] = None, temperature_vllm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, vllm_model: Optional[str] = None) -> Dict[str, Any]:
         """Procesa un archivo de imagen y genera su resumen usando el modelo multimodal"""
-        logger.info(f"Starting image processing: {os.path.basename(image_path)} (Language: {language})")
+        file_name = os.path.basename(image_path)
+        logger.info(f"Starting image processing: {file_name} (Language: {language})")
 
         # Verificar si el archivo está vacío
         try:
             if os.path.getsize(image_path) == 0:
-                logger.warning(f"Archivo de imagen vacío ignorado: {os.path.basename(image_path)}")
+                logger.warning(f"Archivo de imagen vacío ignorado: {file_name}")
                 return None
         except OSError as e:
             logger.warning(f"No se pudo verificar tamaño del archivo {image_path}: {e}")
@@ -1496,23 +2192,23 @@ Responde en {language_name}.
 
             # Extraer title y description del JSON
             try:
-                response_json = json.loads(response_content)
+                response_json = _json_loads(response_content)
                 title = response_json.get("title", "").strip()
                 description = response_json.get("description", "").strip()
 
                 # Fallback si no se obtienen correctamente
                 if not title:
-                    title = os.path.basename(image_path)
+                    title = file_name
                 if not description:
                     description = self._extract_description(response_content) or "Sin descripción disponible"
             except Exception as e:
                 logger.warning(f"Error parsing structured output: {e}. Falling back to description extraction.")
                 description = self._extract_description(response_content) or "Sin descripción disponible"
-                title = os.path.basename(image_path)
+                title = file_name
 
             # Asegurar que siempre haya título y descripción
             if not title:
-                title = os.path.basename(image_path)
+                title = file_name
             if not description:
                 description = "Sin descripción disponible"
 
@@ -1532,15 +2228,99 @@ Responde en {language_name}.
         except Exception as e:
             logger.error(f"Error processing image: {e}")
             return {
-                "title": os.path.basename(image_path),
+                "title": file_name,
                 "description": f"Error procesando imagen: {str(e)}",
                 "metadata": {"error": True}
             }
 
-    def process_file_from_source(self, source_config: Dict[str, Any], file_id: Optional[str] = None, file_name: Optional[str] = None) -> Optional[DocumentResult]:
-        """Procesa un archivo desde diferentes fuentes"""
+    # Sufijos probados, en orden, al buscar un archivo por nombre en una carpeta de Google Drive
+    FOLDER_SEARCH_SUFFIXES = ('', '.pdf', '.docx', '.doc', '.odt', '.zip', '.rar', '.7z', '.tar', '.tar.gz', '.tgz', '.xml', '.eml')
+
+    def _get_folder_index(self, folder_id: str, refresh: bool = False) -> Dict[str, Dict]:
+        """
+        Devuelve el contenido de una carpeta de Google Drive indexado por nombre.
+
+        El listado se cachea GDRIVE_FOLDER_CACHE_TTL segundos, para que buscar varios archivos por nombre
+        en la misma carpeta no liste la carpeta completa en cada llamada. refresh=True fuerza un nuevo listado.
+        """
+        ttl = self._folder_cache_ttl
+        requested_at = time.monotonic()
+        with self._folder_cache_lock:
+            cached = self._folder_cache.get(folder_id)
+            if cached and not refresh and time.monotonic() - cached[0] < ttl:
+                return cached[1]
+            folder_lock = self._folder_list_locks.setdefault(folder_id, threading.Lock())
+        # Un solo listado por carpeta a la vez: las búsquedas concurrentes en la misma carpeta esperan
+        # al primero y reutilizan su resultado en lugar de listar la carpeta cada una
+        with folder_lock:
+            with self._folder_cache_lock:
+                cached = self._folder_cache.get(folder_id)
+                # Con refresh solo sirve un listado hecho mientras se esperaba el lock
+                if cached and (cached[0] >= requested_at or (not refresh and time.monotonic() - cached[0] < ttl)):
+                    return cached[1]
+            folder_contents = self.gdrive_service.list_folder_contents(folder_id)
+            # Con nombres repetidos se conserva el primero, como en la búsqueda lineal original
+            items_by_name = {}
+            for item in folder_contents:
+                items_by_name.setdefault(item['name'], item)
+            if ttl > 0:
+                now = time.monotonic()
+                with self._folder_cache_lock:
+                    # Descartar los listados caducados de otras carpetas (el proceso de la API es de larga duración)
+                    for expired_id in [fid for fid, (listed_at, _) in self._folder_cache.items() if now - listed_at >= ttl]:
+                        del self._folder_cache[expired_id]
+                    self._folder_cache[folder_id] = (now, items_by_name)
+        return items_by_name
+
+    def _detect_type(self, file_name: str) -> Optional[str]:
+        """
+        Determina el tipo de documento por la extensión del nombre o ruta (una búsqueda en TYPE_BY_EXTENSION).
+
+        Returns:
+            "pdf", "docx" (genérico para Word/ODT), "zip" (genérico para comprimidos), "xml", "eml",
+            "image" o None si la extensión no está soportada. Los .xsig deben filtrarse antes.
+        """
+        return self.TYPE_BY_EXTENSION.get(self._archive_extension(file_name))
+
+    def _archive_extension(self, file_name: str) -> str:
+        """Extensión en minúsculas del nombre o ruta, incluida la doble de los TAR comprimidos (.tar.gz, .tar.bz2, .tar.xz)"""
+        stem, extension = os.path.splitext(file_name.lower())
+        # splitext solo devuelve la última extensión
+        if extension in ('.gz', '.bz2', '.xz') and stem.endswith('.tar'):
+            return '.tar' + extension
+        return extension
+
+    def _archive_type(self, archive_name: str) -> Optional[str]:
+        """Formato del comprimido ("ZIP", "RAR", "7Z" o "TAR") según su extensión, o None si no está soportado"""
+        return self.ARCHIVE_TYPE_BY_EXTENSION.get(self._archive_extension(archive_name))
+
+    def _detect_type_from_mime(self, mime_type: str) -> Optional[str]:
+        """Determina el tipo de documento por mimeType (fallback de Google Drive cuando la extensión no basta)"""
+        if 'pdf' in mime_type:
+            return "pdf"
+        if 'word' in mime_type or 'docx' in mime_type or 'document' in mime_type or 'msword' in mime_type or 'opendocument.text' in mime_type:
+            return "docx"
+        if 'zip' in mime_type or 'rar' in mime_type or '7z' in mime_type or 'tar' in mime_type or 'compressed' in mime_type:
+            return "zip"
+        if 'xml' in mime_type:
+            return "xml"
+        if 'message' in mime_type or 'rfc822' in mime_type or 'eml' in mime_type:
+            return "eml"
+        if 'image/' in mime_type:
+            return "image"
+        return None
+
+    def process_file_from_source(self, source_config: Dict[str, Any], file_id: Optional[str] = None, file_name: Optional[str] = None, local_path: Optional[str] = None, file_data: Optional[bytes] = None, images: Optional[List[Any]] = None) -> Optional[DocumentResult]:
+        """Procesa un archivo desde diferentes fuentes
+
+        Args:
+            local_path: En modo gdrive, ruta local de un archivo ya descargado (prefetch del pipeline).
+                Si se indica, no se vuelve a descargar de Google Drive.
+            file_data: En modo gdrive, contenido de un PDF ya descargado a memoria (prefetch del pipeline).
+            images: Para PDFs y DOCX/DOC/ODT, páginas ya renderizadas (etapa de renderizado del pipeline).
+        """
         mode = source_config["mode"]
-        logger.info(f"Processing file from source: mode={mode}, file_name={file_name}")
+        logger.info("Processing file from source: mode=%s, file_name=%s", mode, file_name)
         
         language = source_config.get("language", "es")
         initial_pages = source_config.get("initial_pages", 2)
@@ -1555,7 +2335,9 @@ Responde en {language_name}.
         no_think = source_config.get("no_think", False) # False por defecto
         content_limit = source_config.get("content_limit", None)  # Para XML/EML
         max_inner_files = source_config.get("max_inner_files", 0)  # Para archivos comprimidos
-        temp_dir = tempfile.mkdtemp()
+        # Directorio temporal solo si hay que descargar a disco (modos local/upload, PDFs en memoria
+        # y archivos ya descargados por el pipeline no lo necesitan)
+        temp_dir = None
         
         try:
             file_path = None
@@ -1579,250 +2361,124 @@ Responde en {language_name}.
                     
                     # Buscar archivo en la carpeta
                     logger.info(f"Searching for file '{search_file_name}' in folder {folder_id}")
-                    folder_contents = self.gdrive_service.list_folder_contents(folder_id)
+                    items_by_name = self._get_folder_index(folder_id, refresh=source_config.get("refresh_folder_cache", False))
                     
-                    for item in folder_contents:
-                        # Buscar por nombre exacto o con extensión
-                        if (item['name'] == search_file_name or 
-                            item['name'] == f"{search_file_name}.pdf" or 
-                            item['name'] == f"{search_file_name}.docx" or 
-                            item['name'] == f"{search_file_name}.doc" or 
-                            item['name'] == f"{search_file_name}.odt" or 
-                            item['name'] == f"{search_file_name}.zip" or
-                            item['name'] == f"{search_file_name}.rar" or
-                            item['name'] == f"{search_file_name}.7z" or
-                            item['name'] == f"{search_file_name}.tar" or
-                            item['name'] == f"{search_file_name}.tar.gz" or
-                            item['name'] == f"{search_file_name}.tgz"):
+                    # Buscar por nombre exacto o con extensión
+                    for suffix in self.FOLDER_SEARCH_SUFFIXES:
+                        item = items_by_name.get(f"{search_file_name}{suffix}")
+                        if item:
                             file_id = item['id']
                             file_name = item['name']
+                            source_config = dict(source_config, mime_type=item.get('mimeType', ''))
                             logger.info(f"Found file: {file_name} (ID: {file_id})")
                             break
                     
                     if not file_id:
                         raise Exception(f"Archivo '{search_file_name}' no encontrado en la carpeta {folder_id}")
                 
+                # mimeType ya conocido por el listado de la carpeta (evita otra llamada a la API)
+                mime_type = source_config.get("mime_type")
+                
                 # Obtener información del archivo si no tenemos el nombre
                 if not file_name:
-                    # Usar lock para serializar llamadas a Google Drive API
-                    with self.gdrive_download_lock:
-                        file_info = self.gdrive_service.get_file_info(file_id)
+                    file_info = self.gdrive_service.get_file_info(file_id, fields='name, mimeType')
                     file_name = file_info.get('name', 'unknown_file')
+                    mime_type = mime_type or file_info.get('mimeType', '')
                 
-                logger.info(f"Downloading from GDrive: {file_name}")
-                file_path = os.path.join(temp_dir, file_name)
-                # Usar lock para serializar descargas de Google Drive (evitar rate limiting y colisiones)
-                with self.gdrive_download_lock:
-                    self.gdrive_service.download_file(file_id, file_path)
-                
-                # Determinar tipo por extensión o mimeType
+                # Determinar tipo por extensión o mimeType (antes de descargar: los .xsig no se descargan)
                 # Excluir explícitamente archivos .xsig
                 if file_name.lower().endswith('.xsig'):
                     logger.info(f"Archivo .xsig ignorado (no soportado): {file_name}")
                     return None  # Retornar None para indicar que debe ser ignorado
-                elif file_name.lower().endswith('.pdf'):
-                    file_type = "pdf"
-                elif file_name.lower().endswith(('.docx', '.doc', '.odt')):
-                    file_type = "docx"  # Usar "docx" como tipo genérico para todos los documentos de Word/ODT
-                elif file_name.lower().endswith(('.zip', '.rar', '.cbr', '.7z', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz')):
-                    file_type = "zip"  # Usar "zip" como tipo genérico para todos los archivos comprimidos
-                elif file_name.lower().endswith('.xml'):
-                    file_type = "xml"
-                elif file_name.lower().endswith('.eml'):
-                    file_type = "eml"
-                elif file_name.lower().endswith(self.IMAGE_EXTENSIONS):
-                    file_type = "image"
-                else:
+                file_type = self._detect_type(file_name)
+                if file_type is None:
                     # Intentar determinar por mimeType
-                    # Excluir explícitamente archivos .xsig
-                    if file_name.lower().endswith('.xsig'):
-                        logger.info(f"Archivo .xsig ignorado (no soportado): {file_name}")
-                        return None  # Retornar None para indicar que debe ser ignorado
-                    # Usar lock para serializar llamadas a Google Drive API
-                    with self.gdrive_download_lock:
-                        file_info = self.gdrive_service.get_file_info(file_id)
-                    mime_type = file_info.get('mimeType', '')
-                    if 'pdf' in mime_type:
-                        file_type = "pdf"
-                    elif 'word' in mime_type or 'docx' in mime_type or 'document' in mime_type or 'msword' in mime_type or 'opendocument.text' in mime_type:
-                        file_type = "docx"  # Usar "docx" como tipo genérico para todos los documentos de Word/ODT
-                    elif 'zip' in mime_type or 'rar' in mime_type or '7z' in mime_type or 'x-7z' in mime_type or 'tar' in mime_type or 'compressed' in mime_type or 'x-tar' in mime_type or 'x-rar' in mime_type:
-                        file_type = "zip"  # Usar "zip" como tipo genérico para todos los archivos comprimidos
-                    elif 'xml' in mime_type:
-                        # Verificar que no sea .xsig antes de clasificar como XML
-                        if not file_name.lower().endswith('.xsig'):
-                            file_type = "xml"
-                        else:
-                            logger.info(f"Archivo .xsig ignorado (no soportado): {file_name}")
-                            return None
-                    elif 'message' in mime_type or 'rfc822' in mime_type or 'eml' in mime_type:
-                        file_type = "eml"
-                    elif 'image/' in mime_type:
-                        file_type = "image"
+                    if mime_type is None:
+                        file_info = self.gdrive_service.get_file_info(file_id, fields='mimeType')
+                        mime_type = file_info.get('mimeType', '')
+                    file_type = self._detect_type_from_mime(mime_type)
+                
+                if local_path:
+                    # Archivo ya descargado por la etapa de descarga del pipeline
+                    file_path = local_path
+                elif file_data is not None or self._can_stream_pdf(file_name, initial_pages, final_pages):
+                    # PDF renderizable en memoria: se descarga a bytes sin pasar por disco
+                    if file_data is None:
+                        logger.info("Downloading from GDrive to memory: %s", file_name)
+                        file_data = self.gdrive_service.download_file_to_memory(file_id)
+                    file_path = file_name  # Solo se usa como nombre; el contenido va en file_data
+                elif file_type:
+                    logger.info("Downloading from GDrive: %s", file_name)
+                    temp_dir = self._new_temp_dir()
+                    file_path = os.path.join(temp_dir, file_name)
+                    # Cada hilo descarga con su propia conexión (ver GoogleDriveService._get_thread_http); los
+                    # errores de cuota se reintentan con backoff en _download_with_retry
+                    self.gdrive_service.download_file(file_id, file_path)
             
-            elif mode == "local":
+            elif mode in ("local", "upload"):
                 file_path = source_config.get("path")
-                if not file_path or not os.path.exists(file_path):
+                if mode == "local" and (not file_path or not os.path.exists(file_path)):
                     raise Exception(f"Archivo no encontrado: {file_path}")
-                # Excluir explícitamente archivos .xsig
-                if file_path.lower().endswith('.xsig'):
-                    logger.info(f"Archivo .xsig ignorado (no soportado): {os.path.basename(file_path)}")
-                    return None  # Retornar None para indicar que debe ser ignorado
-                elif file_path.lower().endswith('.pdf'):
-                    file_type = "pdf"
-                elif file_path.lower().endswith(('.docx', '.doc', '.odt')):
-                    file_type = "docx"  # Usar "docx" como tipo genérico para todos los documentos de Word/ODT
-                elif file_path.lower().endswith(('.zip', '.rar', '.cbr', '.7z', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz')):
-                    file_type = "zip"  # Usar "zip" como tipo genérico para todos los archivos comprimidos
-                elif file_path.lower().endswith('.xml'):
-                    file_type = "xml"
-                elif file_path.lower().endswith('.eml'):
-                    file_type = "eml"
-                elif file_path.lower().endswith(self.IMAGE_EXTENSIONS):
-                    file_type = "image"
-            
-            elif mode == "upload":
-                # En modo upload, el archivo ya está en file_path
-                file_path = source_config.get("path")
                 if not file_path:
+                    # En modo upload, el archivo ya está en file_path
                     raise Exception("path es requerido para modo upload")
                 # Excluir explícitamente archivos .xsig
                 if file_path.lower().endswith('.xsig'):
                     logger.info(f"Archivo .xsig ignorado (no soportado): {os.path.basename(file_path)}")
                     return None  # Retornar None para indicar que debe ser ignorado
-                elif file_path.lower().endswith('.pdf'):
-                    file_type = "pdf"
-                elif file_path.lower().endswith(('.docx', '.doc', '.odt')):
-                    file_type = "docx"  # Usar "docx" como tipo genérico para todos los documentos de Word/ODT
-                elif file_path.lower().endswith(('.zip', '.rar', '.cbr', '.7z', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz')):
-                    file_type = "zip"  # Usar "zip" como tipo genérico para todos los archivos comprimidos
-                elif file_path.lower().endswith('.xml'):
-                    file_type = "xml"
-                elif file_path.lower().endswith('.eml'):
-                    file_type = "eml"
-                elif file_path.lower().endswith(self.IMAGE_EXTENSIONS):
-                    file_type = "image"
+                file_type = self._detect_type(file_path)
             
             if not file_path or not file_type:
-                display_name = file_name or os.path.basename(file_path) if file_path else "unknown"
+                display_name = file_name or (os.path.basename(file_path) if file_path else "unknown")
                 logger.error(f"Could not determine file type for {display_name}")
                 raise Exception(f"No se pudo determinar el tipo de archivo para {display_name}")
             
-            logger.info(f"Detected file type: {file_type}")
+            logger.info("Detected file type: %s", file_type)
             
-            # Procesar según el tipo
+            # Procesar según el tipo (solo cambia el método y sus argumentos; el resultado se trata igual)
             if file_type == "pdf":
-                result = self.process_pdf(file_path, language, initial_pages, final_pages, max_tokens, temperature_vllm, top_p, top_k, vllm_model=vllm_model)
-                # Si el archivo está vacío, result será None y lo ignoramos
-                if result is None:
-                    logger.info(f"Archivo PDF vacío ignorado: {file_name or os.path.basename(file_path)}")
-                    return None  # Retornar None para indicar que debe ser ignorado
-                description = self._clean_description(result["description"])  # Limpiar comillas y backslashes
-                return DocumentResult(
-                    name=file_name or os.path.basename(file_path),
-                    title=result.get("title") or file_name or os.path.basename(file_path),
-                    description=description,
-                    type="pdf",
-                    path=source_config.get("path"),
-                    file_id=file_id if mode == "gdrive" else None,
-                    metadata=result.get("metadata", {})
-                )
+                result = self.process_pdf(file_path, language, initial_pages, final_pages, max_tokens, temperature_vllm, top_p, top_k, vllm_model=vllm_model, pdf_data=file_data, images=images)
             elif file_type == "docx":
-                result = self.process_docx(file_path, language, initial_pages, final_pages, max_tokens, temperature_vllm, top_p, top_k, vllm_model=vllm_model)
-                # Si el archivo está vacío, result será None y lo ignoramos
-                if result is None:
-                    file_ext = os.path.splitext(file_path)[1].lower()
-                    file_type_name = {"docx": "DOCX", "doc": "DOC", "odt": "ODT"}.get(file_ext[1:], "DOCUMENTO")
-                    logger.info(f"Archivo {file_type_name} vacío ignorado: {file_name or os.path.basename(file_path)}")
-                    return None  # Retornar None para indicar que debe ser ignorado
-                description = self._clean_description(result["description"])  # Limpiar comillas y backslashes
-                # Determinar el tipo real del archivo por su extensión
-                file_ext = os.path.splitext(file_path)[1].lower()
-                actual_type = file_ext[1:] if file_ext else "docx"  # "docx", "doc", o "odt"
-                return DocumentResult(
-                    name=file_name or os.path.basename(file_path),
-                    title=result.get("title") or file_name or os.path.basename(file_path),
-                    description=description,
-                    type=actual_type,
-                    path=source_config.get("path"),
-                    file_id=file_id if mode == "gdrive" else None,
-                    metadata=result.get("metadata", {})
-                )
+                result = self.process_docx(file_path, language, initial_pages, final_pages, max_tokens, temperature_vllm, top_p, top_k, vllm_model=vllm_model, images=images)
             elif file_type == "zip":
                 result = self.process_archive(file_path, language, initial_pages, final_pages, max_tokens, temperature_vllm, temperature_llm, top_p, top_k, vllm_model=vllm_model, llm_model=llm_model, no_think=no_think, max_inner_files=max_inner_files)
-                # Si el archivo comprimido está vacío, result será None y lo ignoramos
-                if result is None:
-                    archive_type = "ZIP" if file_path.lower().endswith('.zip') else "RAR" if file_path.lower().endswith(('.rar', '.cbr')) else "7Z" if file_path.lower().endswith('.7z') else "TAR"
-                    logger.info(f"Archivo {archive_type} vacío ignorado: {file_name or os.path.basename(file_path)}")
-                    return None  # Retornar None para indicar que debe ser ignorado
-                # Agregar file_id a los children si vienen de Google Drive
-                children = result.get("children", [])
-                if mode == "gdrive" and file_id and children:
-                    for child in children:
-                        # Los children de un ZIP no tienen file_id individual... pero el ZIP padre sí
-                        pass
-                
-                description = self._clean_description(result["description"])  # Limpiar comillas y backslashes
-                return DocumentResult(
-                    name=file_name or os.path.basename(file_path),
-                    title=result.get("title") or file_name or os.path.basename(file_path),
-                    description=description,
-                    type="zip",
-                    path=source_config.get("path"),
-                    file_id=file_id if mode == "gdrive" else None,
-                    children=children,
-                    metadata=result.get("metadata", {})
-                )
             elif file_type == "xml":
                 result = self.process_xml(file_path, language, max_tokens, temperature_llm, top_p, top_k, content_limit, llm_model=llm_model, no_think=no_think)
-                # Si el archivo está vacío, result será None y lo ignoramos
-                if result is None:
-                    logger.info(f"Archivo XML vacío ignorado: {file_name or os.path.basename(file_path)}")
-                    return None  # Retornar None para indicar que debe ser ignorado
-                description = self._clean_description(result["description"])  # Limpiar comillas y backslashes
-                return DocumentResult(
-                    name=file_name or os.path.basename(file_path),
-                    title=result.get("title") or file_name or os.path.basename(file_path),
-                    description=description,
-                    type="xml",
-                    path=source_config.get("path"),
-                    file_id=file_id if mode == "gdrive" else None,
-                    metadata=result.get("metadata", {})
-                )
             elif file_type == "eml":
                 result = self.process_eml(file_path, language, max_tokens, temperature_llm, top_p, top_k, content_limit, llm_model=llm_model, no_think=no_think)
-                # Si el archivo está vacío, result será None y lo ignoramos
-                if result is None:
-                    logger.info(f"Archivo EML vacío ignorado: {file_name or os.path.basename(file_path)}")
-                    return None  # Retornar None para indicar que debe ser ignorado
-                description = self._clean_description(result["description"])  # Limpiar comillas y backslashes
-                return DocumentResult(
-                    name=file_name or os.path.basename(file_path),
-                    title=result.get("title") or file_name or os.path.basename(file_path),
-                    description=description,
-                    type="eml",
-                    path=source_config.get("path"),
-                    file_id=file_id if mode == "gdrive" else None,
-                    metadata=result.get("metadata", {})
-                )
-            elif file_type == "image":
+            else:
                 result = self.process_image(file_path, language, max_tokens, temperature_vllm, top_p, top_k, vllm_model=vllm_model)
-                # Si el archivo está vacío, result será None y lo ignoramos
-                if result is None:
-                    logger.info(f"Archivo de imagen vacío ignorado: {file_name or os.path.basename(file_path)}")
-                    return None  # Retornar None para indicar que debe ser ignorado
-                description = self._clean_description(result["description"])  # Limpiar comillas y backslashes
-                return DocumentResult(
-                    name=file_name or os.path.basename(file_path),
-                    title=result.get("title") or file_name or os.path.basename(file_path),
-                    description=description,
-                    type="image",
-                    path=source_config.get("path"),
-                    file_id=file_id if mode == "gdrive" else None,
-                    metadata=result.get("metadata", {})
-                )
+            
+            display_name = file_name or os.path.basename(file_path)
+            file_ext = os.path.splitext(file_path)[1].lower()
+            
+            # Si el archivo está vacío, result será None y lo ignoramos
+            if result is None:
+                if file_type == "docx":
+                    type_label = {".docx": "DOCX", ".doc": "DOC", ".odt": "ODT"}.get(file_ext, "DOCUMENTO")
+                elif file_type == "zip":
+                    type_label = "ZIP" if file_ext == ".zip" else "RAR" if file_ext in ('.rar', '.cbr') else "7Z" if file_ext == ".7z" else "TAR"
+                else:
+                    type_label = {"pdf": "PDF", "xml": "XML", "eml": "EML", "image": "de imagen"}[file_type]
+                logger.info(f"Archivo {type_label} vacío ignorado: {display_name}")
+                return None  # Retornar None para indicar que debe ser ignorado
+            
+            # Word/ODT conservan su tipo real por extensión ("docx", "doc" u "odt")
+            result_type = (file_ext[1:] or "docx") if file_type == "docx" else file_type
+            return DocumentResult(
+                name=display_name,
+                title=result.get("title") or display_name,
+                description=self._clean_description(result["description"]),  # Limpiar comillas y backslashes
+                type=result_type,
+                path=source_config.get("path"),
+                file_id=file_id if mode == "gdrive" else None,
+                # Los children de un comprimido no tienen file_id individual... pero el comprimido padre sí
+                children=result.get("children", []) if file_type == "zip" else None,
+                metadata=result.get("metadata", {})
+            )
         finally:
-            shutil.rmtree(temp_dir, ignore_errors=True)
+            if temp_dir:
+                self._discard_temp_dir(temp_dir)
 
     def process_gdrive_folder(self, folder_id: str, folder_name: str, language: str = "es", initial_pages: int = 2, final_pages: int = 2, max_tokens: Optional[int] = None, temperature_vllm: Optional[float] = None, temperature_llm: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, max_inner_files: int = 0) -> ProcessFolderResponse:
         """Procesa todos los archivos PDF, DOCX/DOC/ODT, ZIP/RAR/TAR, XML y EML de una carpeta de Google Drive
@@ -1934,22 +2590,12 @@ Responde en {language_name}.
                 logger.info(f"⚠️  Se reintentarán {len(failed_files)} archivo(s) que fallaron anteriormente")
 
             # Actualizar la lista de pending_files en el checkpoint
-            checkpoint_service.checkpoint_data["pending_files"] = [f['id'] for f in pending_files]
-            checkpoint_service._save_checkpoint()
+            checkpoint_service.set_pending_files([f['id'] for f in pending_files])
 
             # Cargar resultados previos (includes ignored files just saved)
             previous_results = checkpoint_service.get_results()
-            results = []
-
             # Convertir resultados previos a DocumentResult
-            for prev_result in previous_results:
-                result_data = prev_result.get("result", {})
-                if isinstance(result_data, dict):
-                    try:
-                        doc_result = DocumentResult(**result_data)
-                        results.append(doc_result)
-                    except Exception as e:
-                        logger.warning(f"Error cargando resultado previo: {e}")
+            results = load_checkpoint_results(previous_results)
 
             all_files = pending_files
             if len(all_files) > 0:
@@ -1976,85 +2622,35 @@ Responde en {language_name}.
             "max_inner_files": max_inner_files
         }
         
-        # Procesar archivos
-        if batch_size > 1 and max_workers > 1:
-            # Procesamiento por batches con threading
-            logger.info(f"Procesando en batches de {batch_size} archivos con {max_workers} workers")
-            results.extend(self._process_files_batch_parallel(
-                all_files, source_config, checkpoint_service, batch_size, max_workers
-            ))
-        else:
-            # Procesamiento secuencial
-            for file_info in all_files:
-                try:
-                    result = self.process_file_from_source(
-                        source_config,
-                        file_id=file_info['id'],
-                        file_name=file_info['name']
+        # Sin archivos pendientes (p.ej. al retomar un checkpoint ya completo) no se monta el manifest
+        # ni los pools de workers: se pasa directamente a finalizar
+        if all_files:
+            # Los resultados nuevos se vuelcan a disco a medida que se generan (JSONL) en lugar de
+            # acumularse en memoria durante todo el procesamiento; se leen de vuelta al final
+            manifest_writer = ManifestWriter(folder_id)
+        
+            # Procesar archivos
+            try:
+                if batch_size > 1 and max_workers > 1:
+                    # Procesamiento por batches con threading
+                    logger.info(f"Procesando en batches de {batch_size} archivos con {max_workers} workers")
+                    self._process_files_batch_parallel(
+                        all_files, source_config, checkpoint_service, batch_size, max_workers, manifest_writer
                     )
-                    # Si el archivo está vacío, result será None y lo ignoramos
-                    if result is None:
-                        logger.info(f"Archivo vacío ignorado: {file_info['name']}")
-                        continue
-                    result.path = file_info['path']
-                    # Asegurar que el file_id esté presente
-                    if not result.file_id:
-                        result.file_id = file_info['id']
-                    
-                    # Verificar si la descripción indica error
-                    description = result.description or ""
-                    if self._is_error_description(description):
-                        # Marcar como fallido si la descripción indica error
-                        error_msg = f"Error en descripción: {description}"
-                        logger.error(f"Error en descripción para {file_info['name']}: {description}")
-                        if checkpoint_service:
-                            checkpoint_service.mark_file_failed(
-                                file_info['id'],
-                                file_info['name'],
-                                error_msg
-                            )
-                        # Cambiar el resultado a error
-                        result.description = error_msg
-                        result.metadata = result.metadata or {}
-                        result.metadata["error"] = True
-                    else:
-                        # Procesamiento exitoso
-                        if checkpoint_service:
-                            checkpoint_service.mark_file_processed(
-                                file_info['id'],
-                                file_info['name'],
-                                result.model_dump()
-                            )
-                    
-                    results.append(result)
-                    
-                    # Mostrar progreso periódicamente
-                    if checkpoint_service:
-                        progress = checkpoint_service.get_progress()
-                        if progress['processed'] % 10 == 0:  # Cada 10 archivos
-                            logger.info(f"Progreso: {progress['processed']}/{progress['total']} "
-                                      f"({progress['progress_percent']:.1f}%)")
-                except Exception as e:
-                    error_msg = f"Error al procesar: {str(e)}"
-                    logger.error(f"Error procesando {file_info['name']}: {e}")
-                    error_result = DocumentResult(
-                        name=file_info['name'],
-                        title=file_info['name'],  # Usar nombre como título en caso de error
-                        description=error_msg,
-                        type=file_info.get('mimeType', 'unknown'),
-                        path=file_info.get('path', ''),
-                        file_id=file_info['id'],
-                            metadata={"error": True}
+                else:
+                    # Pipeline descarga -> procesamiento (MAX_WORKERS hilos de procesamiento)
+                    logger.info(f"Procesando en pipeline con {max(1, max_workers)} worker(s)")
+                    self._process_files_pipeline(
+                        all_files, source_config, checkpoint_service, max(1, max_workers), manifest_writer
                     )
-                    results.append(error_result)
-                    
-                    # Actualizar checkpoint con error
-                    if checkpoint_service:
-                        checkpoint_service.mark_file_failed(
-                            file_info['id'],
-                            file_info['name'],
-                            str(e)
-                        )
+            except BaseException:
+                # Conservar en disco los resultados ya generados para poder inspeccionarlos tras el fallo
+                manifest_writer.close()
+                logger.error(f"Procesamiento interrumpido; {manifest_writer.count} resultado(s) parciales conservados en: {manifest_writer.path}")
+                raise
+        
+            results.extend(manifest_writer.read_results())
+            manifest_writer.remove()
         
         # Finalizar checkpoint
         if checkpoint_service:
@@ -2092,6 +2688,12 @@ Responde en {language_name}.
             # Obtener todos los archivos de nuevo para buscar paths (incluyendo ignorados)
             all_files_dict = {f['id']: f for f in all_files_all}
             
+            # Archivos fallidos que ya no están en la carpeta: consultar su info en una sola petición batch
+            missing_ids = [f.get("file_id") for f in failed_files if f.get("file_id") and f.get("file_id") not in all_files_dict]
+            missing_info = {}
+            if missing_ids and self.gdrive_service:
+                missing_info = self.gdrive_service.get_files_info(missing_ids, fields='name, mimeType')
+            
             for failed_file in failed_files:
                 file_id = failed_file.get("file_id")
                 file_name = failed_file.get("file_name", "unknown")
@@ -2099,19 +2701,16 @@ Responde en {language_name}.
                 # Buscar información del archivo en la lista original
                 file_info = all_files_dict.get(file_id)
                 
-                # Si no está en la lista, intentar obtenerlo de Google Drive
-                if not file_info and hasattr(self, 'gdrive_service') and self.gdrive_service:
-                    try:
-                        gdrive_info = self.gdrive_service.get_file_info(file_id)
-                        # Crear estructura similar a la de get_all_files_recursive
-                        file_info = {
-                            'id': file_id,
-                            'name': gdrive_info.get('name', file_name),
-                            'mimeType': gdrive_info.get('mimeType', 'unknown'),
-                            'path': ''  # No tenemos path sin recorrer la estructura
-                        }
-                    except Exception:
-                        file_info = None
+                # Si no está en la lista, usar la info obtenida de Google Drive
+                if not file_info and file_id in missing_info:
+                    gdrive_info = missing_info[file_id]
+                    # Crear estructura similar a la de get_all_files_recursive
+                    file_info = {
+                        'id': file_id,
+                        'name': gdrive_info.get('name', file_name),
+                        'mimeType': gdrive_info.get('mimeType', 'unknown'),
+                        'path': ''  # No tenemos path sin recorrer la estructura
+                    }
                 
                 # Determinar tipo de archivo
                 file_type = 'unknown'
@@ -2156,7 +2755,7 @@ Responde en {language_name}.
                 results.append(failed_result)
         
         # Ordenar resultados por ruta
-        results.sort(key=lambda x: x.path or "")
+        results.sort(key=result_path_key)
         
         return ProcessFolderResponse(
             folder_id=folder_id,
@@ -2166,103 +2765,346 @@ Responde en {language_name}.
             results=results
         )
     
-    def _process_files_batch_parallel(self, files: List[Dict], source_config: Dict, 
-                                     checkpoint_service: Optional[CheckpointService],
-                                     batch_size: int, max_workers: int) -> List[DocumentResult]:
-        """Procesa archivos en batches paralelos"""
-        results = []
-        results_lock = threading.Lock()
-        
-        def process_single_file(file_info: Dict) -> Optional[DocumentResult]:
-            """Procesa un solo archivo"""
-            try:
-                result = self.process_file_from_source(
-                    source_config,
-                    file_id=file_info['id'],
-                    file_name=file_info['name']
-                )
-                # Si el archivo está vacío, result será None y lo ignoramos
-                if result is None:
-                    logger.info(f"Archivo vacío ignorado: {file_info['name']}")
-                    return None  # Retornar None para indicar que debe ser ignorado
-                result.path = file_info['path']
-                # Asegurar que el file_id esté presente
-                if not result.file_id:
-                    result.file_id = file_info['id']
-                
-                # Verificar si la descripción indica error
-                description = result.description or ""
-                if self._is_error_description(description):
-                    # Marcar como fallido si la descripción indica error
-                    error_msg = f"Error en descripción: {description}"
-                    logger.error(f"Error en descripción para {file_info['name']}: {description}")
-                    if checkpoint_service:
-                        checkpoint_service.mark_file_failed(
-                            file_info['id'],
-                            file_info['name'],
-                            error_msg
-                        )
-                    # Cambiar el resultado a error
-                    result.description = error_msg
-                    result.metadata = result.metadata or {}
-                    result.metadata["error"] = True
-                else:
-                    # Procesamiento exitoso
-                    if checkpoint_service:
-                        checkpoint_service.mark_file_processed(
-                            file_info['id'],
-                            file_info['name'],
-                            result.model_dump()
-                        )
-                
-                return result
-            except Exception as e:
-                error_msg = f"Error al procesar: {str(e)}"
-                logger.error(f"Error procesando {file_info['name']}: {e}")
-                
-                error_result = DocumentResult(
-                    name=file_info['name'],
-                    title=file_info['name'], # Usar nombre como título en caso de error
-                    description=error_msg,
-                    type=file_info.get('mimeType', 'unknown'),
-                    path=file_info.get('path', ''),
-                    file_id=file_info.get('id'), # file_id del Google Drive
-                    metadata={"error": True}
-                )
-                
-                # Actualizar checkpoint con error
+    def _process_one(self, file_info: Dict, source_config: Dict,
+                     checkpoint_service: Optional[CheckpointService],
+                     local_path: Optional[str] = None,
+                     file_data: Optional[bytes] = None,
+                     images: Optional[List[Any]] = None) -> Optional[DocumentResult]:
+        """
+        Procesa un archivo de Google Drive de una carpeta y actualiza el checkpoint.
+
+        Común al pipeline y al procesamiento por batches. Nunca lanza excepciones: en caso de
+        error devuelve un DocumentResult de error. Devuelve None si el archivo está vacío.
+        """
+        try:
+            result = self.process_file_from_source(
+                dict(source_config, mime_type=file_info.get('mimeType', '')),
+                file_id=file_info['id'],
+                file_name=file_info['name'],
+                local_path=local_path,
+                file_data=file_data,
+                images=images
+            )
+            # Si el archivo está vacío, result será None y lo ignoramos
+            if result is None:
+                logger.info("Archivo vacío ignorado: %s", file_info['name'])
+                return None
+            result.path = file_info['path']
+            # Asegurar que el file_id esté presente
+            if not result.file_id:
+                result.file_id = file_info['id']
+            
+            # Verificar si la descripción indica error
+            description = result.description or ""
+            if self._is_error_description(description):
+                # Marcar como fallido si la descripción indica error
+                error_msg = f"Error en descripción: {description}"
+                logger.error("Error en descripción para %s: %s", file_info['name'], description)
                 if checkpoint_service:
                     checkpoint_service.mark_file_failed(
                         file_info['id'],
                         file_info['name'],
-                        str(e)
+                        error_msg
+                    )
+                # Cambiar el resultado a error
+                result.description = error_msg
+                result.metadata = result.metadata or {}
+                result.metadata["error"] = True
+            else:
+                # Procesamiento exitoso
+                if checkpoint_service:
+                    checkpoint_service.mark_file_processed(
+                        file_info['id'],
+                        file_info['name'],
+                        result.model_dump()
                     )
-                
-                return error_result
-        
-        # Procesar en batches
-        for i in range(0, len(files), batch_size):
-            batch = files[i:i + batch_size]
-            batch_num = (i // batch_size) + 1
-            total_batches = (len(files) + batch_size - 1) // batch_size
-            
-            logger.info(f"Procesando batch {batch_num}/{total_batches} ({len(batch)} archivos)")
             
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = {executor.submit(process_single_file, file_info): file_info 
-                          for file_info in batch}
+            return result
+        except Exception as e:
+            logger.error("Error procesando %s: %s", file_info['name'], e)
+            return self._file_error_result(file_info, e, checkpoint_service)
+
+    def _file_error_result(self, file_info: Dict, error: Union[Exception, str],
+                           checkpoint_service: Optional[CheckpointService]) -> DocumentResult:
+        """Construye el DocumentResult de error de un archivo y lo marca como fallido en el checkpoint"""
+        # Con errores frecuentes (p.ej. cuotas agotadas) este camino es caliente: el mensaje se obtiene una vez
+        message = error if isinstance(error, str) else str(error)
+        if checkpoint_service:
+            checkpoint_service.mark_file_failed(
+                file_info['id'],
+                file_info['name'],
+                message
+            )
+        return DocumentResult(
+            name=file_info['name'],
+            title=file_info['name'],  # Usar nombre como título en caso de error
+            description="Error al procesar: " + message,
+            type=file_info.get('mimeType', 'unknown'),
+            path=file_info.get('path', ''),
+            file_id=file_info.get('id'),  # file_id del Google Drive
+            metadata={"error": True}
+        )
+
+    def _process_files_pipeline(self, files: List[Dict], source_config: Dict,
+                                checkpoint_service: Optional[CheckpointService],
+                                max_workers: int, manifest_writer: ManifestWriter) -> None:
+        """
+        Procesa archivos de Google Drive en un pipeline de etapas: descarga -> renderizado -> procesamiento.
+
+        GDRIVE_DOWNLOAD_WORKERS hilos descargan en paralelo hacia una cola acotada (PIPELINE_PREFETCH),
+        PIPELINE_RENDER_WORKERS hilos convierten a imágenes las páginas de los PDFs descargados (CPU) y los
+        workers de procesamiento hacen la inferencia (GPU) y el resto de tipos de archivo. Así red, CPU y GPU
+        trabajan a la vez en archivos distintos en lugar de sumarse. Con PIPELINE_RENDER_WORKERS=0 no hay
+        etapa de renderizado y los PDFs se convierten en los workers de procesamiento.
+        Cada worker toma el siguiente archivo de la cola compartida en cuanto termina el anterior, así que
+        un archivo grande no retiene a los demás (no hay barrera por batch).
+        Cada resultado se escribe en manifest_writer en cuanto está disponible.
+
+        Si un worker falla (p.ej. sin espacio para el manifiesto) o se interrumpe el proceso (Ctrl+C), se
+        activa una señal de parada compartida: todas las etapas esperan en las colas con timeout y la consultan,
+        así que terminan en lugar de quedarse bloqueadas. Después se vacían las colas (borrando los directorios
+        temporales pendientes) y se relanza la primera excepción de los workers.
+        """
+        prefetch_size = max(1, int(os.getenv("PIPELINE_PREFETCH", "4")))
+        initial_pages = source_config.get("initial_pages", 2)
+        final_pages = source_config.get("final_pages", 2)
+        # Parámetros de la clave de la caché de PDFs (los mismos que usa process_file_from_source)
+        cache_params = (source_config.get("language", "es"), initial_pages, final_pages, source_config.get("max_tokens"),
+                        source_config.get("temperature_vllm"), source_config.get("top_p"), source_config.get("top_k"),
+                        source_config.get("vllm_model"))
+        download_queue = queue.Queue(maxsize=prefetch_size)
+        download_workers = max(1, min(len(files), int(os.getenv("GDRIVE_DOWNLOAD_WORKERS", "4"))))
+        render_workers = max(0, min(len(files), int(os.getenv("PIPELINE_RENDER_WORKERS", "2"))))
+        # Sin etapa de renderizado, los workers de procesamiento leen directamente de la cola de descargas
+        render_queue = queue.Queue(maxsize=prefetch_size) if render_workers else download_queue
+        pending_files = queue.Queue()
+        for file_info in files:
+            pending_files.put(file_info)
+        # Archivos terminados con éxito en esta ejecución; next() es atómico, así que no hace falta
+        # consultar el checkpoint (y tomar su lock) en cada archivo solo para decidir si se informa
+        succeeded = itertools.count(1)
+        stop = threading.Event()
+        # Excepciones de los workers por orden de llegada (list.append es atómico)
+        errors: List[BaseException] = []
+
+        def put(target: queue.Queue, item) -> bool:
+            """put() que deja de esperar si se ha pedido parar; devuelve False si el item no se encoló"""
+            while not stop.is_set():
+                try:
+                    target.put(item, timeout=_PIPELINE_POLL_SECONDS)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(source: queue.Queue):
+            """get() que deja de esperar si se ha pedido parar (devuelve None, igual que la marca de fin)"""
+            while not stop.is_set():
+                try:
+                    return source.get(timeout=_PIPELINE_POLL_SECONDS)
+                except queue.Empty:
+                    continue
+            return None
+
+        def run_stage(stage):
+            """Ejecuta una etapa; si falla, guarda la excepción y para todo el pipeline"""
+            try:
+                stage()
+            except BaseException as e:
+                logger.error("Worker del pipeline detenido por un error: %s", e, exc_info=True)
+                errors.append(e)
+                stop.set()
+
+        def download_stage():
+            """Etapa 1: descarga archivos pendientes a directorios temporales y los encola"""
+            while not stop.is_set():
+                try:
+                    file_info = pending_files.get_nowait()
+                except queue.Empty:
+                    return
+                temp_dir = local_path = file_data = None
+                download_error = None
+                try:
+                    # Las descargas usan una conexión por hilo: van en paralelo
+                    if self._can_stream_pdf(file_info['name'], initial_pages, final_pages):
+                        # PDFs renderizables en memoria: sin escribir ni releer de disco
+                        logger.info("Downloading from GDrive to memory: %s", file_info['name'])
+                        file_data = self.gdrive_service.download_file_to_memory(file_info['id'])
+                    else:
+                        temp_dir = self._new_temp_dir()
+                        local_path = os.path.join(temp_dir, file_info['name'])
+                        logger.info("Downloading from GDrive: %s", file_info['name'])
+                        self.gdrive_service.download_file(file_info['id'], local_path)
+                except Exception as e:
+                    download_error = e
+                # put() bloquea si la cola está llena: limita los archivos descargados pendientes
+                if not put(download_queue, (file_info, temp_dir, local_path, file_data, download_error, None)):
+                    if temp_dir:
+                        self._discard_temp_dir(temp_dir)
+                    return
+
+        def render_stage():
+            """Etapa 2: renderiza las páginas de los PDFs y documentos Word/ODT descargados; el resto pasa sin cambios"""
+            while True:
+                item = get(download_queue)
+                if item is None:
+                    break
+                file_info, temp_dir, local_path, file_data, download_error, images = item
+                pdf_source = file_data if file_data is not None else local_path
+                if not download_error and file_info['name'].lower().endswith('.pdf') and pdf_source:
+                    try:
+                        # Un PDF ya cacheado (o que otro worker está analizando) no necesita imágenes:
+                        # process_pdf devolverá el resultado sin renderizar
+                        if self._pdf_result_known(self._pdf_cache_key(pdf_source, *cache_params)):
+                            logger.info("PDF con contenido ya procesado, sin renderizar: %s", file_info['name'])
+                        elif (len(file_data) if file_data is not None else os.path.getsize(local_path)) > 0:
+                            logger.info("Converting PDF to images: %s", file_info['name'])
+                            images = self._render_pdf(pdf_source, initial_pages, final_pages)
+                    except Exception as e:
+                        # process_pdf lo reintentará y generará el resultado de error correspondiente
+                        logger.warning("Error renderizando %s en el pipeline: %s", file_info['name'], e)
+                        images = None
+                elif not download_error and local_path and self._detect_type(file_info['name']) == "docx":
+                    # La conversión con LibreOffice (CPU, segundos por documento) también se solapa con la inferencia;
+                    # su PDF intermedio queda en el directorio temporal de la descarga
+                    try:
+                        if os.path.getsize(local_path) > 0:
+                            logger.info("Converting document to images: %s", file_info['name'])
+                            images = self.docx_processor.convert_to_images(local_path, temp_dir, initial_pages, final_pages)
+                    except Exception as e:
+                        # process_docx lo reintentará y generará el resultado de error correspondiente
+                        logger.warning("Error convirtiendo %s en el pipeline: %s", file_info['name'], e)
+                        images = None
+                if not put(render_queue, (file_info, temp_dir, local_path, file_data, download_error, images)):
+                    if temp_dir:
+                        self._discard_temp_dir(temp_dir)
+                    return
+
+        def process_stage():
+            """Etapa 3: procesa los archivos (inferencia) y actualiza el checkpoint"""
+            while True:
+                item = get(render_queue)
+                if item is None:
+                    break
+                file_info, temp_dir, local_path, file_data, download_error, images = item
+                try:
+                    if download_error:
+                        logger.error("Error procesando %s: %s", file_info['name'], download_error)
+                        result = self._file_error_result(file_info, download_error, checkpoint_service)
+                    else:
+                        result = self._process_one(file_info, source_config, checkpoint_service,
+                                                   local_path=local_path, file_data=file_data, images=images)
+                finally:
+                    if temp_dir:
+                        self._discard_temp_dir(temp_dir)
+                if result is None:
+                    continue
+                manifest_writer.write(result)
                 
-                for future in as_completed(futures):
-                    result = future.result()
-                    if result:
-                        with results_lock:
-                            results.append(result)
-            
-            # Mostrar progreso después de cada batch
-            if checkpoint_service:
-                progress = checkpoint_service.get_progress()
-                logger.info(f"Progreso total: {progress['processed']}/{progress['total']} "
-                          f"({progress['progress_percent']:.1f}%)")
+                # Mostrar progreso periódicamente
+                if checkpoint_service and not (result.metadata or {}).get("error"):
+                    if next(succeeded) % 10 == 0:  # Cada 10 archivos
+                        progress = checkpoint_service.get_progress()
+                        logger.info("Progreso: %d/%d (%.1f%%)", progress['processed'],
+                                    progress['total'], progress['progress_percent'])
+
+        try:
+            with ThreadPoolExecutor(max_workers=download_workers + render_workers + max_workers) as executor:
+                download_futures = [executor.submit(run_stage, download_stage) for _ in range(download_workers)]
+                render_futures = [executor.submit(run_stage, render_stage) for _ in range(render_workers)]
+                process_futures = [executor.submit(run_stage, process_stage) for _ in range(max_workers)]
+                try:
+                    for future in download_futures:
+                        future.result()
+                    # Una marca de fin por worker de la etapa siguiente
+                    for _ in range(render_workers):
+                        put(download_queue, None)
+                    for future in render_futures:
+                        future.result()
+                    for _ in range(max_workers):
+                        put(render_queue, None)
+                    for future in process_futures:
+                        future.result()
+                except BaseException:
+                    # Ctrl+C en el hilo principal: los workers terminan su archivo actual y salen
+                    stop.set()
+                    raise
+        finally:
+            # Archivos descargados que no llegaron a procesarse (pipeline detenido)
+            for pending_queue in ((download_queue,) if render_queue is download_queue else (download_queue, render_queue)):
+                while True:
+                    try:
+                        item = pending_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None and item[1]:
+                        self._discard_temp_dir(item[1])
+        if errors:
+            raise errors[0]
+
+    def _process_files_batch_parallel(self, files: List[Dict], source_config: Dict, 
+                                     checkpoint_service: Optional[CheckpointService],
+                                     batch_size: int, max_workers: int, manifest_writer: ManifestWriter) -> None:
+        """Procesa archivos en batches paralelos, escribiendo cada resultado en manifest_writer
+
+        Un solo pool para toda la carpeta: los workers no se recrean en cada batch y un batch no espera
+        al más lento del anterior. El batch queda como unidad de informe de progreso.
+
+        Con ADAPTIVE_WORKERS_BETA > 0, MAX_WORKERS es solo el máximo: el número de archivos en vuelo se
+        ajusta según la fracción del tiempo que los workers pasan bloqueados (β = 1 - CPU/pared). Si β
+        supera el umbral (esperando a Drive o al modelo) se admite un archivo más; si no, uno menos.
+
+        Cada future se publica al terminar en una cola (add_done_callback) que el hilo principal consume;
+        así no se vuelve a registrar un waiter en todos los futures en vuelo por cada archivo terminado.
+        """
+        total_batches = (len(files) + batch_size - 1) // batch_size
+        beta_threshold = self._adaptive_workers_beta
+        in_flight_limit = max(1, max_workers // 2) if beta_threshold > 0 else max_workers
+        # (tiempo de pared, tiempo de CPU del hilo) de los últimos archivos terminados
+        samples = deque(maxlen=max(4, max_workers * 2))
+
+        def timed_process(file_info: Dict) -> Tuple[Optional[DocumentResult], float, float]:
+            wall_start, cpu_start = time.perf_counter(), time.thread_time()
+            result = self._process_one(file_info, source_config, checkpoint_service)
+            return result, time.perf_counter() - wall_start, time.thread_time() - cpu_start
+
+        done_queue = queue.SimpleQueue()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = 0
+            next_index = 0
+            completed = 0
+            while in_flight or next_index < len(files):
+                while next_index < len(files) and in_flight < in_flight_limit:
+                    executor.submit(timed_process, files[next_index]).add_done_callback(done_queue.put)
+                    next_index += 1
+                    in_flight += 1
+                
+                future = done_queue.get()
+                in_flight -= 1
+                completed += 1
+                result, wall_time, cpu_time = future.result()
+                samples.append((wall_time, cpu_time))
+                if result:
+                    manifest_writer.write(result)
+                
+                # Mostrar progreso cada batch_size archivos terminados
+                if completed % batch_size == 0 or completed == len(files):
+                    batch_num = (completed + batch_size - 1) // batch_size
+                    logger.info(f"Batch {batch_num}/{total_batches} completado ({completed}/{len(files)} archivos)")
+                    if checkpoint_service:
+                        # Una transacción del diario por batch (CHECKPOINT_JOURNAL_BATCH)
+                        checkpoint_service.flush_journal()
+                        progress = checkpoint_service.get_progress()
+                        logger.info(f"Progreso total: {progress['processed']}/{progress['total']} "
+                                  f"({progress['progress_percent']:.1f}%)")
+                
+                if beta_threshold > 0:
+                    total_wall = sum(wall for wall, _ in samples)
+                    beta = 1 - sum(cpu for _, cpu in samples) / total_wall if total_wall > 0 else 1.0
+                    new_limit = in_flight_limit + 1 if beta > beta_threshold else in_flight_limit - 1
+                    new_limit = max(1, min(max_workers, new_limit))
+                    if new_limit != in_flight_limit:
+                        logger.debug("β=%.2f: archivos en vuelo %d -> %d", beta, in_flight_limit, new_limit)
+                        in_flight_limit = new_limit
         
-        return results
 
@@ -0,0 +1,84 @@
+"""
+Caché persistente de resultados (SQLite)
+Conserva entre ejecuciones los resultados de documentos ya analizados, indexados por hash de contenido
+"""
+import json
+import sqlite3
+import threading
+import time
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """Almacén clave-valor en SQLite con caducidad, compartido por todos los hilos del procesador"""
+
+    def __init__(self, path: str, ttl_seconds: float = 0):
+        """
+        Abre (o crea) la base de datos de la caché
+
+        Args:
+            path: Ruta del fichero SQLite
+            ttl_seconds: Antigüedad máxima de una entrada en segundos (0 = sin caducidad)
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)")
+        self._conn.commit()
+        if ttl_seconds > 0:
+            self._purge_expired()
+        logger.info(f"Caché persistente de resultados: {path}")
+
+    @staticmethod
+    def make_key(parts: tuple) -> str:
+        """Convierte una tupla (hash de contenido + configuración) en una clave estable entre ejecuciones"""
+        return hashlib.blake2b(json.dumps(parts, default=str).encode('utf-8'), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Devuelve el resultado guardado para key, o None si no existe o ha caducado"""
+        try:
+            with self.lock:
+                row = self._conn.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Error leyendo la caché persistente: {e}")
+            return None
+        if row is None:
+            return None
+        value, created_at = row
+        if self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds:
+            return None
+        return json.loads(value)
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        """Guarda (o reemplaza) el resultado de key"""
+        try:
+            with self.lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False, default=str), time.time())
+                )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Error escribiendo en la caché persistente: {e}")
+
+    def _purge_expired(self):
+        """Elimina las entradas caducadas al abrir la caché"""
+        with self.lock:
+            deleted = self._conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl_seconds,)).rowcount
+            self._conn.commit()
+        if deleted:
+            logger.info(f"Caché persistente: {deleted} entradas caducadas eliminadas")
+
+    def close(self):
+        """Cierra la conexión a la base de datos"""
+        with self.lock:
+            self._conn.close()
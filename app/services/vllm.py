@@ -1,17 +1,66 @@
 import os
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 import base64
-from typing import List, Tuple, Optional
+import io
+from typing import List, Tuple, Optional, Union
+from PIL import Image
 import logging
 import json
 
+try:
+    import orjson  # Serializa la petición y parsea la respuesta del modelo bastante más rápido que json
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+
+def encode_jpeg(image: Image.Image, max_dim: int, quality: int) -> bytes:
+    """Reduce una imagen PIL a max_dim px de lado (0 = sin redimensionar) y la codifica como JPEG en memoria
+
+    Función de módulo para poder ejecutarla en un ProcessPoolExecutor junto al renderizado.
+    """
+    if max_dim > 0 and max(image.size) > max_dim:
+        image = image.copy()
+        image.thumbnail((max_dim, max_dim), Image.LANCZOS)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=quality, optimize=True)
+    return buffered.getvalue()
+
+
 class VLLMService:
     def __init__(self, model: str = None):
         self.api_url = os.getenv("MODEL_API_URL", "http://localhost:11434/v1/chat/completions")
         self.api_token = os.getenv("MODEL_API_TOKEN", None)
         self.model = model or os.getenv("VLLM_MODEL", "mistralai/Mistral-Small-3.2-24B-Instruct-2506")
+        # Lado máximo (px) de las imágenes enviadas al modelo (0 = sin redimensionar) y calidad JPEG
+        self.image_max_dim = int(os.getenv("VLLM_IMAGE_MAX_DIM", "1540"))
+        self.image_quality = int(os.getenv("VLLM_IMAGE_QUALITY", "80"))
+        self.session = self._shared_session()
+
+    # Sesión HTTP única por proceso, compartida por todas las instancias (p.ej. varios DocumentProcessor)
+    _session: Optional[requests.Session] = None
+    _session_lock = threading.Lock()
+
+    @classmethod
+    def _shared_session(cls) -> requests.Session:
+        """Sesión con keep-alive compartida por todas las instancias del proceso
+
+        Las peticiones concurrentes reutilizan conexiones (y el handshake TLS) en lugar de abrir una por
+        petición. El pool admite tantas conexiones como inferencias concurrentes permite el procesador.
+        """
+        with cls._session_lock:
+            if cls._session is None:
+                adapter = HTTPAdapter(pool_maxsize=int(os.getenv("MAX_CONCURRENT_INFERENCE", "16")))
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                cls._session = session
+            return cls._session
 
     # Mapping of file extensions to MIME types for image encoding
     IMAGE_MIME_TYPES = {
@@ -25,21 +74,50 @@ class VLLMService:
         '.tif': 'image/tiff'
     }
 
-    def _encode_image(self, image_path: str) -> Tuple[str, str]:
+    def _encode_pil_image(self, image: Image.Image) -> str:
+        """Downscale a PIL image to VLLM_IMAGE_MAX_DIM and encode it as base64 JPEG.
+
+        Larger images are downsampled by the vision encoder anyway, so sending them
+        at full size only wastes upload bandwidth and image tokens.
+        """
+        base64_data = base64.b64encode(encode_jpeg(image, self.image_max_dim, self.image_quality)).decode('utf-8')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Image encoded: {image.size[0]}x{image.size[1]}, {len(base64_data)} bytes base64")
+        return base64_data
+
+    def _encode_image(self, image: Union[str, bytes, Image.Image]) -> Tuple[str, str]:
         """Encode image to base64 and return with correct MIME type.
 
+        Accepts a path to an image file, an in-memory PIL image (encoded as JPEG
+        without touching the disk) or JPEG bytes already encoded with encode_jpeg
+        (e.g. by the PDF render pool), which are only base64-encoded.
+
         Returns:
             Tuple of (base64_data, mime_type)
         """
-        with open(image_path, "rb") as f:
+        if isinstance(image, (bytes, bytearray)):
+            return base64.b64encode(image).decode('utf-8'), 'image/jpeg'
+        if not isinstance(image, str):
+            return self._encode_pil_image(image), 'image/jpeg'
+
+        # Imágenes en disco demasiado grandes: redimensionar antes de enviarlas
+        if self.image_max_dim > 0:
+            try:
+                with Image.open(image) as img:
+                    if max(img.size) > self.image_max_dim:
+                        return self._encode_pil_image(img), 'image/jpeg'
+            except Exception as e:
+                logger.warning(f"Could not inspect image {os.path.basename(image)} for downscaling: {e}")
+
+        with open(image, "rb") as f:
             base64_data = base64.b64encode(f.read()).decode('utf-8')
 
-        ext = os.path.splitext(image_path)[1].lower()
+        ext = os.path.splitext(image)[1].lower()
         mime_type = self.IMAGE_MIME_TYPES.get(ext, 'image/jpeg')
 
         return base64_data, mime_type
 
-    def analyze_vllm(self, image_paths: List[str], prompt: str, max_tokens: Optional[int] = None, schema: dict = None, temperature: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, model: Optional[str] = None) -> str:
+    def analyze_vllm(self, image_paths: List[Union[str, bytes, Image.Image]], prompt: str, max_tokens: Optional[int] = None, schema: dict = None, temperature: Optional[float] = None, top_p: Optional[float] = None, top_k: Optional[int] = None, model: Optional[str] = None) -> str:
         """Servicio específico para procesamiento multimodal (VLLM)"""
         # Usar el modelo proporcionado o el modelo por defecto de la instancia
         model_to_use = model or self.model
@@ -114,10 +192,13 @@ CRITICAL - Output rules:
                 logger.warning("No API token configured for VLLM (MODEL_API_TOKEN not set)")
             
             logger.info(f"Sending VLLM request to {self.api_url}")
-            response = requests.post(self.api_url, json=payload, headers=headers)
+            # Con orjson el cuerpo (imágenes en base64, varios MB) se serializa bastante más rápido
+            body = orjson.dumps(payload) if orjson is not None else json.dumps(payload).encode('utf-8')
+            # 10s para conectar, 300s para leer la respuesta (varias imágenes con el servidor cargado)
+            response = self.session.post(self.api_url, data=body, headers=headers, timeout=(10, 300))
             response.raise_for_status()
             
-            resp_json = response.json()
+            resp_json = orjson.loads(response.content) if orjson is not None else response.json()
             content = resp_json["choices"][0]["message"]["content"]
             
             if content is None:
@@ -1,14 +1,23 @@
 """
 Servicio para procesar archivos XML y EML
 """
+import io
 import os
+import re
 import email
 import xml.etree.ElementTree as ET
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+# Limpieza previa al truncado: el espacio en blanco repetido, los comentarios y el DOCTYPE solo gastan tokens
+_WHITESPACE_RE = re.compile(r'\s+')
+_INLINE_WHITESPACE_RE = re.compile(r'[^\S\n]+')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n')
+_XML_NOISE_RE = re.compile(r'<!--[\s\S]*?-->|<!DOCTYPE[^>]*>', re.IGNORECASE)
+
 
 class XMLEMLProcessor:
     """Procesador para archivos XML y EML"""
@@ -32,18 +41,19 @@ class XMLEMLProcessor:
         'Transforms'
     ]
     
-    def process_xml(self, xml_path: str) -> str:
+    def process_xml(self, xml_path: str, data: Optional[bytes] = None) -> str:
         """
         Extrae el contenido de texto de un archivo XML, ignorando elementos de firma digital
         
         Args:
             xml_path: Ruta al archivo XML
+            data: Contenido del XML en memoria (opcional; si se pasa, no se lee xml_path)
             
         Returns:
             Texto extraído del XML
         """
         try:
-            tree = ET.parse(xml_path)
+            tree = ET.parse(io.BytesIO(data) if data is not None else xml_path)
             root = tree.getroot()
             
             # Extraer todo el texto del XML
@@ -88,35 +98,42 @@ class XMLEMLProcessor:
             # Si el texto es muy largo, tomar las primeras líneas
             lines = extracted_text.split('\n')
             if len(lines) > 100:
-                extracted_text = '\n'.join(lines[:100]) + "\n[... contenido truncado ...]"
+                extracted_text = '\n'.join(lines[:100]) + " [... contenido truncado ...]"
             
-            return extracted_text
+            return _WHITESPACE_RE.sub(' ', extracted_text).strip()
         except ET.ParseError as e:
             logger.warning(f"Error parseando XML: {e}. Intentando leer como texto plano...")
             # Si falla el parseo, leer como texto plano
-            with open(xml_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-                # Limitar tamaño
-                if len(content) > 10000:
-                    return content[:10000] + "\n[... contenido truncado ...]"
-                return content
+            if data is not None:
+                raw = data.decode('utf-8', errors='ignore')
+            else:
+                with open(xml_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    raw = f.read()
+            content = _WHITESPACE_RE.sub(' ', _XML_NOISE_RE.sub('', raw)).strip()
+            # Limitar tamaño
+            if len(content) > 10000:
+                return content[:10000] + "\n[... contenido truncado ...]"
+            return content
         except Exception as e:
             logger.error(f"Error procesando XML {xml_path}: {e}")
             return ""
     
-    def process_eml(self, eml_path: str) -> str:
+    def process_eml(self, eml_path: str, data: Optional[bytes] = None) -> str:
         """
         Extrae el contenido de un archivo EML (email)
         
         Args:
             eml_path: Ruta al archivo EML
+            data: Contenido del EML en memoria (opcional; si se pasa, no se lee eml_path)
             
         Returns:
             Texto extraído del email (asunto, remitente, cuerpo)
         """
         try:
-            with open(eml_path, 'rb') as f:
-                msg = email.message_from_bytes(f.read())
+            if data is None:
+                with open(eml_path, 'rb') as f:
+                    data = f.read()
+            msg = email.message_from_bytes(data)
             
             # Extraer información del email
             parts = []
@@ -144,6 +161,8 @@ class XMLEMLProcessor:
             # Cuerpo del mensaje
             body = self._extract_email_body(msg)
             if body:
+                # Compactar espacios y líneas en blanco antes de truncar (caben más palabras útiles)
+                body = _BLANK_LINES_RE.sub('\n', _INLINE_WHITESPACE_RE.sub(' ', body)).strip()
                 # Limitar tamaño del cuerpo
                 if len(body) > 5000:
                     body = body[:5000] + "\n[... contenido truncado ...]"
@@ -154,11 +173,14 @@ class XMLEMLProcessor:
             logger.error(f"Error procesando EML {eml_path}: {e}")
             # Si falla, intentar leer como texto plano
             try:
-                with open(eml_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                    if len(content) > 10000:
-                        return content[:10000] + "\n[... contenido truncado ...]"
-                    return content
+                if data is not None:
+                    content = data.decode('utf-8', errors='ignore')
+                else:
+                    with open(eml_path, 'r', encoding='utf-8', errors='ignore') as f:
+                        content = f.read()
+                if len(content) > 10000:
+                    return content[:10000] + "\n[... contenido truncado ...]"
+                return content
             except:
                 return ""
     
@@ -185,10 +207,8 @@ class XMLEMLProcessor:
                         if payload:
                             charset = part.get_content_charset() or 'utf-8'
                             html_body = payload.decode(charset, errors='ignore')
-                            # Intentar extraer texto del HTML (simple)
-                            import re
-                            # Remover tags HTML básicos
-                            text_body = re.sub(r'<[^>]+>', '', html_body)
+                            # Intentar extraer texto del HTML (simple): remover tags HTML básicos
+                            text_body = _HTML_TAG_RE.sub('', html_body)
                             body = text_body.strip()
                             break
                     except Exception as e:
@@ -205,3 +225,13 @@ class XMLEMLProcessor:
         
         return body
 
+
+
+def extract_xml_text(xml_path: str, data: Optional[bytes] = None) -> str:
+    """Extrae el texto de un XML; función de módulo para poder ejecutarla en un ProcessPoolExecutor"""
+    return XMLEMLProcessor().process_xml(xml_path, data)
+
+
+def extract_eml_text(eml_path: str, data: Optional[bytes] = None) -> str:
+    """Extrae el contenido de un EML; función de módulo para poder ejecutarla en un ProcessPoolExecutor"""
+    return XMLEMLProcessor().process_eml(eml_path, data)